@@ -0,0 +1,68 @@
+"""
+Compare the cache codecs on a sample of the existing scraping and generation caches.
+
+For every payload kind (listing pages, completions) the report shows the
+compression ratio and the encode/decode throughput of each codec. The zstd
+dictionary is trained on one half of the sample and evaluated on the other.
+
+    python -m benchmarks.cache_codecs --samples 1000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from src.common import cached_generation, cached_request, codecs, config
+
+
+def run(name: str, samples: List[bytes]):
+    if len(samples) < 2:
+        print(f"{name}: not enough cached entries")
+        return
+
+    train, test = samples[::2], samples[1::2]
+    raw_size = sum(map(len, test))
+    variants = [
+        ("stored", codecs.Codec.STORED, None),
+        ("gzip", codecs.Codec.GZIP, None),
+    ]
+    if codecs.zstandard is not None:
+        codecs.train_dictionary(name, train)
+        variants += [
+            ("zstd", codecs.Codec.ZSTD, None),
+            ("zstd+dict", codecs.Codec.ZSTD, name),
+        ]
+
+    print(f"{name}: {len(test)} entries, {raw_size / 1e6:.1f} MB")
+    print(f"  {'codec':<10} {'ratio':>7} {'encode MB/s':>12} {'decode MB/s':>12}")
+    for label, codec, dictionary in variants:
+        start = time.perf_counter()
+        blobs = [codecs.encode(s, codec, dictionary) for s in test]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for blob in blobs:
+            codecs.decode(blob)
+        decode_time = time.perf_counter() - start
+
+        ratio = raw_size / sum(map(len, blobs))
+        print(
+            f"  {label:<10} {ratio:>7.2f} {raw_size / 1e6 / encode_time:>12.1f}"
+            f" {raw_size / 1e6 / decode_time:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cache codecs.")
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    listing_samples = cached_request.sample_entries(args.samples, b"<")
+    completion_samples = cached_generation.sample_entries(args.samples)
+
+    # Train the benchmark dictionaries without replacing the real ones
+    config.ZSTD_DICT_DIR = Path(tempfile.mkdtemp())
+    run("listing", listing_samples)
+    run("completion", completion_samples)
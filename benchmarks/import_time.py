@@ -0,0 +1,91 @@
+"""
+Measure the cold-start import time of the pipeline packages.
+
+The packages are imported in a fresh interpreter with ``python -X importtime``.
+The report lists the slowest modules by cumulative time, and the run fails if
+the total exceeds the budget or if one of the heavy modules that should only be
+imported by the stages using them (openai, pymupdf, spacy, lxml) is imported.
+
+    python -m benchmarks.import_time --budget 800
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import List, Tuple
+
+PACKAGES = ("src.scraping", "src.labeling", "src.augmentation")
+HEAVY_MODULES = ("openai", "pymupdf", "fitz", "spacy", "lxml")
+
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+project_dir = Path(__file__).resolve().parent.parent
+
+
+def measure() -> List[Tuple[str, int, int, int]]:
+    """
+    Import the packages in a fresh interpreter and return the (module, self µs,
+    cumulative µs, nesting depth) entries of every imported module.
+    """
+    # An empty working directory without .env, and no credentials
+    env = {k: v for k, v in os.environ.items() if not k.endswith("_API_KEY")}
+    env["PYTHONPATH"] = str(project_dir)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    with tempfile.TemporaryDirectory() as cwd:
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {', '.join(PACKAGES)}"],
+            cwd=cwd,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if process.returncode != 0:
+        sys.exit(f"Importing the packages failed:\n{process.stderr}")
+
+    entries = []
+    for line in process.stderr.splitlines():
+        if match := IMPORTTIME_PATTERN.match(line):
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--budget", type=float, default=800, help="Maximum total import time in ms."
+    )
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    entries = measure()
+    total_ms = sum(self_us for _, self_us, _, _ in entries) / 1000
+    modules = {module for module, _, _, _ in entries}
+
+    print(f"Imported {len(modules)} modules in {total_ms:.0f} ms")
+    print(f"  {'module':<50} {'cumulative ms':>14}")
+    top_level = sorted(
+        (e for e in entries if e[3] == 0), key=lambda e: e[2], reverse=True
+    )
+    for module, _, cumulative_us, _ in top_level[: args.top]:
+        print(f"  {module:<50} {cumulative_us / 1000:>14.1f}")
+
+    heavy = sorted(
+        {m.split(".")[0] for m in modules if m.split(".")[0] in HEAVY_MODULES}
+    )
+    failures = []
+    if heavy:
+        failures.append(f"heavy modules imported at package import: {heavy}")
+    if total_ms > args.budget:
+        failures.append(f"total of {total_ms:.0f} ms exceeds {args.budget:.0f} ms")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
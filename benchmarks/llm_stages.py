@@ -0,0 +1,195 @@
+"""
+Run label_docs and create_augmentations end to end against the local OpenAI stub.
+
+For every concurrency setting, a worker process gets a fresh data and cache
+directory with a synthetic corpus, serves an ``OpenAIStub`` (see
+``benchmarks.openai_stub``) from a background thread and runs both stages
+against it with a cold generation cache. The report shows the throughput, the
+p50/p99 latency of the LLM calls (from the telemetry records) and the lag of
+the event loop, sampled every 10 ms while the stages run. ``--chunk-chars``
+enables the chunked augmentation of long facts.
+
+    python -m benchmarks.llm_stages --documents 200 --concurrency 1 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import List
+
+from benchmarks import openai_stub
+
+WORDS = (
+    "der Kläger verlangt von der Beklagten Schadensersatz wegen eines Unfalls "
+    "das Berufungsgericht hat die Klage abgewiesen und die Revision zugelassen "
+    "den Kläger trifft ein Mitverschulden an dem Vertrag des Klägers über die "
+    "Lieferung einer Maschine im Jahr gegen Zahlung eines Kaufpreises"
+).split()
+LAG_INTERVAL = 0.01
+
+
+def synthetic_documents(n: int, seed: int = 0) -> List[dict]:
+    """
+    Parsed documents with facts of typical lengths (2k to 20k characters).
+    """
+    rng = random.Random(seed)
+
+    def text(n_chars: int) -> str:
+        sentences, size = [], 0
+        while size < n_chars:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 25))]
+            sentence = " ".join(words).capitalize() + "."
+            sentences.append(sentence)
+            size += len(sentence) + 1
+        return " ".join(sentences)
+
+    return [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "year": 2020,
+            "case_number": f"VI ZR {i}/20",
+            "url": f"https://example.org/{i}",
+            "text": "",
+            "facts": text(rng.randint(2_000, 20_000)),
+            "operative": text(rng.randint(200, 1_000)),
+        }
+        for i in range(n)
+    ]
+
+
+async def _monitor_lag(samples: List[float]):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(time.perf_counter() - started - LAG_INTERVAL)
+
+
+async def _run_stage(name: str, stage, concurrency: int) -> dict:
+    from src.common import telemetry
+
+    lag: List[float] = []
+    monitor = asyncio.create_task(_monitor_lag(lag))
+    started = time.perf_counter()
+    with telemetry.run() as records:
+        results = await stage(concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+
+    latencies = sorted(
+        r["wall_time"] for r in records if r.get("stage") == name and not r["cache_hit"]
+    )
+    return {
+        "stage": name,
+        "documents": len(results),
+        "calls": len(latencies),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else None,
+        "p99": latencies[math.ceil(0.99 * len(latencies)) - 1] if latencies else None,
+        "lag_p50": statistics.median(lag) if lag else None,
+        "lag_max": max(lag) if lag else None,
+    }
+
+
+def worker(args: argparse.Namespace):
+    """
+    Run both stages in this process, against a stub served from a thread.
+    """
+    url, stub = openai_stub.start_in_thread(**openai_stub.stub_options(args))
+    os.environ["OPENAI_BASE_URL"] = url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    from src.augmentation import create_augmentations
+    from src.common import config
+    from src.labeling import label_docs
+
+    config.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    config.DOCS_PARSED_JSONL.write_text(
+        "\n".join(map(json.dumps, synthetic_documents(args.documents))),
+        encoding="utf-8",
+    )
+
+    async def run():
+        return [
+            await _run_stage("label_docs", label_docs, args.concurrency),
+            await _run_stage(
+                "create_augmentations",
+                partial(create_augmentations, chunk_chars=args.chunk_chars),
+                args.concurrency,
+            ),
+        ]
+
+    for result in asyncio.run(run()):
+        result.update(
+            concurrency=args.concurrency,
+            throttled=stub.throttled,
+            errors=stub.errors,
+        )
+        print(json.dumps(result))
+
+
+def main(args: argparse.Namespace):
+    print(
+        f"{'stage':<22} {'conc':>5} {'calls':>6} {'elapsed s':>10} {'calls/s':>8} "
+        f"{'p50 s':>7} {'p99 s':>7} {'lag p50 ms':>11} {'lag max ms':>11}"
+    )
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATA_DIR=str(Path(tmp) / "data"),
+                CACHE_DIR=str(Path(tmp) / "cache"),
+                OPENAI_API_KEY="stub",
+            )
+            command = [sys.executable, "-m", "benchmarks.llm_stages", "--worker"]
+            command += sys.argv[1:] + ["--concurrency", str(concurrency)]
+            process = subprocess.run(
+                command,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=None if args.verbose else subprocess.DEVNULL,
+                text=True,
+            )
+        if process.returncode != 0:
+            sys.exit(f"Worker failed for concurrency {concurrency}")
+
+        for line in process.stdout.splitlines():
+            if not line.startswith("{"):
+                continue
+            r = json.loads(line)
+            print(
+                f"{r['stage']:<22} {concurrency:>5} {r['calls']:>6} "
+                f"{r['elapsed']:>10.2f} {r['throughput']:>8.1f} "
+                f"{r['p50'] or 0:>7.2f} {r['p99'] or 0:>7.2f} "
+                f"{r['lag_p50'] * 1000:>11.2f} {r['lag_max'] * 1000:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--chunk-chars", type=int, default=None, help="Augment long facts in chunks."
+    )
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    openai_stub.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.concurrency = args.concurrency[-1]
+        worker(args)
+    else:
+        main(args)
@@ -0,0 +1,396 @@
+"""
+A local stand-in for the OpenAI API, to run the LLM stages without cost.
+
+The stub implements the endpoints the pipeline uses:
+
+- ``POST /v1/chat/completions``: structured outputs (``response_format`` with a
+  JSON schema, as sent by ``parse``) are answered with an instance of the
+  schema, predicted outputs with the prediction (with the gendered party nouns
+  swapped) and usage details on accepted and rejected prediction tokens, and
+  anything else with a short text. Logprobs are returned when requested.
+- ``POST /v1/files``, ``POST /v1/batches``, ``GET /v1/batches/<id>`` and
+  ``GET /v1/files/<id>/content`` for the batch mode; a batch completes on its
+  first retrieval.
+
+The latency of a completion is drawn from a log-normal distribution and grows
+with the number of generated tokens (accepted prediction tokens are cheaper).
+Requests beyond the ``--rpm``/``--tpm`` limits are answered with ``429`` and
+``retry-after-ms``, every response carries ``x-ratelimit-*`` headers, and a
+fraction ``--error-rate`` of the requests fails with ``500``.
+
+    python -m benchmarks.openai_stub --port 8000
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=stub python ...
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+GENDER_SWAPS = {
+    "Kläger": "Klägerin",
+    "Beklagter": "Beklagte",
+    "der Kläger": "die Klägerin",
+    "des Klägers": "der Klägerin",
+    "dem Kläger": "der Klägerin",
+    "den Kläger": "die Klägerin",
+}
+GENDER_PATTERN = re.compile(
+    r"\b(?:"
+    + "|".join(sorted(map(re.escape, GENDER_SWAPS), key=len, reverse=True))
+    + r")\b"
+)
+STATUS_LINES = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Error"}
+
+
+class OpenAIStub:
+    def __init__(
+        self,
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.5,
+        ms_per_token: float = 10.0,
+        rpm: Optional[int] = 10_000,
+        tpm: Optional[int] = 30_000_000,
+        error_rate: float = 0.0,
+        acceptance: float = 0.9,
+        seed: int = 0,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.ms_per_token = ms_per_token
+        self.rpm = rpm
+        self.tpm = tpm
+        self.error_rate = error_rate
+        self.acceptance = acceptance
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._files: Dict[str, bytes] = {}
+        self._batches: Dict[str, dict] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with keep-alive: serve requests until the client disconnects
+        try:
+            while request_line := await reader.readline():
+                if not request_line.strip():
+                    continue
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response_headers, payload = await self.route(
+                    method, path.split("?")[0], headers, body
+                )
+                head = f"HTTP/1.1 {status} {STATUS_LINES.get(status, 'Error')}\r\n"
+                for name, value in response_headers.items():
+                    head += f"{name}: {value}\r\n"
+                head += f"Content-Length: {len(payload)}\r\n\r\n"
+                writer.write(head.encode() + payload)
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        if method == "POST" and path.endswith("/chat/completions"):
+            return await self.chat_completion(json.loads(body))
+        if method == "POST" and path.endswith("/files"):
+            file_id = f"file-{len(self._files)}"
+            self._files[file_id] = _multipart_file(headers["content-type"], body)
+            return _json(200, _file_object(file_id, len(self._files[file_id])))
+        if method == "POST" and path.endswith("/batches"):
+            request = json.loads(body)
+            batch_id = f"batch-{len(self._batches)}"
+            self._batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "validating",
+                "created_at": int(time.time()),
+                "metadata": request.get("metadata"),
+            }
+            return _json(200, self._batches[batch_id])
+        if method == "GET" and (match := re.search(r"/batches/([^/]+)$", path)):
+            if (batch := self._batches.get(match.group(1))) is None:
+                return _json(404, {"error": {"message": "No such batch"}})
+            if batch["status"] == "validating":
+                self._run_batch(batch)
+            return _json(200, batch)
+        if method == "GET" and (match := re.search(r"/files/([^/]+)/content$", path)):
+            if (content := self._files.get(match.group(1))) is None:
+                return _json(404, {"error": {"message": "No such file"}})
+            return 200, {"Content-Type": "application/octet-stream"}, content
+        return _json(404, {"error": {"message": f"Unknown endpoint {path}"}})
+
+    async def chat_completion(self, request: dict) -> Tuple[int, Dict[str, str], bytes]:
+        self.requests += 1
+        completion, latency = self.complete(request)
+        tokens = completion["usage"]["total_tokens"]
+
+        now = time.monotonic()
+        while self._window and self._window[0][0] < now - 60:
+            self._window.popleft()
+        used_requests = len(self._window)
+        used_tokens = sum(t for _, t in self._window)
+        headers = self._rate_limit_headers(used_requests, used_tokens)
+        if (self.rpm and used_requests >= self.rpm) or (
+            self.tpm and used_tokens + tokens > self.tpm
+        ):
+            self.throttled += 1
+            retry_after = 60 - (now - self._window[0][0]) if self._window else 1.0
+            headers["retry-after-ms"] = str(int(retry_after * 1000))
+            return _json(429, {"error": {"message": "Rate limit reached"}}, headers)
+        self._window.append((now, tokens))
+
+        await asyncio.sleep(latency)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return _json(500, {"error": {"message": "Injected error"}}, headers)
+        return _json(200, completion, headers)
+
+    def complete(self, request: dict) -> Tuple[dict, float]:
+        """
+        Build the completion for a request and draw its latency.
+        """
+        messages = request["messages"]
+        prompt_tokens = sum(len(m["content"]) for m in messages) // CHARS_PER_TOKEN
+        accepted = rejected = 0
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            content = json.dumps(_instance(schema, schema.get("$defs", {})))
+        elif prediction := request.get("prediction"):
+            predicted = prediction["content"]
+            content = GENDER_PATTERN.sub(lambda m: GENDER_SWAPS[m.group(0)], predicted)
+            predicted_tokens = len(predicted) // CHARS_PER_TOKEN
+            accepted = int(predicted_tokens * self.acceptance)
+            rejected = predicted_tokens - accepted
+        else:
+            content = "Dies ist eine Antwort des lokalen Stubs."
+        completion_tokens = max(len(content) // CHARS_PER_TOKEN, 1)
+
+        generated = completion_tokens - accepted + accepted / 10
+        latency = self.random.lognormvariate(0, self.latency_sigma)
+        latency = latency * self.latency_median + generated * self.ms_per_token / 1000
+
+        completion = {
+            "id": f"chatcmpl-stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                    "logprobs": (
+                        _logprobs(content, request.get("top_logprobs") or 0)
+                        if request.get("logprobs")
+                        else None
+                    ),
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+                "completion_tokens_details": {
+                    "accepted_prediction_tokens": accepted,
+                    "rejected_prediction_tokens": rejected,
+                },
+            },
+        }
+        return completion, latency
+
+    def _run_batch(self, batch: dict):
+        lines = self._files[batch["input_file_id"]].decode("utf-8").splitlines()
+        output = []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            completion, _ = self.complete(request["body"])
+            output.append(
+                {
+                    "id": f"batch-req-{len(output)}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": completion},
+                    "error": None,
+                }
+            )
+        output_file_id = f"file-{len(self._files)}"
+        self._files[output_file_id] = "\n".join(map(json.dumps, output)).encode()
+        batch.update(
+            status="completed",
+            output_file_id=output_file_id,
+            request_counts={
+                "total": len(output),
+                "completed": len(output),
+                "failed": 0,
+            },
+        )
+
+    def _rate_limit_headers(self, used_requests: int, used_tokens: int) -> dict:
+        headers = {}
+        if self.rpm:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(
+                max(self.rpm - used_requests, 0)
+            )
+            headers["x-ratelimit-reset-requests"] = f"{60 / self.rpm:.3f}s"
+        if self.tpm:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(
+                max(self.tpm - used_tokens, 0)
+            )
+            headers["x-ratelimit-reset-tokens"] = "1s"
+        return headers
+
+
+def start_in_thread(**kwargs) -> Tuple[str, OpenAIStub]:
+    """
+    Serve a stub on a free local port from a background thread. Returns the
+    base URL for the OpenAI client and the stub (for its counters).
+    """
+    stub = OpenAIStub(**kwargs)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(stub.handle, "127.0.0.1", 0))
+    port = server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}/v1", stub
+
+
+def _instance(schema: dict, defs: dict):
+    """
+    Build an instance of a JSON schema, choosing the first enum value.
+    """
+    if "$ref" in schema:
+        return _instance(defs[schema["$ref"].rsplit("/", 1)[1]], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return _instance(schema["anyOf"][0], defs)
+    match schema.get("type"):
+        case "object":
+            return {
+                name: _instance(prop, defs)
+                for name, prop in schema.get("properties", {}).items()
+            }
+        case "array":
+            return [_instance(schema.get("items", {}), defs)]
+        case "integer":
+            return 0
+        case "number":
+            return 0.0
+        case "boolean":
+            return False
+        case "null":
+            return None
+        case _:
+            return "stub"
+
+
+def _logprobs(content: str, top: int) -> dict:
+    tokens = [
+        content[i : i + CHARS_PER_TOKEN]
+        for i in range(0, len(content), CHARS_PER_TOKEN)
+    ]
+    return {
+        "content": [
+            {
+                "token": token,
+                "logprob": -0.01,
+                "bytes": list(token.encode()),
+                "top_logprobs": [
+                    {"token": token, "logprob": -0.01, "bytes": list(token.encode())}
+                ][:top],
+            }
+            for token in tokens
+        ],
+        "refusal": None,
+    }
+
+
+def _multipart_file(content_type: str, body: bytes) -> bytes:
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        head, _, content = part.partition(b"\r\n\r\n")
+        if b'name="file"' in head:
+            return content.removesuffix(b"\r\n")
+    return b""
+
+
+def _file_object(file_id: str, size: int) -> dict:
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": size,
+        "created_at": int(time.time()),
+        "filename": f"{file_id}.jsonl",
+        "purpose": "batch",
+        "status": "processed",
+    }
+
+
+def _json(
+    status: int, payload: dict, headers: Optional[dict] = None
+) -> Tuple[int, Dict[str, str], bytes]:
+    return (
+        status,
+        {"Content-Type": "application/json", **(headers or {})},
+        json.dumps(payload).encode(),
+    )
+
+
+async def main(port: int, **kwargs):
+    stub = OpenAIStub(**kwargs)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", port)
+    print(f"Serving on http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1")
+    async with server:
+        await server.serve_forever()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--ms-per-token", type=float, default=10.0)
+    parser.add_argument("--rpm", type=int, default=10_000)
+    parser.add_argument("--tpm", type=int, default=30_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--acceptance", type=float, default=0.9)
+
+
+def stub_options(args: argparse.Namespace) -> dict:
+    return dict(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        ms_per_token=args.ms_per_token,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        error_rate=args.error_rate,
+        acceptance=args.acceptance,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(main(args.port, **stub_options(args)))
@@ -0,0 +1,82 @@
+"""
+Regression benchmark for the section locator of parse_docs on pathological inputs.
+
+Every case is parsed with the current locator and with the former single
+backtracking regex (kept here as the reference). The run fails if the worst
+case of the current locator exceeds ``--budget`` milliseconds per document.
+
+    python -m benchmarks.section_parser
+    python -m benchmarks.section_parser --size 1000000 --skip-reference
+
+The former regex needs tens of seconds on some cases even at the default size.
+"""
+
+import argparse
+import re
+import sys
+import time
+
+from src.scraping._parse_docs import _locate_sections
+
+# The former TENOR_TATBESTAND_PATTERN of parse_docs
+BACKTRACKING_PATTERN = re.compile(
+    r"für\s+recht\s+erkannt\s*:?"
+    r"\s*\n(.+?)\n\s*"
+    r"(?:von\s+rechts\s+wegen\s+.*)?"
+    r"tatbestand\s*:?"
+    r"\s*\n(.+?)\n\s*"
+    r"entscheidungsgründe\s*:?"
+    r"\s*\n.*",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+def cases(size: int) -> dict[str, str]:
+    line = "Der Kläger nimmt die Beklagte auf Schadensersatz in Anspruch.\n"
+    filler = line * (size // len(line))
+    return {
+        "well-formed": (
+            "für Recht erkannt:\nDie Revision wird zurückgewiesen.\nVon Rechts wegen\n"
+            f"Tatbestand:\n{filler}Entscheidungsgründe:\nI.\n{filler}"
+        ),
+        "no headings": filler,
+        "no tatbestand": f"für Recht erkannt:\n{filler}",
+        "no entscheidungsgründe": f"für Recht erkannt:\nTenor\nTatbestand:\n{filler}",
+        "repeated tenor headings": "für Recht erkannt:\nTenor\n" * (size // 24),
+        "repeated von rechts wegen": (
+            "für Recht erkannt:\nTenor\n"
+            + "von Rechts wegen tatbestand\n" * (size // 28)
+        ),
+    }
+
+
+def timed(fn, text: str) -> float:
+    start = time.perf_counter()
+    fn(text)
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the section locator.")
+    parser.add_argument("--size", type=int, default=20_000)
+    parser.add_argument("--budget", type=float, default=250.0)
+    parser.add_argument(
+        "--skip-reference", action="store_true", help="Don't time the former regex."
+    )
+    args = parser.parse_args()
+
+    worst = 0.0
+    print(f"{'case':<28} {'locator ms':>11} {'regex ms':>11}")
+    for name, text in cases(args.size).items():
+        locator_ms = timed(_locate_sections, text)
+        worst = max(worst, locator_ms)
+        regex_ms = (
+            "-"
+            if args.skip_reference
+            else f"{timed(BACKTRACKING_PATTERN.search, text):.1f}"
+        )
+        print(f"{name:<28} {locator_ms:>11.1f} {regex_ms:>11}")
+
+    if worst > args.budget:
+        print(f"Worst case {worst:.1f}ms exceeds the budget of {args.budget:.1f}ms")
+        sys.exit(1)
@@ -0,0 +1,53 @@
+"""
+Compare spaCy models for the dehyphenation in parse_docs.
+
+The hyphenation candidates of a sample of documents are decided with every
+model (without the persistent lexicon). The report shows the model load time,
+the time to decide all candidates, and how many decisions and documents differ
+from the first (reference) model. A smaller model can replace ``de_core_news_lg``
+(via ``SPACY_MODEL``) if it produces identical output.
+
+    python -m benchmarks.spacy_models --models de_core_news_lg de_core_news_md
+"""
+
+import argparse
+import time
+
+from src.common import nlp
+from src.common.utils import load_documents_text
+from src.scraping._dehyphenation import Dehyphenator
+from src.scraping._parse_docs import ParseFailure, _clean, _locate_sections
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark spaCy models.")
+    parser.add_argument("--models", nargs="+", default=["de_core_news_lg"])
+    parser.add_argument("--samples", type=int, default=500)
+    args = parser.parse_args()
+
+    sections = []
+    for doc in load_documents_text()[: args.samples]:
+        if not isinstance(located := _locate_sections(doc["text"]), ParseFailure):
+            sections.append([_clean(section) for section in located])
+
+    reference = None
+    for model in args.models:
+        start = time.perf_counter()
+        dehyphenator = Dehyphenator(nlp.load(model), model)
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dehyphenator.prime(text for doc in sections for text in doc)
+        outputs = [[dehyphenator.fix(text) for text in doc] for doc in sections]
+        decide_time = time.perf_counter() - start
+        decisions = dict(dehyphenator._cache)
+
+        print(f"{model}: load {load_time:.1f}s, decide {decide_time:.1f}s")
+        print(f"  {len(decisions)} distinct candidates in {len(sections)} documents")
+        if reference is None:
+            reference = decisions, outputs
+            continue
+        differing = sum(decisions[pair] != reference[0][pair] for pair in decisions)
+        differing_docs = sum(a != b for a, b in zip(outputs, reference[1]))
+        print(
+            f"  {differing} differing decisions, {differing_docs} differing documents"
+        )
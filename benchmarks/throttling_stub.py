@@ -0,0 +1,92 @@
+"""
+Run the shared scraping transport against a local stub server that injects throttling.
+
+The stub server answers with ``429 Too Many Requests`` (and a ``Retry-After``
+header) whenever more than ``--capacity`` requests are in flight, and otherwise
+responds after ``--latency`` seconds. The report shows how the per-host rate
+controller converges to the server's capacity.
+
+    python -m benchmarks.throttling_stub --requests 500 --capacity 8
+"""
+
+import argparse
+import asyncio
+import time
+
+from src.common import transport
+
+
+class StubServer:
+    def __init__(self, capacity: int, latency: float, retry_after: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.served = 0
+        self.throttled = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with keep-alive: serve requests until the client disconnects
+        while request_line := await reader.readline():
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if not request_line.strip():
+                continue
+
+            if self.in_flight >= self.capacity:
+                self.throttled += 1
+                status = b"429 Too Many Requests"
+                headers = f"Retry-After: {self.retry_after}\r\n".encode()
+            else:
+                self.in_flight += 1
+                await asyncio.sleep(self.latency)
+                self.in_flight -= 1
+                self.served += 1
+                status, headers = b"200 OK", b""
+
+            body = b"ok"
+            writer.write(
+                b"HTTP/1.1 "
+                + status
+                + b"\r\n"
+                + headers
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        writer.close()
+
+
+async def main(n_requests: int, capacity: int, latency: float, retry_after: float):
+    stub = StubServer(capacity, latency, retry_after)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/"
+
+    async def fetch():
+        # Retry throttled requests; the controller delays them as instructed
+        while (await transport.request("GET", url)).status_code == 429:
+            pass
+
+    start = time.monotonic()
+    async with server:
+        await asyncio.gather(*(fetch() for _ in range(n_requests)))
+    elapsed = time.monotonic() - start
+
+    controller = transport.controller_for(url)
+    print(f"requests:          {n_requests}")
+    print(f"elapsed:           {elapsed:.2f}s ({n_requests / elapsed:.1f} req/s)")
+    print(f"ideal:             {n_requests * latency / capacity:.2f}s")
+    print(f"429 responses:     {stub.throttled}")
+    print(f"final concurrency: {controller.limit:.1f} (server capacity {capacity})")
+    await transport.get_client().aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scraping transport.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.capacity, args.latency, args.retry_after))
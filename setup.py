@@ -22,6 +22,10 @@ setup(
         "jupyter==1.1.1",
         "spacy==3.8.7",
     ],
+    extras_require={
+        "http2": ["httpx[http2]==0.28.1"],
+        "zstd": ["zstandard==0.23.0"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
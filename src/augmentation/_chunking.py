@@ -0,0 +1,61 @@
+"""
+This module splits long texts into chunks on paragraph and sentence boundaries,
+so that long Tatbestände can be augmented chunk by chunk.
+"""
+
+import re
+from typing import List
+
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+
+# A sentence ends with ., ! or ? followed by whitespace and an upper-case letter or
+# an opening quote, unless the period belongs to a common abbreviation or follows a
+# number (dates such as "1. Februar", ordinals).
+ABBREVIATIONS = (
+    "Abs",
+    "Art",
+    "Dr",
+    "Nr",
+    "Rn",
+    "Rdnr",
+    "S",
+    "vgl",
+    "bzw",
+    "ff",
+    "Ziff",
+)
+SENTENCE_PATTERN = re.compile(
+    "".join(rf"(?<!\b{abbreviation}\.)" for abbreviation in ABBREVIATIONS)
+    + r"(?<!\d\.)(?<=[.!?])\s+(?=[„\"(]?[A-ZÄÖÜ])"
+)
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split a text into its paragraphs and those into sentences.
+    """
+    return [
+        sentence
+        for paragraph in PARAGRAPH_PATTERN.split(text)
+        for sentence in SENTENCE_PATTERN.split(paragraph.strip())
+        if sentence
+    ]
+
+
+def chunk_text(text: str, max_chars: int) -> List[str]:
+    """
+    Pack the sentences of a text into chunks of at most ``max_chars`` characters.
+    A sentence longer than that becomes a chunk of its own.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in split_sentences(text):
+        if current and size + 1 + len(sentence) > max_chars:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        size += len(sentence) + (1 if current else 0)
+        current.append(sentence)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
@@ -5,80 +5,170 @@ results in JSONL format. The augmentations are then zipped for easier distributi
 """
 
 import asyncio
-import json
-from itertools import batched
+from functools import cache, partial
+from typing import Optional
 
 from tqdm import tqdm
 
+from src.augmentation._chunking import chunk_text
 from src.augmentation._prompt import AugmentationPrompt
-from src.common import cached_generation, config, prompts
+from src.common import (
+    artifacts,
+    cached_generation,
+    executor,
+    generation_batch,
+    prompts,
+    telemetry,
+)
 from src.common.types import (
     Appellant,
-    Decision,
     DocumentAugmented,
     DocumentLabeled,
     GrammaticalGender,
-    LegalPartyType,
 )
-from src.common.utils import flatten_text, load_documents_labeled
-
-prompt = AugmentationPrompt(prompts.CREATE_AUGMENTATION_SYSTEM)
+from src.common.utils import flatten_text, is_augmentable, load_documents_labeled
 
 
-async def create_augmentations():
+async def create_augmentations(
+    concurrency: int = 10,
+    batch: bool = False,
+    chunk_chars: Optional[int] = None,
+    rule_threshold: Optional[float] = None,
+):
     """
-    Main function to generate augmentations for training examples.
+    Main function to generate augmentations for training examples. With ``batch``,
+    the uncached requests are first run as OpenAI batch jobs. With ``chunk_chars``,
+    facts longer than that are split on sentence boundaries into chunks of at most
+    ``chunk_chars`` characters, which are augmented concurrently. With
+    ``rule_threshold``, the rule-based swaps with at least that confidence are used
+    as they are, and only the other documents are sent to the LLM.
     """
-    sem = asyncio.Semaphore(10)
+    process = partial(_process, chunk_chars=chunk_chars)
 
     async def generate(examples: list[DocumentLabeled]):
+        # Longest facts first, as they take longest to rewrite
         with tqdm(total=len(examples)) as pbar:
-            for batch in batched(examples, 25):
-                tasks = (_process(doc, sem) for doc in batch)
-                for r in await asyncio.gather(*tasks):
-                    pbar.update(1)
-                    if r is not None:
-                        yield r
+            async for r in executor.run_bounded(
+                examples,
+                process,
+                concurrency=concurrency,
+                size=lambda doc: len(doc["facts"]),
+            ):
+                pbar.update(1)
+                if r.error is not None:
+                    print(f"Error augmenting {r.item['id']}: {r.error!r}")
+                yield r
 
     # Load examples
     documents_labeled = load_documents_labeled()
-    augmentations = [r async for r in generate(documents_labeled)]
+    swapped = {}
+    if rule_threshold is not None:
+        swapped = _swap_rule_based(documents_labeled, rule_threshold)
+    remaining = [doc for doc in documents_labeled if doc["id"] not in swapped]
+
+    if batch:
+        await generation_batch.prefill(remaining, process, "create_augmentations")
+    with telemetry.run() as records, telemetry.scope(stage="create_augmentations"):
+        generated = {
+            r.item["id"]: r.value
+            for r in executor.in_order([r async for r in generate(remaining)])
+        }
+    telemetry.report(records)
+    augmentations = [
+        augmentation
+        for doc in documents_labeled
+        if (augmentation := swapped.get(doc["id"]) or generated.get(doc["id"]))
+    ]
 
     # Write augmentations to files
-    config.DOCS_AUGMENTED_JSONL.write_text(
-        "\n".join(json.dumps(r, default=lambda x: str(x)) for r in augmentations),
-        encoding="utf-8",
-    )
+    artifacts.write("augmented", augmentations)
 
     return augmentations
 
 
-async def _process(doc: DocumentLabeled, sem) -> DocumentAugmented | None:
+def _swap_rule_based(
+    documents: list[DocumentLabeled], threshold: float
+) -> dict[str, DocumentAugmented]:
+    """
+    Swap the gender of the appellant with rules, keeping the swaps with at least
+    the given confidence.
+    """
+    eligible = [doc for doc in documents if is_augmentable(doc)]
+    swapped = {}
+    for doc in eligible:
+        if augmentation := _swap_one(doc, threshold):
+            swapped[doc["id"]] = augmentation
+    print(
+        f"Rule-based swaps for {len(swapped)} of {len(eligible)} documents "
+        f"(confidence >= {threshold})"
+    )
+    return swapped
+
+
+def _swap_one(doc: DocumentLabeled, threshold: float) -> DocumentAugmented | None:
+    """
+    Swap the gender of the appellant of an augmentable document with rules, or
+    return None if the swap is less confident than the threshold.
+    """
+    from src.augmentation._rule_based import swap_gender
+
+    result = swap_gender(
+        doc["facts"],
+        Appellant(doc["appellant"]),
+        GrammaticalGender(doc["appellant_gender"]),
+    )
+    if result.confidence < threshold:
+        return None
+    return DocumentAugmented(**doc, facts_augmented=flatten_text(result.text))
+
+
+async def _process(
+    doc: DocumentLabeled, chunk_chars: Optional[int] = None
+) -> DocumentAugmented | None:
     """
     Process a single training example to create an augmentation.
     """
-    if (
-        doc["appellant"] not in (Appellant.PLAINTIFF, Appellant.DEFENDANT)
-        or doc["decision"] == Decision.OTHER
-        or doc["appellant_type"] != LegalPartyType.INDIVIDUAL
-        or doc["appellant_gender"] == GrammaticalGender.NEUTER
-    ):
+    if not is_augmentable(doc):
         return None
 
-    system_prompt = prompt.system_prompt(
+    system_prompt = _prompt().system_prompt(
         appellant=Appellant(doc["appellant"]),
         grammatical_gender=GrammaticalGender(doc["appellant_gender"]),
     )
-    response = await cached_generation.create(
+    if chunk_chars and len(doc["facts"]) > chunk_chars:
+        chunks = chunk_text(doc["facts"], chunk_chars)
+    else:
+        chunks = [doc["facts"]]
+
+    with telemetry.scope(document_id=str(doc["id"])):
+        responses = await asyncio.gather(
+            *(_augment(system_prompt, chunk) for chunk in chunks),
+            return_exceptions=True,
+        )
+    for response in responses:
+        if isinstance(response, BaseException):
+            raise response
+
+    return DocumentAugmented(
+        **doc,
+        facts_augmented=" ".join(map(flatten_text, responses)),
+    )
+
+
+async def _augment(system_prompt: str, text: str) -> str:
+    """
+    Rewrite a text (the facts or a chunk of them); each text is cached on its own.
+    """
+    return await cached_generation.create(
         model=cached_generation.Model.GPT_41_MINI,
         messages=[
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": doc["facts"]},
+            {"role": "user", "content": text},
         ],
-        prediction_content=doc["facts"],
-        sem=sem,
-    )
-    return DocumentAugmented(
-        **doc,
-        facts_augmented=flatten_text(response),
+        prediction_content=text,
     )
+
+
+@cache
+def _prompt() -> AugmentationPrompt:
+    return AugmentationPrompt(prompts.CREATE_AUGMENTATION_SYSTEM)
@@ -0,0 +1,728 @@
+"""
+This module swaps the grammatical gender of the appellant with rules, as a fast
+path before the LLM.
+
+The appellant is referred to as "Kläger"/"Klägerin" or "Beklagter"/"Beklagte".
+Every mention of the appellant is rewritten together with its determiner and
+adjectives, and so are the personal, possessive and relative pronouns that refer
+to it. The case, number and gender of a mention follow from its determiner and
+the inflection of the noun; where these are ambiguous (e.g. "die Klägerin" as
+subject or object), the case is taken from a governing preposition or the
+position of the mention in its clause. A pronoun is taken to refer to the
+appellant if the appellant is its closest preceding party mention of the same
+gender within the current and the previous sentence.
+
+Nouns for the role or profession of the appellant ("Der Kläger, ein
+Rechtsanwalt, ...", "als Geschäftsführer", "Die Beklagte ist Ärztin") agree with
+its gender but are not rewritten.
+
+Every rewrite that relied on such a heuristic, every mention or pronoun that
+could not be resolved, and every role noun of the appellant lowers the
+confidence of the result, so that only the documents the rules handle reliably
+skip the LLM. The agreement with the LLM
+augmentations is reported by confidence with::
+
+    python -m src.augmentation._rule_based
+"""
+
+import argparse
+import difflib
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from src.augmentation._chunking import ABBREVIATIONS
+from src.common.types import Appellant, GrammaticalGender
+from src.common.utils import flatten_text, load_documents_augmented
+
+TOKEN_PATTERN = re.compile(r"\w+|\W+")
+SENTENCE_END = re.compile(r"[.!?]")
+CLAUSE_END = re.compile(r"[,;:()\"„“]")
+
+MASCULINE = GrammaticalGender.MASCULINE
+FEMININE = GrammaticalGender.FEMININE
+
+NOM, GEN, DAT, AKK = "nom", "gen", "dat", "akk"
+
+DEFINITE = {
+    MASCULINE: {NOM: "der", GEN: "des", DAT: "dem", AKK: "den"},
+    FEMININE: {NOM: "die", GEN: "der", DAT: "der", AKK: "die"},
+}
+INDEFINITE = {
+    MASCULINE: {NOM: "ein", GEN: "eines", DAT: "einem", AKK: "einen"},
+    FEMININE: {NOM: "eine", GEN: "einer", DAT: "einer", AKK: "eine"},
+}
+# Preposition and article merged into one word, always dative here
+CONTRACTIONS = {
+    "vom": ("von", MASCULINE),
+    "zum": ("zu", MASCULINE),
+    "beim": ("bei", MASCULINE),
+    "im": ("in", MASCULINE),
+    "am": ("an", MASCULINE),
+    "zur": ("zu", FEMININE),
+}
+CONTRACT = {
+    (prep, gender): contraction for contraction, (prep, gender) in CONTRACTIONS.items()
+}
+
+AKK_PREPOSITIONS = {"für", "gegen", "ohne", "um", "durch", "bis", "wider"}
+DAT_PREPOSITIONS = {
+    "von",
+    "mit",
+    "bei",
+    "nach",
+    "aus",
+    "zu",
+    "seit",
+    "gegenüber",
+    "ab",
+    "außer",
+    "entgegen",
+    "gemäß",
+    "laut",
+}
+GEN_PREPOSITIONS = {
+    "wegen",
+    "trotz",
+    "während",
+    "statt",
+    "anstatt",
+    "aufgrund",
+    "zugunsten",
+    "zulasten",
+    "zuungunsten",
+    "seitens",
+    "namens",
+    "infolge",
+    "mangels",
+    "hinsichtlich",
+    "bezüglich",
+    "anlässlich",
+}
+TWO_WAY_PREPOSITIONS = {"an", "auf", "in", "über", "unter", "vor", "hinter", "neben"}
+PREPOSITIONS = (
+    AKK_PREPOSITIONS | DAT_PREPOSITIONS | GEN_PREPOSITIONS | TWO_WAY_PREPOSITIONS
+)
+SUBORDINATORS = {
+    "dass",
+    "weil",
+    "da",
+    "als",
+    "nachdem",
+    "ob",
+    "wenn",
+    "obwohl",
+    "sodass",
+    "damit",
+    "bevor",
+    "indem",
+    "soweit",
+    "sofern",
+}
+DETERMINERS = (
+    set(CONTRACTIONS)
+    | {
+        form
+        for table in (DEFINITE, INDEFINITE)
+        for forms in table.values()
+        for form in forms.values()
+    }
+    | {"das"}
+)
+
+# Other words for the parties (procedural roles, plurals) are not rewritten
+PARTY_NOUNS = {"Kläger", "Klägers", "Klägerin", "Beklagte", "Beklagten", "Beklagter"}
+
+# Endings of nouns for persons ("Rechtsanwalt", "Geschäftsführer", "Ärztin"),
+# except those of common other nouns ("Verein", "Steuer", "Papier")
+ROLE_ENDINGS = ("in", "frau", "mann", "er", "or", "ist", "eur", "arzt", "anwalt")
+ROLE_ENDINGS += ("ling", "zeuge", "erbe", "kunde", "bote", "experte", "kollege")
+NON_ROLE_ENDINGS = ("ein", "uer", "ier")
+# Words linking the subject to a predicative noun
+COPULAS = {"ist", "war", "sei", "wäre", "wird", "wurde", "bleibt", "blieb"}
+
+PERSONAL_PRONOUNS = {
+    MASCULINE: {"er": NOM, "ihn": AKK, "ihm": DAT},
+    FEMININE: {"sie": None, "ihr": DAT},
+}
+POSSESSIVE_STEMS = {MASCULINE: "sein", FEMININE: "ihr"}
+POSSESSIVE_ENDINGS = ("", "e", "en", "em", "er", "es")
+RELATIVE_PRONOUNS = {
+    MASCULINE: {"der": NOM, "den": AKK, "dem": DAT, "dessen": GEN},
+    FEMININE: {"die": None, "der": DAT, "deren": GEN},
+}
+RELATIVE_FORMS = {
+    MASCULINE: {NOM: "der", AKK: "den", DAT: "dem", GEN: "dessen"},
+    FEMININE: {NOM: "die", AKK: "die", DAT: "der", GEN: "deren"},
+}
+PERSONAL_FORMS = {
+    MASCULINE: {NOM: "er", AKK: "ihn", DAT: "ihm", GEN: "seiner"},
+    FEMININE: {NOM: "sie", AKK: "sie", DAT: "ihr", GEN: "ihrer"},
+}
+
+
+class RuleBasedSwap(NamedTuple):
+    text: str
+    confidence: float
+    rewrites: int
+    uncertain: int
+    # Role nouns of the appellant, which are not rewritten
+    roles: int
+
+
+class _Mention(NamedTuple):
+    position: int
+    sentence: int
+    appellant: bool
+    genders: Set[str]
+
+
+def swap_gender(
+    text: str,
+    appellant: Appellant,
+    grammatical_gender: GrammaticalGender,
+) -> RuleBasedSwap:
+    """
+    Swap the grammatical gender of the appellant in the text.
+    """
+    return _Swapper(text, appellant, grammatical_gender).run()
+
+
+class _Swapper:
+    def __init__(
+        self,
+        text: str,
+        appellant: Appellant,
+        gender: GrammaticalGender,
+    ):
+        if appellant not in (Appellant.PLAINTIFF, Appellant.DEFENDANT):
+            raise ValueError(f"Invalid appellant: {appellant}")
+        if gender not in (MASCULINE, FEMININE):
+            raise ValueError(f"Invalid grammatical gender: {gender}")
+
+        self.appellant = appellant
+        self.source = gender
+        self.target = FEMININE if gender == MASCULINE else MASCULINE
+
+        self.tokens = TOKEN_PATTERN.findall(text)
+        # Positions of the words among the tokens, and their sentence and clause
+        self.words = [i for i, t in enumerate(self.tokens) if t[0].isalnum()]
+        self.texts = [self.tokens[i] for i in self.words]
+        self.lowers = [t.lower() for t in self.texts]
+        self.sentence: List[int] = []
+        self.clause: List[int] = []
+        self.clause_start: List[bool] = []
+        self._segment()
+
+        self.edits: Dict[int, str] = {}
+        self.mentions: List[_Mention] = []
+        self.subjects: Set[int] = set()
+        self.certain = 0
+        self.uncertain = 0
+
+    def run(self) -> RuleBasedSwap:
+        stem = POSSESSIVE_STEMS[self.source]
+        for w, word in enumerate(self.texts):
+            if self._is_subject(w):
+                self.subjects.add(self.clause[w])
+            if word in PARTY_NOUNS:
+                self._mention(w)
+            elif ("läger" in word or "eklagte" in word) and word[0].isupper():
+                # e.g. "Revisionskläger", "Widerbeklagte" or "Klägerinnen"
+                self.uncertain += 1
+            elif (
+                self.lowers[w].startswith(stem)
+                or self.lowers[w] in PERSONAL_PRONOUNS[self.source]
+            ) and self._pronoun_gender(w) is not None:
+                self._pronoun(w)
+
+        roles = self._roles()
+        self.uncertain += len(roles)
+
+        tokens = [self.edits.get(i, t) for i, t in enumerate(self.tokens)]
+        rewrites = sum(1 for m in self.mentions if m.appellant)
+        decisions = self.certain + self.uncertain
+        confidence = self.certain / decisions if rewrites and decisions else 0.0
+        return RuleBasedSwap(
+            "".join(tokens), confidence, rewrites, self.uncertain, len(roles)
+        )
+
+    # Segmentation
+
+    def _segment(self):
+        sentence = clause = 0
+        start = True
+        for n, i in enumerate(self.words):
+            separator = self.tokens[i - 1] if i > 0 else ""
+            if separator == " ":
+                pass
+            elif SENTENCE_END.search(separator) and not (
+                n > 0
+                and (self.texts[n - 1] in ABBREVIATIONS or self.texts[n - 1].isdigit())
+            ):
+                sentence += 1
+                clause += 1
+                start = True
+            elif CLAUSE_END.search(separator) or separator.count("-") > 1:
+                clause += 1
+                start = True
+            self.sentence.append(sentence)
+            self.clause.append(clause)
+            self.clause_start.append(start)
+            start = False
+
+    def _word(self, w: int) -> str:
+        return self.texts[w]
+
+    def _lower(self, w: int) -> str:
+        return self.lowers[w] if 0 <= w < len(self.words) else ""
+
+    def _joined(self, a: int, b: int) -> bool:
+        """
+        Whether two adjacent words are in the same clause.
+        """
+        return 0 <= a and b < len(self.words) and self.clause[a] == self.clause[b]
+
+    def _set(self, w: int, replacement: str):
+        original = self._word(w)
+        if original[0].isupper():
+            replacement = replacement[0].upper() + replacement[1:]
+        if replacement != original:
+            self.edits[self.words[w]] = replacement
+
+    def _drop(self, w: int):
+        """
+        Remove a word and the whitespace before it.
+        """
+        self.edits[self.words[w]] = ""
+        self.edits[self.words[w] - 1] = ""
+
+    def _opens_clause(self, w: int) -> bool:
+        """
+        Whether the word starts its clause, possibly after a subordinator.
+        """
+        return self.clause_start[w] or (
+            w > 0 and self.clause_start[w - 1] and self._lower(w - 1) in SUBORDINATORS
+        )
+
+    def _is_subject(self, w: int) -> bool:
+        """
+        Whether the word starts a subject other than a party mention, e.g. "Das
+        Landgericht" or "Es" at the start of a clause.
+        """
+        lower = self.lowers[w]
+        if lower in ("er", "es", "ich", "wir"):
+            return True
+        if lower == "sie":
+            return self._opens_clause(w)
+        return (
+            w > 0
+            and self.texts[w][0].isupper()
+            and self._lower(w - 1) in ("der", "die", "das", "ein", "eine")
+            and self._opens_clause(w - 1)
+        )
+
+    # Mentions
+
+    def _mention(self, w: int):
+        noun = self._word(w)
+        party = (
+            Appellant.PLAINTIFF if noun.startswith("Kläger") else Appellant.DEFENDANT
+        )
+
+        # Determiner and up to two weakly inflected adjectives before the noun
+        adjectives: List[int] = []
+        d = w - 1
+        while (
+            len(adjectives) < 2
+            and self._joined(d, w)
+            and self._word(d).islower()
+            and re.fullmatch(r"\w+(e|en|er)", self._word(d))
+            and self._lower(d) not in DETERMINERS | PREPOSITIONS
+        ):
+            adjectives.insert(0, d)
+            d -= 1
+        det = self._lower(d) if self._joined(d, w) else ""
+        if det not in DETERMINERS:
+            det, d, adjectives = "", w, []
+        prep = self._lower(d - 1) if self._joined(d - 1, w) else ""
+        prep = prep if prep in PREPOSITIONS else ""
+
+        analysis = self._analyze(party, noun, det, prep, d)
+        if analysis is None:
+            self.uncertain += party == self.appellant
+            return
+        gender, case, certain = analysis
+        if case == NOM:
+            self.subjects.add(self.clause[w])
+
+        is_appellant = party == self.appellant and gender == self.source
+        if party == self.appellant and gender != self.source:
+            # The text disagrees with the label
+            self.uncertain += 1
+        if not is_appellant:
+            self.mentions.append(_Mention(w, self.sentence[w], False, {gender.value}))
+            return
+
+        self.mentions.append(_Mention(w, self.sentence[w], True, {self.source.value}))
+        if certain:
+            self.certain += 1
+        else:
+            self.uncertain += 1
+
+        kind = (
+            "contraction"
+            if det in CONTRACTIONS
+            else "indefinite" if det.startswith("ein") else "definite" if det else ""
+        )
+        if kind == "contraction" or (
+            kind == "definite" and case == DAT and prep in ("von", "zu", "bei")
+        ):
+            self._set_contraction(det, d, prep, kind)
+        elif kind:
+            table = DEFINITE if kind == "definite" else INDEFINITE
+            self._set(d, table[self.target][case])
+        for a in adjectives:
+            self._set(a, _adjective(self._word(a), self.target, case, kind))
+        self._set(w, _noun(party, self.target, case, kind))
+        self._relative(w)
+
+    def _analyze(self, party: Appellant, noun: str, det: str, prep: str, d: int):
+        """
+        Return the gender and case of a party mention and whether they are certain,
+        or ``None`` for plural and other forms that are not rewritten.
+        """
+        if det in CONTRACTIONS:
+            return CONTRACTIONS[det][1], DAT, True
+
+        m, f = MASCULINE, FEMININE
+        if party == Appellant.PLAINTIFF:
+            if noun == "Klägerin":
+                forms = {"die": (f, NOM, AKK), "eine": (f, NOM, AKK)}
+                forms |= {"der": (f, GEN, DAT), "einer": (f, GEN, DAT), "": (f, NOM)}
+            elif noun == "Klägers":
+                forms = {"des": (m, GEN), "eines": (m, GEN), "": (m, GEN)}
+            else:
+                forms = {"der": (m, NOM), "dem": (m, DAT), "den": (m, AKK)}
+                forms |= {"ein": (m, NOM), "einem": (m, DAT), "einen": (m, AKK)}
+                forms |= {"": (m, NOM)}
+        else:
+            if noun == "Beklagte":
+                forms = {"der": (m, NOM), "die": (f, NOM, AKK), "eine": (f, NOM, AKK)}
+                forms |= {"": (f, NOM)}
+            elif noun == "Beklagter":
+                forms = {"ein": (m, NOM), "": (m, NOM)}
+            else:
+                forms = {"des": (m, GEN), "dem": (m, DAT), "den": (m, AKK)}
+                forms |= {"eines": (m, GEN), "einem": (m, DAT), "einen": (m, AKK)}
+                forms |= {"der": (f, GEN, DAT), "einer": (f, GEN, DAT)}
+        if det not in forms:
+            return None
+
+        gender, *cases = forms[det]
+        if len(cases) == 1:
+            return gender, cases[0], True
+        if cases == [NOM, AKK]:
+            if prep:
+                return gender, AKK, True
+            if self._opens_clause(d):
+                return gender, NOM, True
+            if self.clause[d] in self.subjects:
+                return gender, AKK, False
+            return gender, NOM, False
+        if prep:
+            return gender, GEN if prep in GEN_PREPOSITIONS else DAT, True
+        # "der Antrag der Klägerin" vs. "teilte der Klägerin mit"
+        before = self._word(d - 1) if self._joined(d - 1, d) else ""
+        return gender, GEN if before[:1].isupper() else DAT, False
+
+    def _set_contraction(self, det: str, d: int, prep: str, kind: str):
+        """
+        Rewrite "vom Kläger" to "von der Klägerin" and "von der Klägerin" to
+        "vom Kläger".
+        """
+        if kind == "contraction":
+            preposition, _ = CONTRACTIONS[det]
+            contraction = CONTRACT.get((preposition, self.target))
+            self._set(d, contraction or f"{preposition} {DEFINITE[self.target][DAT]}")
+        else:
+            contraction = CONTRACT.get((prep, self.target))
+            if contraction:
+                self._set(d - 1, contraction)
+                self._drop(d)
+            else:
+                self._set(d, DEFINITE[self.target][DAT])
+
+    def _relative(self, w: int):
+        """
+        Rewrite the relative pronoun of "der Kläger, der ..." and the like.
+        """
+        r = w + 1
+        if r >= len(self.words) or self.tokens[self.words[w] + 1].strip() != ",":
+            return
+        forms = RELATIVE_PRONOUNS[self.source]
+        if self._lower(r) not in forms:
+            return
+        case = forms[self._lower(r)]
+        if case is None:
+            # "die" is the subject or the object of the relative clause
+            case = NOM
+            self.uncertain += 1
+        else:
+            self.certain += 1
+        if case == NOM:
+            self.subjects.add(self.clause[r])
+        self._set(r, RELATIVE_FORMS[self.target][case])
+
+    # Role nouns
+
+    def _roles(self) -> Set[int]:
+        """
+        Return the role nouns of the appellant: in apposition to a mention ("der
+        Kläger, ein Rechtsanwalt,"), as its predicate ("die Beklagte ist Ärztin")
+        or after "als" in a sentence that mentions it ("als Geschäftsführer").
+        """
+        candidates = []
+        mentioned = {m.sentence for m in self.mentions if m.appellant}
+        for m in self.mentions:
+            if not m.appellant:
+                continue
+            w = m.position
+            # The comma after the mention opens the clause of the apposition
+            if (
+                w + 1 < len(self.words)
+                and self.tokens[self.words[w] + 1].strip() == ","
+            ):
+                candidates.append(self._head(w + 1))
+            # The copula follows the subject, possibly after an adverb or two
+            for c in range(w + 1, w + 4):
+                if self._joined(w, c) and self._lower(c) in COPULAS:
+                    if self._joined(c, r := self._head(c + 1)):
+                        candidates.append(r)
+                    break
+        for w, lower in enumerate(self.lowers):
+            if lower == "als" and self.sentence[w] in mentioned:
+                if self._joined(w, r := self._head(w + 1)):
+                    candidates.append(r)
+        return {r for r in candidates if self._is_role(r)}
+
+    def _head(self, w: int) -> int:
+        """
+        Skip the determiner and adjectives of the noun phrase starting at the word.
+        """
+        start = w
+        while (
+            w < len(self.words)
+            and w - start < 3
+            and self._joined(start, w)
+            and self._word(w).islower()
+            and (
+                self._lower(w) in DETERMINERS | {"kein", "keine"}
+                or re.fullmatch(r"\w+(e|en|er|es|em)", self._word(w))
+            )
+        ):
+            w += 1
+        return w
+
+    def _is_role(self, w: int) -> bool:
+        if w >= len(self.words):
+            return False
+        word = self._word(w)
+        lower = word.lower()
+        return (
+            word[0].isupper()
+            and word not in PARTY_NOUNS
+            and lower.endswith(ROLE_ENDINGS)
+            and not lower.endswith(NON_ROLE_ENDINGS)
+        )
+
+    # Pronouns
+
+    def _pronoun_gender(self, w: int) -> Optional[GrammaticalGender]:
+        word = self._word(w)
+        lower = word.lower()
+        if word[0].isupper() and w > 0 and self.sentence[w] == self.sentence[w - 1]:
+            # Polite form "Sie"/"Ihr"
+            return None
+        if lower in PERSONAL_PRONOUNS[self.source] or lower == "seiner":
+            return self.source
+        stem = POSSESSIVE_STEMS[self.source]
+        if lower == "sein" and not self._possessive(w):
+            # The verb "sein"
+            return None
+        if lower.startswith(stem) and lower[len(stem) :] in POSSESSIVE_ENDINGS:
+            return self.source
+        return None
+
+    def _possessive(self, w: int) -> Optional[bool]:
+        """
+        Whether "sein"/"ihr" is a possessive ("ihr Antrag", "ihr früheres Haus"):
+        ``True`` if a noun follows, ``None`` if an adjective may follow.
+        """
+        following = self._word(w + 1) if self._joined(w, w + 1) else ""
+        if following[:1].isupper():
+            return True
+        if (
+            re.fullmatch(r"[a-zäöüß]+(e|en|er|es|em)", following)
+            and self._joined(w + 1, w + 2)
+            and self._word(w + 2)[:1].isupper()
+        ):
+            return None
+        return False
+
+    def _pronoun(self, w: int):
+        refers, certain = self._antecedent(w)
+        if not refers:
+            self.uncertain += 1
+            return
+
+        lower = self._lower(w)
+        stem = POSSESSIVE_STEMS[self.source]
+        case = PERSONAL_PRONOUNS[self.source].get(lower, GEN)
+        if lower == "ihr":
+            possessive = self._possessive(w)
+            if self._lower(w - 1) in DETERMINERS:
+                # "das ihr gehörende Grundstück"
+                possessive = False
+            certain = certain and possessive is not None
+            case = GEN if possessive in (True, None) else DAT
+        elif lower == "sie":
+            # Subject or object
+            prep = self._lower(w - 1) if self._joined(w - 1, w) else ""
+            if prep in PREPOSITIONS:
+                case = AKK
+            elif self._opens_clause(w):
+                case = NOM
+            else:
+                certain = False
+                case = AKK if self.clause[w] in self.subjects else NOM
+
+        if case == GEN:
+            # Possessives and the genitive "seiner"/"ihrer" only swap the stem
+            self._set(w, POSSESSIVE_STEMS[self.target] + lower[len(stem) :])
+        else:
+            self._set(w, PERSONAL_FORMS[self.target][case])
+        if case == NOM:
+            self.subjects.add(self.clause[w])
+        if certain:
+            self.certain += 1
+        else:
+            self.uncertain += 1
+
+    def _antecedent(self, w: int):
+        """
+        Return whether a pronoun refers to the appellant, and whether that is
+        certain: the closest party mention of the pronoun's gender within the
+        current and previous sentence is the appellant, and no other party of
+        that gender is mentioned in between.
+        """
+        gender = self.source.value
+        window: List[_Mention] = []
+        for m in reversed(self.mentions):
+            if m.sentence < self.sentence[w] - 1:
+                break
+            if gender in m.genders:
+                window.insert(0, m)
+        if not window or not window[-1].appellant:
+            return False, False
+        others = [m for m in window if not m.appellant]
+        # A noun of the pronoun's gender between the mention and the pronoun
+        between = any(
+            self._lower(v) in _DISTRACTORS[self.source]
+            and self._word(v + 1)[:1].isupper()
+            and self._word(v + 1) not in PARTY_NOUNS
+            for v in range(window[-1].position + 1, w - 1)
+        )
+        return True, not others and not between
+
+
+_DISTRACTORS = {
+    MASCULINE: {"den", "dem", "des", "einen", "einem", "eines"},
+    FEMININE: {"die", "eine", "einer"},
+}
+
+
+def _adjective(word: str, gender: GrammaticalGender, case: str, kind: str) -> str:
+    """
+    Inflect an adjective between a determiner and a party noun.
+    """
+    stem = re.sub(r"(en|er|e)$", "", word)
+    if kind == "indefinite" and gender == MASCULINE and case == NOM:
+        return stem + "er"
+    if case == NOM or (gender == FEMININE and case == AKK):
+        return stem + "e"
+    return stem + "en"
+
+
+def _noun(party: Appellant, gender: GrammaticalGender, case: str, kind: str) -> str:
+    if party == Appellant.PLAINTIFF:
+        if gender == FEMININE:
+            return "Klägerin"
+        return "Klägers" if case == GEN else "Kläger"
+    if gender == MASCULINE and case == NOM:
+        return "Beklagte" if kind in ("definite", "contraction") else "Beklagter"
+    if gender == FEMININE and case in (NOM, AKK):
+        return "Beklagte"
+    return "Beklagten"
+
+
+def report(thresholds=(0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)):
+    """
+    Compare the rule-based swaps with the LLM augmentations, by confidence.
+    """
+    documents = load_documents_augmented()
+    if not documents:
+        print("No augmented documents to compare with.")
+        return
+
+    started = time.perf_counter()
+    results = [
+        swap_gender(
+            doc["facts"],
+            Appellant(doc["appellant"]),
+            GrammaticalGender(doc["appellant_gender"]),
+        )
+        for doc in documents
+    ]
+    elapsed = time.perf_counter() - started
+    print(f"Swapped {len(documents)} documents in {elapsed:.2f} s")
+
+    scores = []
+    for doc, result in zip(documents, results):
+        rule_words = flatten_text(result.text).split()
+        llm_words = flatten_text(doc["facts_augmented"]).split()
+        similarity = difflib.SequenceMatcher(
+            None, rule_words, llm_words, autojunk=False
+        ).ratio()
+        scores.append((result.confidence, rule_words == llm_words, similarity))
+
+    print(f"{'confidence':>10} {'coverage':>9} {'exact':>7} {'similarity':>11}")
+    for threshold in thresholds:
+        selected = [s for s in scores if s[0] >= threshold]
+        if not selected:
+            print(f"{threshold:>10.2f} {0:>9.1%} {'-':>7} {'-':>11}")
+            continue
+        exact = sum(s[1] for s in selected) / len(selected)
+        similarity = sum(s[2] for s in selected) / len(selected)
+        print(
+            f"{threshold:>10.2f} {len(selected) / len(scores):>9.1%} "
+            f"{exact:>7.1%} {similarity:>11.4f}"
+        )
+
+    # Documents whose role nouns of the appellant are left as they are
+    with_roles = [s for s, result in zip(scores, results) if result.roles]
+    print(
+        f"Role nouns of the appellant in {len(with_roles)} documents"
+        + (
+            f": {sum(s[1] for s in with_roles) / len(with_roles):.1%} exact, "
+            f"similarity {sum(s[2] for s in with_roles) / len(with_roles):.4f}"
+            if with_roles
+            else ""
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.parse_args()
+    report()
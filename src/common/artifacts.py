@@ -0,0 +1,359 @@
+"""
+This module stores the documents written by the stages, either as the JSONL files
+of the stages (``ARTIFACT_FORMAT=jsonl``, the default) or as a columnar store of
+Arrow tables (``ARTIFACT_FORMAT=arrow``).
+
+In the columnar store, each stage writes only the columns it adds to the
+documents, keyed by ``id``: ``text.arrow`` holds the text of the PDFs,
+``parsed.arrow`` the facts and the operative part, ``labeled.arrow`` the labels
+and ``augmented.arrow`` the augmented facts, while the metadata stays in
+``CASE_IDS_JSONL``. The raw text is thus stored once instead of in every later
+artifact. The tables are uncompressed Arrow IPC files, which are memory-mapped
+when read: ``join`` assembles the documents of a stage from its table and those
+of the previous stages without copying the columns whose rows line up, and
+without reading the columns that aren't asked for.
+
+PyArrow is imported on first use (it is installed with ``datasets``). The JSONL
+files and the Hugging Face dataset of the notebook are exported from the store,
+and existing JSONL files are imported into it, with::
+
+    python -m src.common.artifacts export
+    python -m src.common.artifacts export --dataset
+    python -m src.common.artifacts import
+"""
+
+import argparse
+import json
+import os
+from enum import Enum
+from functools import cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+from uuid import UUID
+
+from httpx import URL
+
+from src.common import config
+from src.common.types import (
+    DocumentAugmented,
+    DocumentLabeled,
+    DocumentParsed,
+    DocumentText,
+    ScrapingID,
+)
+
+# The stages in pipeline order, with the type of their documents
+STAGES = {
+    "ids": ScrapingID,
+    "text": DocumentText,
+    "parsed": DocumentParsed,
+    "labeled": DocumentLabeled,
+    "augmented": DocumentAugmented,
+}
+# The stages that write documents, as opposed to the scraped IDs
+STAGES_WRITTEN = ("text", "parsed", "labeled", "augmented")
+# Rows per record batch of the written tables
+BATCH_SIZE = 1024
+JSON_BLOCK_SIZE = 64 << 20
+
+
+def columns(stage: str) -> List[str]:
+    """
+    The columns a stage adds to the documents of the previous stage.
+    """
+    names = list(STAGES)
+    inherited = STAGES[names[names.index(stage) - 1]] if stage != "ids" else None
+    return [
+        name
+        for name in STAGES[stage].__annotations__
+        if inherited is None or name not in inherited.__annotations__
+    ]
+
+
+def jsonl_path(stage: str) -> Path:
+    return {
+        "ids": config.CASE_IDS_JSONL,
+        "text": config.DOCS_TEXT_JSONL,
+        "parsed": config.DOCS_PARSED_JSONL,
+        "labeled": config.DOCS_LABELED_JSONL,
+        "augmented": config.DOCS_AUGMENTED_JSONL,
+    }[stage]
+
+
+def table_path(stage: str) -> Path:
+    return config.ARTIFACTS_DIR / f"{stage}.arrow"
+
+
+def write(stage: str, documents: List[dict]):
+    """
+    Write the documents of a stage in the configured format.
+    """
+    if config.ARTIFACT_FORMAT == "arrow":
+        _write_table(stage, documents)
+        return
+
+    content = "\n".join(json.dumps(r, default=lambda x: str(x)) for r in documents)
+    jsonl_path(stage).write_text(content, encoding="utf-8")
+
+
+def read(stage: str) -> Iterator[dict]:
+    """
+    Yield the documents of a stage from the store, with all their fields.
+    """
+    for batch in join(stage).to_batches(BATCH_SIZE):
+        for doc in batch.to_pylist():
+            if doc_id := doc.get("id"):
+                doc["id"] = UUID(doc_id)
+            if url := doc.get("url"):
+                doc["url"] = URL(url)
+            yield doc
+
+
+def table(stage: str, artifact_format: Optional[str] = None):
+    """
+    The table of the columns a stage adds, with its ``id`` column. Tables of the
+    store are memory-mapped; from JSONL files (the default with
+    ``ARTIFACT_FORMAT=jsonl``), the columns are parsed.
+    """
+    pa = _pyarrow()
+    artifact_format = artifact_format or config.ARTIFACT_FORMAT
+    if artifact_format != "arrow" or stage == "ids":
+        return _read_jsonl_columns(stage)
+    return pa.ipc.open_file(pa.memory_map(str(table_path(stage)))).read_all()
+
+
+def join(
+    stage: str,
+    select: Optional[List[str]] = None,
+    artifact_format: Optional[str] = None,
+):
+    """
+    The documents of a stage as a table with the columns of the stage and all
+    previous stages (or only those in ``select``). Columns of tables whose rows
+    line up with those of the stage are used as they are; the others are
+    gathered for the rows of the stage.
+    """
+    pa = _pyarrow()
+    pc = _compute()
+
+    base = table(stage, artifact_format)
+    ids = base.column("id")
+    joined = {"id": ids}
+    for upstream in list(STAGES)[: list(STAGES).index(stage) + 1]:
+        wanted = [
+            name
+            for name in columns(upstream)
+            if name != "id" and (select is None or name in select)
+        ]
+        if not wanted:
+            continue
+        t = base if upstream == stage else table(upstream, artifact_format)
+        if t.num_rows != len(ids) or not t.column("id").equals(ids):
+            indices = pc.index_in(ids, value_set=t.column("id"))
+            if indices.null_count:
+                raise ValueError(f"{stage} has documents missing from {upstream}")
+            t = t.select(wanted).take(indices)
+        for name in wanted:
+            joined[name] = t.column(name)
+
+    if select is not None and "id" not in select:
+        del joined["id"]
+    return pa.table(joined)
+
+
+def select(stage: str, ids: Set[UUID]) -> Iterator[dict]:
+    """
+    Yield the documents of a stage with the given ids from the store, as they
+    are written to its JSONL file.
+    """
+    if not ids or not table_path(stage).exists():
+        return
+    pa = _pyarrow()
+    pc = _compute()
+    t = join(stage, artifact_format="arrow")
+    t = t.filter(pc.is_in(t.column("id"), value_set=pa.array(map(str, ids))))
+    for batch in t.to_batches(BATCH_SIZE):
+        yield from batch.to_pylist()
+
+
+def merge(stage: str, documents: Dict[UUID, Optional[dict]], order: Dict[UUID, int]):
+    """
+    Replace the given documents of a stage in the store (removing those that are
+    None) and keep its rows in the order of the scraping IDs.
+    """
+    pa = _pyarrow()
+    pc = _compute()
+    added = _to_table(stage, [doc for doc in documents.values() if doc is not None])
+    if table_path(stage).exists():
+        kept = table(stage, artifact_format="arrow")
+        replaced = pa.array([str(document_id) for document_id in documents])
+        kept = kept.filter(pc.invert(pc.is_in(kept.column("id"), value_set=replaced)))
+        merged = pa.concat_tables([kept, added.cast(kept.schema)])
+    else:
+        merged = added
+    # Documents that aren't scraped (anymore) go last, in their previous order
+    ranks = [
+        order.get(UUID(document_id), len(order))
+        for document_id in merged.column("id").to_pylist()
+    ]
+    merged = merged.append_column("rank", pa.array(ranks, pa.int64()))
+    _write(stage, merged.sort_by("rank").drop_columns(["rank"]))
+
+
+def import_jsonl(stage: str):
+    """
+    Write the table of a stage from its JSONL file.
+    """
+    _write(stage, _read_jsonl_columns(stage))
+
+
+def export_jsonl(stage: str):
+    """
+    Write the JSONL file of a stage from the store, as the stage would.
+    """
+    path = jsonl_path(stage)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".partial")
+    with temporary.open("w", encoding="utf-8") as f:
+        batches = join(stage, artifact_format="arrow").to_batches(BATCH_SIZE)
+        for i, doc in enumerate(doc for b in batches for doc in b.to_pylist()):
+            if i:
+                f.write("\n")
+            f.write(json.dumps(doc, default=lambda x: str(x)))
+    os.replace(temporary, path)
+
+
+def export_dataset(path: Optional[Path] = None):
+    """
+    Split the augmented documents into the train and test sets of the notebook
+    and save them as a Hugging Face dataset.
+    """
+    import pandas as pd
+    from datasets import Dataset, DatasetDict
+    from sklearn.model_selection import train_test_split
+
+    # As in the notebook, the JSONL file is read with the types pandas infers
+    if config.ARTIFACT_FORMAT == "arrow":
+        df = join("augmented").to_pandas().sort_values(by="id")
+    else:
+        df = pd.read_json(config.DOCS_AUGMENTED_JSONL, lines=True).sort_values(by="id")
+    train_unbalanced, test = train_test_split(
+        df, test_size=1 / 3, stratify=df.decision, random_state=42, shuffle=True
+    )
+    # Undersample the majority class of the training set
+    n = train_unbalanced.decision.value_counts().min()
+    train = (
+        train_unbalanced.groupby("decision")
+        .sample(n=n, random_state=42)
+        .sample(frac=1, random_state=42)
+    )
+    dataset = DatasetDict(
+        {
+            "train": Dataset.from_pandas(train.reset_index(drop=True)),
+            "test": Dataset.from_pandas(test.reset_index(drop=True)),
+        }
+    )
+    dataset.save_to_disk(path or config.DATA_DIR / "BGH-CivAppeals-GenderCF")
+
+
+def _write_table(stage: str, documents: List[dict]):
+    _write(stage, _to_table(stage, documents))
+
+
+def _to_table(stage: str, documents: List[dict]):
+    pa = _pyarrow()
+    names = ["id", *columns(stage)]
+    return pa.table(
+        {
+            name: pa.array([_plain(doc[name]) for doc in documents], pa.string())
+            for name in names
+        }
+    )
+
+
+def _write(stage: str, t):
+    pa = _pyarrow()
+    path = table_path(stage)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Readers may have the old table mapped, so it is replaced, not overwritten
+    temporary = path.with_name(path.name + ".partial")
+    with pa.OSFile(str(temporary), "wb") as sink, pa.ipc.new_file(
+        sink, t.schema
+    ) as writer:
+        writer.write_table(t, max_chunksize=BATCH_SIZE)
+    os.replace(temporary, path)
+
+
+def _read_jsonl_columns(stage: str):
+    """
+    Parse the columns a stage adds (and ``id``) from its JSONL file. Text columns
+    are read as strings, also where they are null in every document.
+    """
+    pa = _pyarrow()
+    import pyarrow.json
+
+    names = columns(stage) if stage == "ids" else ["id", *columns(stage)]
+    schema = pa.schema(
+        (name, pa.int64() if name == "year" else pa.string()) for name in names
+    )
+    path = jsonl_path(stage)
+    # PyArrow refuses to read a file without documents
+    if path.stat().st_size == 0:
+        return schema.empty_table()
+    t = pyarrow.json.read_json(
+        path,
+        # A block must hold the longest document
+        read_options=pyarrow.json.ReadOptions(block_size=JSON_BLOCK_SIZE),
+        parse_options=pyarrow.json.ParseOptions(
+            explicit_schema=schema, unexpected_field_behavior="ignore"
+        ),
+    )
+    return t.select(names)
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if value is None:
+        return None
+    return str(value)
+
+
+@cache
+def _pyarrow():
+    import pyarrow as pa
+
+    return pa
+
+
+@cache
+def _compute():
+    import pyarrow.compute as pc
+
+    return pc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser(
+        "export", help="Write the JSONL files of the stages from the store."
+    )
+    export.add_argument(
+        "--dataset", action="store_true", help="Also save the Hugging Face dataset."
+    )
+    subparsers.add_parser("import", help="Write the store from the JSONL files.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for stage in STAGES_WRITTEN:
+            if table_path(stage).exists():
+                export_jsonl(stage)
+                print(f"Exported {stage} to {jsonl_path(stage)}")
+        if args.dataset:
+            export_dataset()
+    elif args.command == "import":
+        for stage in STAGES_WRITTEN:
+            if jsonl_path(stage).exists():
+                import_jsonl(stage)
+                print(f"Imported {stage} to {table_path(stage)}")
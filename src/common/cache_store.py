@@ -0,0 +1,345 @@
+"""
+This module provides the storage backends for the scraping cache.
+
+Two backends are available:
+
+- ``DirectoryStore`` is the legacy layout with one file per cache key.
+- ``PackStore`` appends all entries to a few large, segmented pack files and
+  keeps an in-memory index from key to (segment, offset, length).
+
+Both backends store the values as they are given; compression is left to the
+codecs in ``src.common.codecs``.
+
+Each record in a pack file consists of a fixed-size header (magic, key length,
+value length, CRC32), followed by the key and the value. Records are only ever
+appended; a later record for the same key supersedes the earlier one, and a
+record with an empty value deletes the key (entries are never empty). The index
+is rebuilt from the record headers when the store is opened, a torn record at
+the end of a segment (e.g. after a crash) is ignored and truncated before the
+next append. Appends are serialized with a lock file, so several processes can
+share one store. ``compact`` rewrites the live records into fresh segments and
+drops the superseded ones.
+
+Existing caches can be moved to the pack layout with::
+
+    python -m src.common.cache_store migrate
+"""
+
+import argparse
+import gzip
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Protocol, Tuple
+
+from tqdm import tqdm
+
+from src.common import config
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+RECORD_MAGIC = b"BGCP"
+RECORD_HEADER = struct.Struct("<4sHII")
+SEGMENT_PATTERN = "segment-*.pack"
+DEFAULT_MAX_SEGMENT_BYTES = 256 * 1024 * 1024
+
+
+class CacheStore(Protocol):
+    def get(self, key: str) -> Optional[bytes]: ...
+
+    def set(self, key: str, value: bytes): ...
+
+    def keys(self) -> Iterator[str]: ...
+
+    def delete(self, key: str): ...
+
+
+class DirectoryStore:
+    """
+    Legacy backend storing every entry in its own ``<key>.bin`` file. Entries
+    written before the codec layer existed are read from ``<key>.gz``.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return (self.directory / f"{key}.bin").read_bytes()
+        except FileNotFoundError:
+            pass
+        try:
+            with gzip.open(self.directory / f"{key}.gz", "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes):
+        (self.directory / f"{key}.bin").write_bytes(value)
+
+    def keys(self) -> Iterator[str]:
+        seen = set()
+        for fp in self.directory.iterdir():
+            if fp.suffix in (".bin", ".gz") and (key := fp.stem) not in seen:
+                seen.add(key)
+                yield key
+
+    def delete(self, key: str):
+        (self.directory / f"{key}.bin").unlink(missing_ok=True)
+        (self.directory / f"{key}.gz").unlink(missing_ok=True)
+
+
+class PackStore:
+    """
+    Backend appending all entries to segmented pack files.
+    """
+
+    def __init__(
+        self, directory: Path, max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES
+    ):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_segment_bytes = max_segment_bytes
+
+        self._lock = threading.RLock()
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        self._scanned: Dict[int, int] = {}
+        self._read_fds: Dict[int, int] = {}
+        self._refresh()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._index.get(key)
+        if entry is None:
+            # Another process may have appended the entry in the meantime
+            with self._lock:
+                self._refresh()
+                entry = self._index.get(key)
+            if entry is None:
+                return None
+
+        segment, offset, length = entry
+        try:
+            record = os.pread(self._read_fd(segment), length, offset)
+        except FileNotFoundError:
+            # The segment was compacted away by another process, re-index
+            with self._lock:
+                self._index, self._scanned = {}, {}
+                self._refresh()
+            return self.get(key)
+        return _decode_record(record, key)
+
+    def set(self, key: str, value: bytes):
+        if not value:
+            raise ValueError("Empty values mark deleted entries")
+        self._append(key, value)
+
+    def delete(self, key: str):
+        if self.get(key) is not None:
+            self._append(key, b"")
+
+    def keys(self) -> Iterator[str]:
+        with self._lock:
+            self._refresh()
+            return iter(list(self._index))
+
+    def compact(self):
+        """
+        Rewrite the live records into new segments and remove the old ones.
+        """
+        with self._lock, self._write_lock():
+            self._refresh(truncate_torn=True)
+            old_segments = sorted(self._scanned)
+            first_new = (old_segments[-1] + 1) if old_segments else 0
+
+            segment, size = first_new, 0
+            fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT)
+            try:
+                for key, (old_segment, offset, length) in self._index.items():
+                    record = os.pread(self._read_fd(old_segment), length, offset)
+                    if _decode_record(record, key) is None:
+                        continue
+                    if size and size + length > self.max_segment_bytes:
+                        os.fsync(fd)
+                        os.close(fd)
+                        segment, size = segment + 1, 0
+                        fd = os.open(
+                            self._segment_path(segment), os.O_WRONLY | os.O_CREAT
+                        )
+                    os.write(fd, record)
+                    size += length
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            # The new segments are complete, only now drop the old ones
+            for old_segment in old_segments:
+                if read_fd := self._read_fds.pop(old_segment, None):
+                    os.close(read_fd)
+                self._segment_path(old_segment).unlink()
+
+            self._index = {}
+            self._scanned = {}
+            self._refresh()
+
+    def _append(self, key: str, value: bytes):
+        record = _encode_record(key, value)
+        with self._lock, self._write_lock():
+            self._refresh(truncate_torn=True)
+            segment = self._active_segment(len(record))
+            fd = os.open(
+                self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND
+            )
+            try:
+                offset = os.fstat(fd).st_size
+                os.write(fd, record)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            if value:
+                self._index[key] = (segment, offset, len(record))
+            else:
+                self._index.pop(key, None)
+            self._scanned[segment] = offset + len(record)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"segment-{segment:05d}.pack"
+
+    def _read_fd(self, segment: int) -> int:
+        if (fd := self._read_fds.get(segment)) is None:
+            fd = os.open(self._segment_path(segment), os.O_RDONLY)
+            self._read_fds[segment] = fd
+        return fd
+
+    def _active_segment(self, record_size: int) -> int:
+        """
+        Return the segment to append to, starting a new one when it is full.
+        """
+        if not self._scanned:
+            return 0
+        segment = max(self._scanned)
+        size = self._scanned[segment]
+        if size and size + record_size > self.max_segment_bytes:
+            return segment + 1
+        return segment
+
+    def _refresh(self, truncate_torn: bool = False):
+        """
+        Index all records appended since the last scan.
+        """
+        for fp in sorted(self.directory.glob(SEGMENT_PATTERN)):
+            segment = int(fp.stem.removeprefix("segment-"))
+            offset = self._scanned.get(segment, 0)
+            file_size = fp.stat().st_size
+            if offset >= file_size:
+                continue
+
+            with fp.open("rb") as f:
+                f.seek(offset)
+                while offset + RECORD_HEADER.size <= file_size:
+                    magic, key_len, value_len, _ = RECORD_HEADER.unpack(
+                        f.read(RECORD_HEADER.size)
+                    )
+                    length = RECORD_HEADER.size + key_len + value_len
+                    if magic != RECORD_MAGIC or offset + length > file_size:
+                        break
+                    key = f.read(key_len).decode("utf-8")
+                    f.seek(value_len, os.SEEK_CUR)
+                    if value_len:
+                        self._index[key] = (segment, offset, length)
+                    else:
+                        self._index.pop(key, None)
+                    offset += length
+
+            self._scanned[segment] = offset
+            if truncate_torn and offset < file_size:
+                # Only called while holding the write lock, so this is a torn append
+                os.truncate(fp, offset)
+
+    @contextmanager
+    def _write_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / "write.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _encode_record(key: str, value: bytes) -> bytes:
+    key_bytes = key.encode("utf-8")
+    crc = zlib.crc32(value, zlib.crc32(key_bytes))
+    header = RECORD_HEADER.pack(RECORD_MAGIC, len(key_bytes), len(value), crc)
+    return header + key_bytes + value
+
+
+def _decode_record(record: bytes, key: str) -> Optional[bytes]:
+    """
+    Return the value of a record, or None if the record is damaged.
+    """
+    if len(record) < RECORD_HEADER.size:
+        return None
+    magic, key_len, value_len, crc = RECORD_HEADER.unpack_from(record)
+    key_bytes = record[RECORD_HEADER.size : RECORD_HEADER.size + key_len]
+    value = record[RECORD_HEADER.size + key_len :]
+    if (
+        magic != RECORD_MAGIC
+        or key_bytes != key.encode("utf-8")
+        or len(value) != value_len
+        or zlib.crc32(value, zlib.crc32(key_bytes)) != crc
+    ):
+        return None
+    return value
+
+
+def open_scraping_store(backend: Optional[str] = None) -> CacheStore:
+    """
+    Open the scraping cache with the configured backend ("directory" or "pack").
+    """
+    match backend or config.SCRAPING_CACHE_BACKEND:
+        case "directory":
+            return DirectoryStore(config.SCRAPING_CACHE)
+        case "pack":
+            return PackStore(config.SCRAPING_PACK_CACHE)
+        case other:
+            raise ValueError(f"Unknown scraping cache backend: {other}")
+
+
+def migrate(source: CacheStore, target: CacheStore) -> int:
+    """
+    Copy every entry from one store to another. Returns the number of entries copied.
+    """
+    n = 0
+    for key in tqdm(list(source.keys()), desc="Migrating cache"):
+        if (value := source.get(key)) is not None:
+            target.set(key, value)
+            n += 1
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "migrate", help="Copy the legacy directory cache into the pack store."
+    )
+    subparsers.add_parser(
+        "compact", help="Drop superseded records from the pack store."
+    )
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        copied = migrate(open_scraping_store("directory"), open_scraping_store("pack"))
+        print(f"Migrated {copied} entries to {config.SCRAPING_PACK_CACHE}")
+    elif args.command == "compact":
+        open_scraping_store("pack").compact()
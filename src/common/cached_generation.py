@@ -1,30 +1,70 @@
 """
 This module provides functions to interact with OpenAI's API for generating
+completions, caching every response.
+
+Concurrent cache misses for the same key share a single request (see
+``_single_flight``).
+
+While requests are collected for a batch job (see ``collecting`` and
+``src.common.generation_batch``), a cache miss records the request instead of
+sending it and raises ``Deferred``.
 """
 
 import asyncio
 import json
-import pickle
+import math
+import os
+import re
+import socket
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from enum import Enum
+from functools import cache
 from hashlib import md5
-from typing import Optional, TypeVar
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
-from openai import APIConnectionError, AsyncOpenAI, RateLimitError
 from pydantic import BaseModel
 from tenacity import (
-    retry,
-    retry_if_exception_type,
+    AsyncRetrying,
+    retry_if_exception,
     stop_after_attempt,
     wait_random_exponential,
 )
 
-from src.common import config
+from src.common import config, generation_store, telemetry, token_budget
+from src.common.generation_store import COMPLETION_DICTIONARY, GenerationStore
 from src.common.types import Message
 
-client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
 T = TypeVar("T", bound=BaseModel)
 
-config.GENERATION_CACHE.mkdir(parents=True, exist_ok=True)
+# Expected completion lengths for the token estimates, if no prediction is given
+CREATE_COMPLETION_CHARS = 2000
+PARSE_COMPLETION_CHARS = 500
+
+# Claims on keys being fetched by another process expire after CLAIM_TTL seconds;
+# the owner renews its claim while the request (and its retries) are in flight
+CLAIM_TTL = 60
+CLAIM_RENEW_INTERVAL = CLAIM_TTL / 3
+CLAIM_POLL_INTERVAL = 0.5
+
+# Members of a JSON object: "key": {, "key": "value" or the closing }
+JSON_MEMBER_PATTERN = re.compile(r'"([^"\\]*)"\s*:\s*(?:(\{)|"((?:[^"\\]|\\.)*)")|(\})')
+
+_in_flight: Dict[str, asyncio.Future] = {}
+
+_collected: ContextVar[Optional[Dict[str, dict]]] = ContextVar(
+    "collected", default=None
+)
 
 
 class Model(str, Enum):
@@ -49,25 +89,45 @@ async def create(
         )
     ).hexdigest()
 
-    if (completion := _get_cache(cache_key)) is None:
-        response = await _run_with_sema(
-            sem,
-            client.chat.completions.create,
+    started, retries = time.perf_counter(), 0
+    cache_hit = (completion := _get_cache(cache_key)) is not None
+    if not cache_hit:
+        request = dict(
             model=model.value,
             temperature=temperature,
             messages=messages,
             logprobs=True if not prediction_content else False,
             top_logprobs=3 if not prediction_content else None,
-            timeout=60,
             prediction=(
                 {"type": "content", "content": prediction_content}
                 if prediction_content
                 else None
             ),
         )
-        completion = response.model_dump(mode="json")
-        _set_cache(cache_key, completion)
+        _defer(cache_key, request)
+        completion, retries = await _single_flight(
+            cache_key,
+            lambda: _call(
+                sem,
+                _interactive_client().chat.completions.with_raw_response.create,
+                token_budget.estimate_tokens(
+                    messages, len(prediction_content) or CREATE_COMPLETION_CHARS
+                ),
+                timeout=60,
+                **request,
+            ),
+        )
+        # Served by a concurrent caller for the same key
+        cache_hit = retries is None
 
+    telemetry.record_call(
+        "create",
+        model.value,
+        cache_hit,
+        completion,
+        time.perf_counter() - started,
+        retries or 0,
+    )
     return completion["choices"][0]["message"]["content"]
 
 
@@ -81,60 +141,315 @@ async def parse(
     """
     Parse the messages using the specified model and response format.
     """
+    completion = await _parse(model, messages, response_format, temperature, sem)
+    return response_format(**completion["choices"][0]["message"]["parsed"])
+
+
+async def parse_with_confidence(
+    model: Model,
+    messages: list[Message],
+    response_format: type[T],
+    temperature: float = 0.0,
+    sem: Optional[asyncio.Semaphore] = None,
+) -> Tuple[T, Dict[str, float]]:
+    """
+    Like ``parse``, but also return the probability of every string value of the
+    response by its path (e.g. ``"plaintiff.type"``), see ``field_confidences``.
+    """
+    completion = await _parse(model, messages, response_format, temperature, sem)
+    parsed = response_format(**completion["choices"][0]["message"]["parsed"])
+    return parsed, field_confidences(completion)
+
+
+def field_confidences(completion: dict) -> Dict[str, float]:
+    """
+    Return the probability of every string value of a structured completion by its
+    path, from the logprobs of the tokens that make up the value. Completions
+    cached without logprobs have no confidences.
+    """
+    choice = completion["choices"][0]
+    tokens = (choice.get("logprobs") or {}).get("content") or []
+    content = choice["message"].get("content") or ""
+    if not tokens or not content:
+        return {}
+
+    # Character offsets of the tokens in the content
+    offsets, position = [], 0
+    for token in tokens:
+        offsets.append(position)
+        position += len(token["token"])
+
+    confidences = {}
+    for path, (start, end) in _value_spans(content).items():
+        logprob = sum(
+            token["logprob"]
+            for token, offset in zip(tokens, offsets)
+            if offset < end and offset + len(token["token"]) > start
+        )
+        confidences[path] = math.exp(logprob)
+    return confidences
+
+
+def _value_spans(content: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Return the character spans of the string values of a JSON object by path.
+    """
+    spans, path = {}, []
+    for m in JSON_MEMBER_PATTERN.finditer(content):
+        key, opening, value, closing = m.groups()
+        if closing:
+            if path:
+                path.pop()
+        elif opening:
+            path.append(key)
+        elif value is not None:
+            spans[".".join(path + [key])] = m.span(3)
+    return spans
+
+
+async def _parse(
+    model: Model,
+    messages: list[Message],
+    response_format: type[T],
+    temperature: float,
+    sem: Optional[asyncio.Semaphore],
+) -> dict:
+    """
+    Return the completion of a structured request, from the cache or the API.
+    Structured completions are cached with their logprobs.
+    """
     messages_dumps = tuple(json.dumps(m, sort_keys=True) for m in messages)
-    schema = json.dumps(response_format.model_json_schema(), sort_keys=True)
+    schema = _schema(response_format)
     cache_key = md5(
         f"PARSE:{model.value}:{temperature}:{messages_dumps}:{schema}".encode(
             encoding="utf-8"
         )
     ).hexdigest()
 
-    if (completion := _get_cache(cache_key)) is None:
-        response = await _run_with_sema(
-            sem,
-            client.beta.chat.completions.parse,
+    started, retries = time.perf_counter(), 0
+    cache_hit = (completion := _get_cache(cache_key)) is not None
+    if not cache_hit:
+        request = dict(
             model=model.value,
             temperature=temperature,
             messages=messages,
             response_format=response_format,
             logprobs=True,
             top_logprobs=3,
-            timeout=60,
         )
+        _defer(cache_key, request)
+        completion, retries = await _single_flight(
+            cache_key,
+            lambda: _call(
+                sem,
+                _interactive_client().beta.chat.completions.with_raw_response.parse,
+                token_budget.estimate_tokens(messages, PARSE_COMPLETION_CHARS),
+                timeout=60,
+                **request,
+            ),
+            keep_logprobs=True,
+        )
+        # Served by a concurrent caller for the same key
+        cache_hit = retries is None
+
+    telemetry.record_call(
+        "parse",
+        model.value,
+        cache_hit,
+        completion,
+        time.perf_counter() - started,
+        retries or 0,
+    )
+    return completion
+
+
+async def _single_flight(
+    key: str,
+    call: Callable[[], Awaitable[Tuple[BaseModel, int]]],
+    keep_logprobs: bool = False,
+) -> Tuple[dict, Optional[int]]:
+    """
+    Fetch and cache the completion of a cache miss, once per key: concurrent
+    callers in this process await the same future, and with
+    ``GENERATION_SHARED_LOCK`` other processes sharing the cache wait for the
+    worker holding the claim on the key. Returns the completion and the number
+    of retries, which is None if another caller fetched the completion.
+
+    If the caller fetching the completion is cancelled, the callers awaiting it
+    fetch it again instead of being cancelled with it.
+    """
+    while (future := _in_flight.get(key)) is not None:
+        if (completion := await asyncio.shield(future)) is not None:
+            return completion, None
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        result = await _fetch_claimed(key, call, keep_logprobs)
+    except asyncio.CancelledError:
+        future.set_result(None)
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved, in case no other caller is waiting
+        future.exception()
+        raise
+    else:
+        future.set_result(result[0])
+        return result
+    finally:
+        del _in_flight[key]
+
+
+async def _fetch_claimed(
+    key: str,
+    call: Callable[[], Awaitable[Tuple[BaseModel, int]]],
+    keep_logprobs: bool = False,
+) -> Tuple[dict, Optional[int]]:
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if config.GENERATION_SHARED_LOCK:
+        while not store().claim(key, owner, CLAIM_TTL):
+            await asyncio.sleep(CLAIM_POLL_INTERVAL)
+            if (completion := store().get(key)) is not None:
+                return completion, None
+        # Another worker may have stored the completion before we claimed the key
+        if (completion := store().get(key)) is not None:
+            store().release(key, owner)
+            return completion, None
+        renewal = asyncio.create_task(_renew_claim(key, owner))
+    try:
+        response, retries = await call()
         completion = response.model_dump(mode="json")
-        _set_cache(cache_key, completion)
+        return _set_cache(key, completion, keep_logprobs), retries
+    finally:
+        if config.GENERATION_SHARED_LOCK:
+            renewal.cancel()
+            store().release(key, owner)
 
-    return response_format(**completion["choices"][0]["message"]["parsed"])
 
+async def _renew_claim(key: str, owner: str):
+    """
+    Keep the claim on a key from expiring while its request is retried, however
+    long the backoff takes.
+    """
+    while True:
+        await asyncio.sleep(CLAIM_RENEW_INTERVAL)
+        store().renew(key, owner, CLAIM_TTL)
 
-@retry(
-    stop=stop_after_attempt(10),
-    wait=wait_random_exponential(multiplier=60),
-    reraise=True,
-    retry=retry_if_exception_type((APIConnectionError, RateLimitError)),
-)
-async def _run_with_sema(sem: asyncio.Semaphore, fct: callable, **kwargs):
+
+async def _call(
+    sem: Optional[asyncio.Semaphore], fct: callable, estimated_tokens: int, **kwargs
+):
     """
-    Run a function with a semaphore to limit the number of concurrent requests.
+    Send a request within the RPM/TPM budget of its model (and the semaphore, if
+    given) and return the parsed response and the number of retries. Only the
+    call itself is retried: a throttled request pauses the budget of the model
+    for all requests, so the retries only need a short backoff.
     """
-    async with sem:
-        return await fct(**kwargs)
+    budget = token_budget.budget_for(kwargs["model"])
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(10),
+        wait=wait_random_exponential(multiplier=1, max=30),
+        reraise=True,
+        retry=retry_if_exception(lambda e: _is_retryable(e)),
+    )
+    async for attempt in retrying:
+        with attempt:
+            async with sem or nullcontext():
+                async with budget.reserve(estimated_tokens) as reservation:
+                    raw = await fct(**kwargs)
+                    response = raw.parse()
+                    usage = response.usage.total_tokens if response.usage else None
+                    reservation.observe(raw.headers, usage)
+    return response, attempt.retry_state.attempt_number - 1
 
 
-def _get_cache(key: str) -> Optional[dict]:
+class Deferred(Exception):
     """
-    Get the cached completion from the cache file.
+    Raised for a cache miss while requests are collected for a batch job.
     """
+
+
+@contextmanager
+def collecting() -> Iterator[Dict[str, dict]]:
+    """
+    Collect the requests of all cache misses in this context (including tasks
+    started in it) by cache key, instead of sending them.
+    """
+    requests: Dict[str, dict] = {}
+    token = _collected.set(requests)
     try:
-        with open(config.GENERATION_CACHE / f"{key}.pkl", "rb") as f:
-            return pickle.load(f)
-    except FileNotFoundError:
-        return None
+        yield requests
+    finally:
+        _collected.reset(token)
+
+
+@cache
+def get_client():
+    """
+    Create the OpenAI client on first use, so importing the pipeline stages
+    neither imports openai nor requires an API key.
+    """
+    from openai import AsyncOpenAI
+
+    if not config.OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set (see README).")
+    return AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL)
+
+
+@cache
+def _interactive_client():
+    """
+    The client for the interactive calls, whose retries are left to ``_call``.
+    """
+    return get_client().with_options(max_retries=0)
+
+
+@cache
+def store() -> GenerationStore:
+    """
+    Return the generation cache of this process.
+    """
+    return generation_store.open_generation_store()
+
+
+def _defer(key: str, request: dict):
+    if (requests := _collected.get()) is not None:
+        requests[key] = request
+        raise Deferred(key)
+
+
+def _is_retryable(e: BaseException) -> bool:
+    from openai import APIConnectionError, RateLimitError
+
+    return isinstance(e, (APIConnectionError, RateLimitError))
+
+
+@cache
+def _schema(response_format: type[BaseModel]) -> str:
+    """
+    The JSON schema of a response format, as used in the cache key.
+    """
+    return json.dumps(response_format.model_json_schema(), sort_keys=True)
+
+
+def _get_cache(key: str) -> Optional[dict]:
+    """
+    Get the cached completion from the generation store.
+    """
+    return store().get(key)
+
+
+def _set_cache(key: str, completion: dict, keep_logprobs: bool = False) -> dict:
+    """
+    Set the cached completion in the generation store. Returns the completion
+    as stored, i.e. trimmed to the retained fields.
+    """
+    return store().set(key, completion, keep_logprobs)
 
 
-def _set_cache(key: str, completion: dict):
+def sample_entries(n: int) -> List[bytes]:
     """
-    Set the cached completion in the cache file.
+    Return up to ``n`` randomly chosen cached completions as JSON.
     """
-    with open(config.GENERATION_CACHE / f"{key}.pkl", "wb") as f:
-        f.write(pickle.dumps(completion))
+    return store().sample(n)
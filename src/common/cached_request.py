@@ -1,19 +1,33 @@
 """
 This module provides a function to perform HTTP GET requests with caching
 and retry logic using the httpx library. The caching mechanism stores
-the response content in a gzip-compressed file, which is saved in a
-specified cache directory. The function uses a semaphore to limit
-concurrent requests when specified. The retry logic is implemented using
-the tenacity library, which allows for exponential backoff and
-customizable retry conditions.
+the response content in the configured cache backend (see
+``src.common.cache_store``), by default one file per entry, compressed with the
+codec chosen by ``src.common.codecs``.
+Requests are sent through the shared transport (see
+``src.common.transport``), which adapts the concurrency per host and honors
+Retry-After. The retry logic is implemented using the tenacity library, which
+allows for exponential backoff and customizable retry conditions.
+
+PDFs are not held in memory: ``download`` streams them straight into their
+target file and the cache only records a reference to that file, so every
+document is stored once.
+
+Next to every cache entry, a small metadata entry records the ETag,
+Last-Modified header and a content hash of the response. With
+``revalidate=True`` these are used to send a conditional request, so an
+unchanged resource costs a ``304 Not Modified`` instead of a full download.
 """
 
 import asyncio
-import gzip
 import hashlib
-from typing import Optional
+import json
+import os
+from functools import cache
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
 
-from httpx import URL, AsyncClient, HTTPError
+from httpx import URL, AsyncClient, HTTPError, Response
 from tenacity import (
     retry,
     retry_if_exception_type,
@@ -21,54 +35,229 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from src.common import config
+from src.common import cache_store, codecs, config, transport
+
+LISTING_DICTIONARY = "listing"
 
-config.SCRAPING_CACHE.mkdir(parents=True, exist_ok=True)
+
+class Fetched(NamedTuple):
+    content: bytes
+    # Writes the response to the cache (a no-op for cache hits)
+    commit: Callable[[], None]
+
+
+async def get(
+    url: URL,
+    client: Optional[AsyncClient] = None,
+    sem: Optional[asyncio.Semaphore] = None,
+    revalidate: bool = False,
+) -> bytes:
+    """
+    Fetch content from the given URL using a httpx.AsyncClient (the shared client
+    by default) with optional caching.
+    If ``revalidate`` is set, a cached entry is revalidated with the server using
+    If-None-Match/If-Modified-Since before it is returned.
+    """
+    fetched = await fetch(url, client, sem=sem, revalidate=revalidate)
+    fetched.commit()
+    return fetched.content
 
 
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_random_exponential(multiplier=60),
+    # Throttling is handled by the host's rate controller, which pauses on
+    # Retry-After, so the retries themselves only need a short backoff
+    wait=wait_random_exponential(multiplier=1, max=30),
     reraise=True,
     retry=retry_if_exception_type(HTTPError),
 )
-async def get(
+async def fetch(
     url: URL,
-    client: AsyncClient,
+    client: Optional[AsyncClient] = None,
     sem: Optional[asyncio.Semaphore] = None,
-) -> bytes:
+    revalidate: bool = False,
+) -> Fetched:
     """
-    Fetch content from the given URL using a httpx.AsyncClient with optional caching.
+    Like ``get``, but the response is only written to the cache once ``commit``
+    is called, e.g. for speculative requests that may turn out to be unneeded.
     """
-    cache_key = hashlib.md5(f"GET:{url}".encode()).hexdigest()
-    if (content := _get_cache(cache_key)) is not None:
-        return content
+    cache_key = _cache_key(url)
+    cached = _get_cache(cache_key)
+    if cached is None and not revalidate:
+        cached = _get_file_ref(cache_key)
+    if cached is not None and not revalidate:
+        return Fetched(cached, lambda: None)
 
-    # If a semaphore is provided, we acquire it to limit concurrency
+    headers = {}
+    meta = _get_meta(cache_key) if cached is not None else None
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # If a semaphore is provided, we acquire it as an additional concurrency cap
     if sem:
         async with sem:
-            response = await client.get(url)
+            response = await transport.request("GET", url, client, headers=headers)
     else:
-        response = await client.get(url)
+        response = await transport.request("GET", url, client, headers=headers)
+
+    if response.status_code == 304 and cached is not None:
+        return Fetched(cached, lambda: None)
 
     response.raise_for_status()
     content = response.content
-    _set_cache(cache_key, content)
+    content_hash = hashlib.sha256(content).hexdigest()
 
-    return content
+    def commit():
+        # Servers without validators still get a full response; skip the rewrite if unchanged
+        if meta is None or meta.get("sha256") != content_hash:
+            _set_cache(cache_key, content)
+        _set_meta(cache_key, _meta_from_response(url, response, content_hash))
 
+    return Fetched(content, commit)
 
-def _get_cache(key: str) -> Optional[bytes]:
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(multiplier=1, max=30),
+    reraise=True,
+    retry=retry_if_exception_type(HTTPError),
+)
+async def download(
+    url: URL, output_path: Path, client: Optional[AsyncClient] = None
+) -> Path:
+    """
+    Stream the content of the given URL into ``output_path``. The content is
+    written to a temporary file that is atomically renamed once complete, and
+    the cache records a reference to the file instead of a second copy.
+    """
+    cache_key = _cache_key(url)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f".{output_path.name}.part")
+
+    # Entries cached before downloads were streamed already hold the full content,
+    # which is replaced by a reference once it has been written to the file
+    if (content := _get_cache(cache_key)) is not None:
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, output_path)
+        _set_file_ref(cache_key, output_path)
+        if _get_meta(cache_key) is None:
+            _set_meta(
+                cache_key,
+                {"url": str(url), "sha256": hashlib.sha256(content).hexdigest()},
+            )
+        _store().delete(cache_key)
+        return output_path
+
+    content_hash = hashlib.sha256()
+    try:
+        async with transport.stream("GET", url, client) as response:
+            response.raise_for_status()
+            with tmp_path.open("wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+                    content_hash.update(chunk)
+        os.replace(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    _set_file_ref(cache_key, output_path)
+    _set_meta(cache_key, _meta_from_response(url, response, content_hash.hexdigest()))
+
+    return output_path
+
+
+def _cache_key(url: URL) -> str:
+    return hashlib.md5(f"GET:{url}".encode()).hexdigest()
+
+
+def _get_file_ref(key: str) -> Optional[bytes]:
     """
-    Retrieve cached content from the cache directory.
+    Read the content of a downloaded file referenced by the cache.
     """
+    if (value := _get_cache(f"{key}.file")) is None:
+        return None
     try:
-        with gzip.open(config.SCRAPING_CACHE / f"{key}.gz", "rb") as f:
-            return f.read()
+        # Absolute references were written before they were relative to DOCS_DIR
+        return (config.DOCS_DIR / value.decode("utf-8")).read_bytes()
     except FileNotFoundError:
         return None
 
 
+def _set_file_ref(key: str, path: Path):
+    """
+    Reference a downloaded file, relative to ``DOCS_DIR`` so the data directory
+    can be moved.
+    """
+    path = path.resolve()
+    if path.is_relative_to(docs_dir := config.DOCS_DIR.resolve()):
+        path = path.relative_to(docs_dir)
+    _set_cache(f"{key}.file", str(path).encode("utf-8"))
+
+
+def _meta_from_response(url: URL, response: Response, content_hash: str) -> dict:
+    """
+    Build the metadata entry stored next to a cached response.
+    """
+    return {
+        "url": str(url),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": content_hash,
+    }
+
+
+def _get_meta(key: str) -> Optional[dict]:
+    """
+    Retrieve the metadata entry for a cached response.
+    """
+    if (value := _get_cache(f"{key}.meta")) is None:
+        return None
+    return json.loads(value)
+
+
+def _set_meta(key: str, meta: dict):
+    _set_cache(f"{key}.meta", json.dumps(meta).encode("utf-8"))
+
+
+@cache
+def _store() -> cache_store.CacheStore:
+    """
+    Open the configured cache backend once per process.
+    """
+    return cache_store.open_scraping_store()
+
+
+def _get_cache(key: str) -> Optional[bytes]:
+    """
+    Retrieve cached content from the cache backend. Entries that can't be
+    decoded anymore count as missing.
+    """
+    if (value := _store().get(key)) is None:
+        return None
+    try:
+        return codecs.decode(value)
+    except codecs.MissingDictionaryError:
+        return None
+
+
 def _set_cache(key: str, value: bytes):
-    with gzip.open(config.SCRAPING_CACHE / f"{key}.gz", "wb") as f:
-        f.write(value)
+    _store().set(key, codecs.encode(value, dictionary=LISTING_DICTIONARY))
+
+
+def sample_entries(n: int, prefix: bytes = b"") -> List[bytes]:
+    """
+    Return up to ``n`` cached responses starting with ``prefix`` (after whitespace).
+    """
+    samples = []
+    for key in _store().keys():
+        if "." in key:
+            # Metadata and file reference entries
+            continue
+        if (value := _get_cache(key)) is not None and value.lstrip().startswith(prefix):
+            samples.append(value)
+            if len(samples) >= n:
+                break
+    return samples
@@ -0,0 +1,185 @@
+"""
+This module provides the compression codecs shared by the scraping and generation caches.
+
+Every entry is written with a small header recording the codec (and the zstd
+dictionary, if one was used), so the codec can be chosen per entry:
+
+- PDFs are already compressed and are stored as they are.
+- HTML and JSON payloads are compressed with zstd, optionally with a trained
+  dictionary for the highly similar BGH listing pages and OpenAI completions.
+- Without the optional ``zstandard`` package, gzip is used instead.
+
+Entries without a header were written before this module existed: gzip data is
+decompressed, anything else is returned unchanged.
+
+Dictionaries are trained from the existing caches with::
+
+    python -m src.common.codecs train
+
+``<name>.dict`` is the dictionary new entries are compressed with. Every
+dictionary is also kept as ``<name>-<dict_id>.dict``, so entries compressed with
+an earlier one remain readable after retraining.
+"""
+
+import argparse
+import gzip
+import struct
+from enum import IntEnum
+from functools import cache
+from typing import Dict, Iterable, Optional
+
+from src.common import config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER_MAGIC = b"BGCC"
+HEADER = struct.Struct("<4sBI")
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_LEVEL = 9
+
+
+class MissingDictionaryError(RuntimeError):
+    """
+    Raised when an entry was compressed with a zstd dictionary that isn't available.
+    """
+
+
+class Codec(IntEnum):
+    STORED = 0
+    GZIP = 1
+    ZSTD = 2
+
+
+def sniff(data: bytes) -> Codec:
+    """
+    Choose the codec for a payload based on its content.
+    """
+    if data.startswith(b"%PDF") or data.startswith(GZIP_MAGIC):
+        return Codec.STORED
+    return Codec.ZSTD if zstandard is not None else Codec.GZIP
+
+
+def encode(
+    data: bytes, codec: Optional[Codec] = None, dictionary: Optional[str] = None
+) -> bytes:
+    """
+    Compress a payload and prefix it with the entry header. The named dictionary
+    is used for zstd if it has been trained.
+    """
+    codec = sniff(data) if codec is None else codec
+    dict_id = 0
+    match codec:
+        case Codec.STORED:
+            payload = data
+        case Codec.GZIP:
+            payload = gzip.compress(data)
+        case Codec.ZSTD:
+            zstd_dict = _load_dictionary(dictionary) if dictionary else None
+            dict_id = zstd_dict.dict_id() if zstd_dict else 0
+            payload = _compressor(dictionary if zstd_dict else None).compress(data)
+        case _:
+            raise ValueError(f"Unknown codec: {codec}")
+    return HEADER.pack(HEADER_MAGIC, codec, dict_id) + payload
+
+
+def decode(blob: bytes) -> bytes:
+    """
+    Decompress an entry written by ``encode`` or by the caches before it.
+    """
+    if not blob.startswith(HEADER_MAGIC):
+        if blob.startswith(GZIP_MAGIC):
+            return gzip.decompress(blob)
+        return blob
+
+    _, codec, dict_id = HEADER.unpack_from(blob)
+    payload = blob[HEADER.size :]
+    match codec:
+        case Codec.STORED:
+            return payload
+        case Codec.GZIP:
+            return gzip.decompress(payload)
+        case Codec.ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Decoding zstd entries requires 'zstandard'.")
+            return _decompressor(dict_id).decompress(payload)
+        case _:
+            raise ValueError(f"Unknown codec in entry header: {codec}")
+
+
+def train_dictionary(name: str, samples: Iterable[bytes], size: int = 112_640):
+    """
+    Train a zstd dictionary from sample payloads and save it under the given name.
+    The dictionary it replaces is kept under its ID.
+    """
+    if zstandard is None:
+        raise RuntimeError("Training dictionaries requires 'zstandard'.")
+    zstd_dict = zstandard.train_dictionary(size, list(samples))
+    config.ZSTD_DICT_DIR.mkdir(parents=True, exist_ok=True)
+    # Dictionaries trained before they were kept by ID only exist as <name>.dict
+    if (previous := _load_dictionary(name)) is not None:
+        _save_dictionary(f"{name}-{previous.dict_id()}", previous)
+    _save_dictionary(f"{name}-{zstd_dict.dict_id()}", zstd_dict)
+    _save_dictionary(name, zstd_dict)
+    _load_dictionary.cache_clear()
+    _dictionaries_by_id.cache_clear()
+    _compressor.cache_clear()
+    _decompressor.cache_clear()
+
+
+def _save_dictionary(name: str, zstd_dict: "zstandard.ZstdCompressionDict"):
+    fp = config.ZSTD_DICT_DIR / f"{name}.dict"
+    if not fp.exists() or fp.read_bytes() != zstd_dict.as_bytes():
+        fp.write_bytes(zstd_dict.as_bytes())
+
+
+@cache
+def _load_dictionary(name: str) -> Optional["zstandard.ZstdCompressionDict"]:
+    fp = config.ZSTD_DICT_DIR / f"{name}.dict"
+    if zstandard is None or not fp.exists():
+        return None
+    return zstandard.ZstdCompressionDict(fp.read_bytes())
+
+
+@cache
+def _dictionaries_by_id() -> Dict[int, "zstandard.ZstdCompressionDict"]:
+    dictionaries = (
+        _load_dictionary(fp.stem) for fp in config.ZSTD_DICT_DIR.glob("*.dict")
+    )
+    return {d.dict_id(): d for d in dictionaries if d is not None}
+
+
+@cache
+def _compressor(dictionary: Optional[str]) -> "zstandard.ZstdCompressor":
+    zstd_dict = _load_dictionary(dictionary) if dictionary else None
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zstd_dict)
+
+
+@cache
+def _decompressor(dict_id: int) -> "zstandard.ZstdDecompressor":
+    if not dict_id:
+        return zstandard.ZstdDecompressor()
+    if (zstd_dict := _dictionaries_by_id().get(dict_id)) is None:
+        raise MissingDictionaryError(f"Missing zstd dictionary with id {dict_id}.")
+    return zstandard.ZstdDecompressor(dict_data=zstd_dict)
+
+
+if __name__ == "__main__":
+    from src.common import cached_generation, cached_request
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser(
+        "train", help="Train the listing and completion dictionaries from the caches."
+    )
+    train.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        listing_samples = cached_request.sample_entries(args.samples, b"<")
+        train_dictionary(cached_request.LISTING_DICTIONARY, listing_samples)
+        completion_samples = cached_generation.sample_entries(args.samples)
+        train_dictionary(cached_generation.COMPLETION_DICTIONARY, completion_samples)
+        print(f"Saved dictionaries to {config.ZSTD_DICT_DIR}")
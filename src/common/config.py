@@ -1,38 +1,182 @@
 """
 This module contains configuration settings for the project, including paths to data files,
 environment variables, and directories for caching and storing results.
+
+The settings are resolved lazily, on first access of any of them, so importing the
+package neither requires a .env file nor reads it. Every setting can be overridden
+with an environment variable of the same name (e.g. ``DATA_DIR=/mnt/bgh/data``);
+paths derived from an overridden directory follow it. The settings are declared
+below for type checkers and editors only, as module attributes would defeat the
+lazy resolution.
 """
 
 import os
+from functools import cache
 from pathlib import Path
-from typing import Optional
-
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 
 # The project’s root directory (adjust if your environment requires a different reference).
 _project_dir: Path = Path(__file__).resolve().parent.parent.parent
 
-# Load environment variables from a .env file located in the project's root directory.
-assert load_dotenv(
-    dotenv_path=_project_dir / ".env"
-), "No .env file found in project root directory. See README."
-
-# Retrieve the OpenAI API key and other tokens from environment variables.
-OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
-HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
-
-# Define the data directory and related paths.
-PROMPTS_DIR = _project_dir / "prompt_templates"
-
-DATA_DIR: Path = _project_dir / "data"
-DOCS_DIR: Path = DATA_DIR / "docs"
-CASE_IDS_JSONL: Path = DATA_DIR / "ids.jsonl"
-DOCS_TEXT_JSONL: Path = DATA_DIR / "documents.jsonl"
-DOCS_PARSED_JSONL: Path = DATA_DIR / "documents_parsed.jsonl"
-DOCS_LABELED_JSONL: Path = DATA_DIR / "documents_labeled.jsonl"
-DOCS_AUGMENTED_JSONL: Path = DATA_DIR / "documents_augmented.jsonl"
-
-# Define cache-related directories.
-_cache_dir: Path = _project_dir / "cache"
-SCRAPING_CACHE: Path = _cache_dir / "scraping_gzip"
-GENERATION_CACHE: Path = _cache_dir / "generation_gzip"
+if TYPE_CHECKING:
+    OPENAI_API_KEY: Optional[str]
+    HUGGINGFACE_TOKEN: Optional[str]
+    OPENAI_BASE_URL: Optional[str]
+
+    PROMPTS_DIR: Path
+    DATA_DIR: Path
+    DOCS_DIR: Path
+    CASE_IDS_JSONL: Path
+    DOCS_TEXT_JSONL: Path
+    DOCS_PARSED_JSONL: Path
+    DOCS_LABELED_JSONL: Path
+    DOCS_AUGMENTED_JSONL: Path
+    ARTIFACT_FORMAT: str
+    ARTIFACTS_DIR: Path
+    FINGERPRINTS_DB: Path
+
+    CACHE_DIR: Path
+    SCRAPING_CACHE: Path
+    SCRAPING_PACK_CACHE: Path
+    ZSTD_DICT_DIR: Path
+    DEHYPHENATION_LEXICON: Path
+    GENERATION_CACHE: Path
+    GENERATION_DB: Path
+    GENERATION_KEEP_LOGPROBS: bool
+    GENERATION_LRU_SIZE: int
+    GENERATION_SHARED_LOCK: bool
+    LLM_METRICS_JSONL: Path
+    GENERATION_BATCH_DIR: Path
+
+    LABEL_CASCADE_THRESHOLD: float
+    SPACY_MODEL: str
+    SPACY_EXCLUDE: Tuple[str, ...]
+
+    SCRAPING_CACHE_BACKEND: str
+    SCRAPING_TIMEOUT: float
+    SCRAPING_HTTP2: bool
+    SCRAPING_KEEPALIVE_EXPIRY: float
+    SCRAPING_INITIAL_CONCURRENCY: int
+    SCRAPING_MAX_CONCURRENCY: int
+    SCRAPING_MAX_RATE: Optional[float]
+
+
+def __getattr__(name: str) -> Any:
+    settings = _resolve()
+    try:
+        return settings[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+
+@cache
+def _resolve() -> Dict[str, Any]:
+    """
+    Resolve all settings once, from the environment and the .env file.
+    """
+    from dotenv import load_dotenv
+
+    # Load environment variables from a .env file located in the project's root directory.
+    load_dotenv(dotenv_path=_project_dir / ".env")
+
+    def path(name: str, default: Path) -> Path:
+        return Path(os.environ[name]) if name in os.environ else default
+
+    def optional_float(name: str) -> Optional[float]:
+        return float(os.environ[name]) if name in os.environ else None
+
+    settings: Dict[str, Any] = {}
+
+    # Retrieve the OpenAI API key and other tokens from environment variables.
+    settings["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+    settings["HUGGINGFACE_TOKEN"] = os.getenv("HUGGINGFACE_TOKEN")
+    # Alternative OpenAI-compatible endpoint, e.g. a local stand-in for testing.
+    settings["OPENAI_BASE_URL"] = os.getenv("OPENAI_BASE_URL")
+
+    # Define the data directory and related paths.
+    settings["PROMPTS_DIR"] = path("PROMPTS_DIR", _project_dir / "prompt_templates")
+
+    data_dir = settings["DATA_DIR"] = path("DATA_DIR", _project_dir / "data")
+    settings["DOCS_DIR"] = path("DOCS_DIR", data_dir / "docs")
+    settings["CASE_IDS_JSONL"] = path("CASE_IDS_JSONL", data_dir / "ids.jsonl")
+    settings["DOCS_TEXT_JSONL"] = path("DOCS_TEXT_JSONL", data_dir / "documents.jsonl")
+    settings["DOCS_PARSED_JSONL"] = path(
+        "DOCS_PARSED_JSONL", data_dir / "documents_parsed.jsonl"
+    )
+    settings["DOCS_LABELED_JSONL"] = path(
+        "DOCS_LABELED_JSONL", data_dir / "documents_labeled.jsonl"
+    )
+    settings["DOCS_AUGMENTED_JSONL"] = path(
+        "DOCS_AUGMENTED_JSONL", data_dir / "documents_augmented.jsonl"
+    )
+    # Format of the stage artifacts: "jsonl" files or "arrow" tables of the columns
+    # each stage adds (see src/common/artifacts.py).
+    settings["ARTIFACT_FORMAT"] = os.getenv("ARTIFACT_FORMAT", "jsonl")
+    settings["ARTIFACTS_DIR"] = path("ARTIFACTS_DIR", data_dir / "artifacts")
+
+    # Fingerprints of the documents in each stage (see src/pipeline/_incremental.py).
+    settings["FINGERPRINTS_DB"] = path(
+        "FINGERPRINTS_DB", data_dir / "fingerprints.sqlite"
+    )
+
+    # Define cache-related directories.
+    cache_dir = settings["CACHE_DIR"] = path("CACHE_DIR", _project_dir / "cache")
+    settings["SCRAPING_CACHE"] = path("SCRAPING_CACHE", cache_dir / "scraping_gzip")
+    settings["SCRAPING_PACK_CACHE"] = path(
+        "SCRAPING_PACK_CACHE", cache_dir / "scraping_pack"
+    )
+    settings["ZSTD_DICT_DIR"] = path("ZSTD_DICT_DIR", cache_dir / "zstd_dictionaries")
+    settings["DEHYPHENATION_LEXICON"] = path(
+        "DEHYPHENATION_LEXICON", cache_dir / "dehyphenation.sqlite"
+    )
+    settings["GENERATION_CACHE"] = path(
+        "GENERATION_CACHE", cache_dir / "generation_gzip"
+    )
+
+    # Generation cache database (see src/common/generation_store.py).
+    settings["GENERATION_DB"] = path("GENERATION_DB", cache_dir / "generation.sqlite")
+    settings["GENERATION_KEEP_LOGPROBS"] = (
+        os.getenv("GENERATION_KEEP_LOGPROBS", "0") == "1"
+    )
+    settings["GENERATION_LRU_SIZE"] = int(os.getenv("GENERATION_LRU_SIZE", "10000"))
+    # Coordinate the processes sharing the generation cache through claims on keys.
+    settings["GENERATION_SHARED_LOCK"] = os.getenv("GENERATION_SHARED_LOCK", "0") == "1"
+    settings["LLM_METRICS_JSONL"] = path(
+        "LLM_METRICS_JSONL", cache_dir / "llm_metrics.jsonl"
+    )
+    settings["GENERATION_BATCH_DIR"] = path(
+        "GENERATION_BATCH_DIR", cache_dir / "generation_batches"
+    )
+
+    # Minimum confidence of every field for labels of the small model to be kept
+    # in the labeling cascade (see src/labeling/_cascade.py).
+    settings["LABEL_CASCADE_THRESHOLD"] = float(
+        os.getenv("LABEL_CASCADE_THRESHOLD", "0.95")
+    )
+
+    # spaCy model used by parse_docs, and the pipeline components it doesn't need.
+    settings["SPACY_MODEL"] = os.getenv("SPACY_MODEL", "de_core_news_lg")
+    settings["SPACY_EXCLUDE"] = tuple(
+        os.getenv("SPACY_EXCLUDE", "parser,ner,lemmatizer").split(",")
+    )
+
+    # Backend of the scraping cache: "directory" (one file per entry) or "pack".
+    settings["SCRAPING_CACHE_BACKEND"] = os.getenv(
+        "SCRAPING_CACHE_BACKEND", "directory"
+    )
+
+    # Shared HTTP transport of the scraping stages (see src/common/transport.py).
+    settings["SCRAPING_TIMEOUT"] = float(os.getenv("SCRAPING_TIMEOUT", "60"))
+    settings["SCRAPING_HTTP2"] = os.getenv("SCRAPING_HTTP2", "0") == "1"
+    settings["SCRAPING_KEEPALIVE_EXPIRY"] = float(
+        os.getenv("SCRAPING_KEEPALIVE_EXPIRY", "30")
+    )
+    settings["SCRAPING_INITIAL_CONCURRENCY"] = int(
+        os.getenv("SCRAPING_INITIAL_CONCURRENCY", "10")
+    )
+    settings["SCRAPING_MAX_CONCURRENCY"] = int(
+        os.getenv("SCRAPING_MAX_CONCURRENCY", "32")
+    )
+    settings["SCRAPING_MAX_RATE"] = optional_float("SCRAPING_MAX_RATE")
+
+    return settings
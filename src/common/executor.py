@@ -0,0 +1,120 @@
+"""
+This module provides the executors for the pipeline stages.
+
+``run_bounded`` is a bounded-concurrency executor for the async stages.
+
+A fixed pool of workers pulls items from a queue, so the number of running
+tasks stays at the concurrency limit for the whole run instead of draining
+batch by batch. Results are yielded as they complete, and an exception raised
+for one item (including a ``CancelledError`` of a task it awaited) is captured
+in its result instead of failing the whole run.
+Optionally, the items with the largest estimated size (e.g. text length) are
+started first, which shortens the tail of the run.
+
+``map_processes`` shards the documents of the CPU-bound stages across a
+process pool, dispatching them in chunks and keeping their order.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class Result(Generic[T, R]):
+    index: int
+    item: T
+    value: Optional[R] = None
+    error: Optional[BaseException] = None
+
+
+async def run_bounded(
+    items: Iterable[T],
+    fn: Callable[[T], Awaitable[R]],
+    concurrency: int = 10,
+    size: Optional[Callable[[T], float]] = None,
+) -> AsyncIterator[Result[T, R]]:
+    """
+    Run ``fn`` for every item with at most ``concurrency`` items in progress and
+    yield the results in completion order. ``Result.index`` is the position of the
+    item in ``items``. If ``size`` is given, the largest items are started first.
+    """
+    pending = list(enumerate(items))
+    if size is not None:
+        pending.sort(key=lambda pair: size(pair[1]), reverse=True)
+    queue = deque(pending)
+    results: asyncio.Queue[Result[T, R]] = asyncio.Queue()
+    n_items = len(queue)
+
+    async def worker():
+        while queue:
+            index, item = queue.popleft()
+            try:
+                result = Result(index, item, value=await fn(item))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException as e:
+                # Only the cancellation of the worker itself ends it; otherwise the
+                # item would never yield its result
+                if isinstance(e, asyncio.CancelledError) and (
+                    asyncio.current_task().cancelling()
+                ):
+                    raise
+                result = Result(index, item, error=e)
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, n_items))]
+    try:
+        for _ in range(n_items):
+            yield await results.get()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def in_order(results: Iterable[Result[T, R]]) -> List[Result[T, R]]:
+    """
+    Sort results back into the order of the input items.
+    """
+    return sorted(results, key=lambda r: r.index)
+
+
+def map_processes(
+    fn: Callable[[T], R],
+    items: Sequence[T],
+    workers: int = 1,
+    initializer: Optional[Callable[[], None]] = None,
+    chunksize: Optional[int] = None,
+) -> Iterator[R]:
+    """
+    Apply ``fn`` to every item on a pool of ``workers`` processes and yield the
+    results in the order of the items. ``initializer`` runs once per worker, e.g.
+    to load a model. With a single worker, everything runs in this process.
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer()
+        yield from map(fn, items)
+        return
+
+    # A few chunks per worker balance the load without much dispatch overhead
+    chunksize = chunksize or max(1, len(items) // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=initializer) as pool:
+        yield from pool.map(fn, items, chunksize=chunksize)
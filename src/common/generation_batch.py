@@ -0,0 +1,235 @@
+"""
+This module runs the uncached requests of a pipeline stage as OpenAI batch jobs.
+
+A stage is first run in collect mode (``cached_generation.collecting``): cache
+hits are served as usual, while every cache miss records its request under its
+cache key instead of sending it. The collected requests are written to JSONL
+files (split by the per-batch request and size limits), uploaded and submitted
+as batches, polled until they finish, and their results are written straight
+into the generation cache. The stage is then run normally and finds its
+completions in the cache; requests that failed or expired in the batch are sent
+interactively.
+
+The state of the jobs of a stage is kept in ``GENERATION_BATCH_DIR/<name>``, so
+an interrupted run resumes polling the submitted batches instead of submitting
+them again.
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Set, TypeVar
+
+from pydantic import BaseModel
+
+from src.common import cached_generation, config, executor
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+T = TypeVar("T")
+
+
+async def prefill(
+    items: Iterable[T],
+    fn: Callable[[T], Awaitable],
+    name: str,
+    poll_interval: float = 60,
+):
+    """
+    Run ``fn`` for every item in collect mode and execute the collected cache
+    misses as batch jobs, so that a following normal run is served from the cache.
+    """
+    with cached_generation.collecting() as requests:
+        async for _ in executor.run_bounded(items, fn, concurrency=100):
+            pass
+    print(f"{name}: {len(requests)} uncached requests")
+    if requests:
+        await execute(requests, name, poll_interval=poll_interval)
+
+
+async def execute(requests: Dict[str, dict], name: str, poll_interval: float = 60):
+    """
+    Submit the requests (by cache key) as batch jobs, wait for them to finish
+    and write their results into the generation cache.
+    """
+    directory = config.GENERATION_BATCH_DIR / name
+    directory.mkdir(parents=True, exist_ok=True)
+    state_path = directory / "state.json"
+    state = json.loads(state_path.read_text()) if state_path.exists() else []
+
+    # Requests of unfinished parts are not written again, they are still running
+    submitted = set()
+    for part in state:
+        if not part["ingested"]:
+            submitted |= _read_keys(Path(part["path"]))
+    new = {key: r for key, r in requests.items() if key not in submitted}
+    for lines in _split(_request_line(key, r) for key, r in new.items()):
+        path = directory / f"part-{len(state):04d}.jsonl"
+        path.write_text("".join(lines), encoding="utf-8")
+        state.append(dict(path=str(path), file_id=None, batch_id=None, ingested=False))
+    _save_state(state_path, state)
+
+    client = cached_generation.get_client()
+    for part in state:
+        if part["ingested"]:
+            continue
+        if part["file_id"] is None:
+            with open(part["path"], "rb") as f:
+                part["file_id"] = (
+                    await client.files.create(file=f, purpose="batch")
+                ).id
+            _save_state(state_path, state)
+        if part["batch_id"] is None:
+            batch = await client.batches.create(
+                input_file_id=part["file_id"],
+                endpoint=ENDPOINT,
+                completion_window=COMPLETION_WINDOW,
+                metadata={"stage": name},
+            )
+            part["batch_id"] = batch.id
+            _save_state(state_path, state)
+
+    while pending := [part for part in state if not part["ingested"]]:
+        for part in pending:
+            batch = await client.batches.retrieve(part["batch_id"])
+            counts = batch.request_counts
+            if counts is not None:
+                print(
+                    f"{name}: {Path(part['path']).name} {batch.status} "
+                    f"({counts.completed}/{counts.total} completed, {counts.failed} failed)"
+                )
+            if batch.status not in TERMINAL_STATUSES:
+                continue
+            # Expired and cancelled batches still have results for a part of the requests
+            if batch.output_file_id is not None:
+                content = await client.files.content(batch.output_file_id)
+                stored = _ingest(content.text, _structured_keys(Path(part["path"])))
+                print(f"{name}: stored {stored} completions")
+            part["ingested"] = True
+            _save_state(state_path, state)
+        if any(not part["ingested"] for part in state):
+            await asyncio.sleep(poll_interval)
+
+
+def _request_line(key: str, request: dict) -> str:
+    body = {k: v for k, v in request.items() if v is not None}
+    if "response_format" in body:
+        body["response_format"] = _response_format(body["response_format"])
+    line = {"custom_id": key, "method": "POST", "url": ENDPOINT, "body": body}
+    return json.dumps(line) + "\n"
+
+
+def _response_format(response_format: type[BaseModel]) -> dict:
+    """
+    The ``response_format`` parameter for a structured output, as ``parse`` sends
+    it: the strict JSON schema of the model.
+    """
+    schema = response_format.model_json_schema()
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_format.__name__,
+            "schema": _strict(schema, schema.get("$defs", {})),
+            "strict": True,
+        },
+    }
+
+
+def _strict(schema: dict, defs: Dict[str, dict]) -> dict:
+    """
+    Make a JSON schema strict: objects allow no other properties and require all
+    of theirs, and references with sibling keywords are inlined.
+    """
+    if "$ref" in schema and len(schema) > 1:
+        referenced = defs[schema["$ref"].removeprefix("#/$defs/")]
+        schema = {**referenced, **{k: v for k, v in schema.items() if k != "$ref"}}
+    schema = dict(schema)
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+    if "properties" in schema:
+        schema["properties"] = {
+            name: _strict(value, defs) for name, value in schema["properties"].items()
+        }
+        schema["required"] = list(schema["properties"])
+    if "$defs" in schema:
+        schema["$defs"] = {
+            name: _strict(value, defs) for name, value in schema["$defs"].items()
+        }
+    if "items" in schema:
+        schema["items"] = _strict(schema["items"], defs)
+    for keyword in ("anyOf", "allOf"):
+        if keyword in schema:
+            schema[keyword] = [_strict(value, defs) for value in schema[keyword]]
+    if schema.get("default", 0) is None:
+        del schema["default"]
+    return schema
+
+
+def _split(lines: Iterable[str]) -> Iterable[List[str]]:
+    """
+    Split the request lines into files within the batch limits.
+    """
+    part, size = [], 0
+    for line in lines:
+        line_size = len(line.encode("utf-8"))
+        if part and (
+            len(part) >= MAX_REQUESTS_PER_FILE or size + line_size > MAX_BYTES_PER_FILE
+        ):
+            yield part
+            part, size = [], 0
+        part.append(line)
+        size += line_size
+    if part:
+        yield part
+
+
+def _ingest(output: str, structured_keys: Set[str]) -> int:
+    """
+    Write the successful results of a batch into the generation cache.
+    """
+    stored = 0
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        completion = response["body"]
+        if result["custom_id"] in structured_keys:
+            # parse() reads the parsed message, which the batch result doesn't carry
+            message = completion["choices"][0]["message"]
+            if not message.get("content") or message.get("refusal"):
+                continue
+            message["parsed"] = json.loads(message["content"])
+        cached_generation.store().set(
+            result["custom_id"],
+            completion,
+            keep_logprobs=result["custom_id"] in structured_keys,
+        )
+        stored += 1
+    return stored
+
+
+def _read_keys(path: Path) -> Set[str]:
+    with open(path, encoding="utf-8") as f:
+        return {json.loads(line)["custom_id"] for line in f}
+
+
+def _structured_keys(path: Path) -> Set[str]:
+    with open(path, encoding="utf-8") as f:
+        lines = map(json.loads, f)
+        return {
+            line["custom_id"] for line in lines if "response_format" in line["body"]
+        }
+
+
+def _save_state(path: Path, state: List[dict]):
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
@@ -0,0 +1,238 @@
+"""
+This module provides the storage backend for the generation cache.
+
+All completions live in a single SQLite database (in WAL mode, so any number of
+processes can read while one writes), indexed by the cache key computed in
+``src.common.cached_generation``. Values are the JSON completions, compressed
+with the codecs in ``src.common.codecs``.
+
+Before a completion is stored, it is trimmed to the fields the pipeline reads.
+The per-token ``logprobs`` make up most of a completion's size and are only
+kept if ``keep_logprobs`` is set (``GENERATION_KEEP_LOGPROBS=1``) or requested
+for a completion (the short structured outputs keep them for their confidences). A bounded
+in-memory LRU in front of the database serves repeated lookups within a run.
+
+Workers in several processes can coordinate through claims on keys (a row per
+key being fetched), so only one of them requests a missing completion.
+
+Completions cached in the legacy per-key ``.bin``/``.pkl`` files are imported
+with their ``logprobs`` on first lookup, or all at once with::
+
+    python -m src.common.generation_store migrate
+"""
+
+import argparse
+import json
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from tqdm import tqdm
+
+from src.common import codecs, config
+
+COMPLETION_DICTIONARY = "completion"
+
+# Fields of a choice that are kept; "logprobs" only with keep_logprobs
+CHOICE_FIELDS = ("index", "finish_reason", "message")
+
+
+class GenerationStore:
+    """
+    SQLite-backed store of completions with an LRU front.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        keep_logprobs: bool = False,
+        cache_size: int = 10_000,
+        legacy_directory: Optional[Path] = None,
+    ):
+        self.path = path
+        self.keep_logprobs = keep_logprobs
+        self.cache_size = cache_size
+        self.legacy_directory = legacy_directory
+        self._cache: OrderedDict[str, dict] = OrderedDict()
+        self._db = _open_db(path)
+
+    def get(self, key: str) -> Optional[dict]:
+        if (completion := self._cache.get(key)) is not None:
+            self._cache.move_to_end(key)
+            return completion
+
+        row = self._db.execute(
+            "SELECT value FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and (blob := _decode(row[0])) is not None:
+            completion = json.loads(blob)
+        elif (completion := self._get_legacy(key)) is not None:
+            # Which call wrote a legacy completion is unknown, so its logprobs stay
+            completion = self.set(key, completion, keep_logprobs=True)
+        else:
+            return None
+
+        self._remember(key, completion)
+        return completion
+
+    def set(self, key: str, completion: dict, keep_logprobs: bool = False) -> dict:
+        """
+        Trim and store a completion. Returns the completion as stored.
+        """
+        completion = trim(completion, keep_logprobs or self.keep_logprobs)
+        blob = codecs.encode(
+            json.dumps(completion).encode("utf-8"), dictionary=COMPLETION_DICTIONARY
+        )
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?)", (key, blob)
+            )
+        self._remember(key, completion)
+        return completion
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Claim a key for fetching its completion. Fails while another owner holds
+        an unexpired claim on it.
+        """
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "DELETE FROM claims WHERE key = ? AND expires < ?", (key, now)
+            )
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO claims VALUES (?, ?, ?)", (key, owner, now + ttl)
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, key: str, owner: str, ttl: float):
+        """
+        Extend an owner's claim on a key by ``ttl`` seconds from now.
+        """
+        with self._db:
+            self._db.execute(
+                "UPDATE claims SET expires = ? WHERE key = ? AND owner = ?",
+                (time.time() + ttl, key, owner),
+            )
+
+    def release(self, key: str, owner: str):
+        with self._db:
+            self._db.execute(
+                "DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner)
+            )
+
+    def keys(self) -> Iterator[str]:
+        for (key,) in self._db.execute("SELECT key FROM completions"):
+            yield key
+
+    def sample(self, n: int) -> List[bytes]:
+        """
+        Return up to ``n`` randomly chosen completions as JSON.
+        """
+        rows = self._db.execute(
+            "SELECT value FROM completions ORDER BY random() LIMIT ?", (n,)
+        )
+        return [blob for (value,) in rows if (blob := _decode(value)) is not None]
+
+    def migrate_legacy(self) -> int:
+        """
+        Import all completions from the legacy per-key files.
+        """
+        if self.legacy_directory is None or not self.legacy_directory.exists():
+            return 0
+        paths = [
+            fp
+            for fp in self.legacy_directory.iterdir()
+            if fp.suffix in (".bin", ".pkl")
+        ]
+        copied = 0
+        for fp in tqdm(paths, desc="Migrating completions"):
+            if (completion := self._get_legacy(fp.stem)) is not None:
+                self.set(fp.stem, completion, keep_logprobs=True)
+                copied += 1
+        return copied
+
+    def _get_legacy(self, key: str) -> Optional[dict]:
+        if self.legacy_directory is None:
+            return None
+        try:
+            blob = (self.legacy_directory / f"{key}.bin").read_bytes()
+            return json.loads(codecs.decode(blob))
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.legacy_directory / f"{key}.pkl", "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _remember(self, key: str, completion: dict):
+        self._cache[key] = completion
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+def trim(completion: dict, keep_logprobs: bool = False) -> dict:
+    """
+    Reduce a completion dump to the fields the pipeline reads.
+    """
+    fields = CHOICE_FIELDS + ("logprobs",) if keep_logprobs else CHOICE_FIELDS
+    return {
+        "id": completion.get("id"),
+        "model": completion.get("model"),
+        "usage": completion.get("usage"),
+        "choices": [
+            {k: choice[k] for k in fields if k in choice}
+            for choice in completion["choices"]
+        ],
+    }
+
+
+def open_generation_store() -> GenerationStore:
+    """
+    Open the generation cache as configured.
+    """
+    return GenerationStore(
+        config.GENERATION_DB,
+        keep_logprobs=config.GENERATION_KEEP_LOGPROBS,
+        cache_size=config.GENERATION_LRU_SIZE,
+        legacy_directory=config.GENERATION_CACHE,
+    )
+
+
+def _open_db(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value BLOB)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS claims "
+        "(key TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+    )
+    return connection
+
+
+def _decode(blob: bytes) -> Optional[bytes]:
+    # Entries compressed with a dictionary that is gone count as missing
+    try:
+        return codecs.decode(blob)
+    except codecs.MissingDictionaryError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Import the legacy per-key completion files.")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        copied = open_generation_store().migrate_legacy()
+        print(f"Migrated {copied} completions to {config.GENERATION_DB}")
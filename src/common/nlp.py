@@ -0,0 +1,31 @@
+"""
+This module loads the spaCy model lazily, on first use.
+
+The model and the excluded pipeline components are configurable (see
+``SPACY_MODEL`` and ``SPACY_EXCLUDE`` in the config), so that the stages that
+don't need it never pay for loading it, and so that smaller models can be
+compared against ``de_core_news_lg``.
+"""
+
+from functools import cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from src.common import config
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+
+
+@cache
+def load(
+    model: Optional[str] = None, exclude: Optional[Tuple[str, ...]] = None
+) -> "Language":
+    """
+    Load the spaCy model once per process, without the excluded components.
+    """
+    import spacy
+
+    return spacy.load(
+        model or config.SPACY_MODEL,
+        exclude=list(config.SPACY_EXCLUDE if exclude is None else exclude),
+    )
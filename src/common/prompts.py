@@ -1,23 +1,26 @@
 """
 This module contains the prompts used in the application.
+
+The prompt templates are read from ``PROMPTS_DIR`` on first access.
 """
 
+from functools import cache
+
 from src.common import config
 
-CREATE_CASE_INFO_SYSTEM = (
-    (config.PROMPTS_DIR / "create_case_info_system.txt")
-    .read_text(encoding="utf-8")
-    .strip()
-)
-
-CREATE_CASE_INFO_USER = (
-    (config.PROMPTS_DIR / "create_case_info_user.txt")
-    .read_text(encoding="utf-8")
-    .strip()
-)
-
-CREATE_AUGMENTATION_SYSTEM = (
-    (config.PROMPTS_DIR / "create_augmentation_system.txt")
-    .read_text(encoding="utf-8")
-    .strip()
-)
+_PROMPT_FILES = {
+    "CREATE_CASE_INFO_SYSTEM": "create_case_info_system.txt",
+    "CREATE_CASE_INFO_USER": "create_case_info_user.txt",
+    "CREATE_AUGMENTATION_SYSTEM": "create_augmentation_system.txt",
+}
+
+
+def __getattr__(name: str) -> str:
+    if name not in _PROMPT_FILES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _read(_PROMPT_FILES[name])
+
+
+@cache
+def _read(file_name: str) -> str:
+    return (config.PROMPTS_DIR / file_name).read_text(encoding="utf-8").strip()
@@ -0,0 +1,283 @@
+"""
+This module records usage and latency telemetry of the LLM calls.
+
+Every API call of ``cached_generation.create``/``parse`` appends one record to
+``LLM_METRICS_JSONL`` with the model, the pipeline stage and document it was
+made for (see ``scope``), the token usage (prompt, completion, prompt-cache hits
+and accepted/rejected prediction tokens), the wall time and the number of
+retries. Calls served from the cache are aggregated per stage and model into one
+record with their number in ``cache_hits``, written when the run ends.
+
+Records carry the id of the run that wrote them (see ``run``; calls outside of
+one belong to the run of the process), so a report can be produced per run::
+
+    python -m src.common.telemetry             # latest run
+    python -m src.common.telemetry --run <id>
+"""
+
+import argparse
+import atexit
+import json
+import math
+import os
+import statistics
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from itertools import count
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from src.common import config
+
+RUN_ID = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+# USD per million prompt, cached prompt and completion tokens (interactive API)
+PRICES = {
+    "gpt-4.1-2025-04-14": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini-2025-04-14": (0.40, 0.10, 1.60),
+}
+
+# Fields summed over the aggregated cache hits
+SUMMED_FIELDS = (
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "accepted_prediction_tokens",
+    "rejected_prediction_tokens",
+    "wall_time",
+    "retries",
+)
+
+_scope: ContextVar[Dict[str, str]] = ContextVar("scope", default={})
+_run: ContextVar[Optional["_Run"]] = ContextVar("run", default=None)
+_run_numbers = count(1)
+
+
+class _Run:
+    def __init__(self, run_id: str):
+        self.id = run_id
+        self.records: List[dict] = []
+        self._hits: Dict[Tuple, dict] = {}
+
+    def add(self, record: dict):
+        if not record["cache_hit"]:
+            self.records.append(record)
+            _writer().write(json.dumps(record) + "\n")
+            return
+        # Hits are aggregated over the documents
+        fields = {
+            k: v
+            for k, v in record.items()
+            if k not in SUMMED_FIELDS and k not in ("time", "document_id")
+        }
+        key = tuple(sorted(fields.items()))
+        if (hits := self._hits.get(key)) is None:
+            hits = self._hits[key] = {
+                **fields,
+                "cache_hits": 0,
+                **{field: 0 for field in SUMMED_FIELDS},
+            }
+        hits["cache_hits"] += 1
+        for field in SUMMED_FIELDS:
+            hits[field] += record[field]
+
+    def flush(self):
+        """
+        Write the aggregated cache hits recorded so far.
+        """
+        for hits in self._hits.values():
+            hits["time"] = time.time()
+            self.records.append(hits)
+            _writer().write(json.dumps(hits) + "\n")
+        self._hits = {}
+
+
+_process_run = _Run(RUN_ID)
+atexit.register(_process_run.flush)
+
+
+@contextmanager
+def run() -> Iterator[List[dict]]:
+    """
+    Record the calls made in this context, including tasks started in it, as a
+    run of their own. Yields the records of the run, which are complete once the
+    context exits; they are also added to those of an enclosing run.
+    """
+    parent = _run.get()
+    current = _Run(
+        f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_run_numbers)}"
+    )
+    token = _run.set(current)
+    try:
+        yield current.records
+    finally:
+        _run.reset(token)
+        current.flush()
+        if parent is not None:
+            parent.records.extend(current.records)
+
+
+@contextmanager
+def scope(**fields: str):
+    """
+    Attach the given fields (e.g. ``stage`` and ``document_id``) to all calls
+    recorded in this context, including tasks started in it.
+    """
+    token = _scope.set({**_scope.get(), **fields})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def record_call(
+    kind: str,
+    model: str,
+    cache_hit: bool,
+    completion: dict,
+    wall_time: float,
+    retries: int = 0,
+):
+    """
+    Record a call of the generation cache.
+    """
+    usage = completion.get("usage") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    current = _run.get() or _process_run
+    record = {
+        "run": current.id,
+        "time": time.time(),
+        **_scope.get(),
+        "kind": kind,
+        "model": model,
+        "cache_hit": cache_hit,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "cached_tokens": prompt_details.get("cached_tokens") or 0,
+        "accepted_prediction_tokens": (
+            completion_details.get("accepted_prediction_tokens") or 0
+        ),
+        "rejected_prediction_tokens": (
+            completion_details.get("rejected_prediction_tokens") or 0
+        ),
+        "wall_time": wall_time,
+        "retries": retries,
+    }
+    current.add(record)
+
+
+def lookups(records: List[dict]) -> int:
+    """
+    The number of calls the records stand for, including the aggregated cache hits.
+    """
+    return sum(r.get("cache_hits", 1) for r in records)
+
+
+def cost(record: dict, model: Optional[str] = None) -> float:
+    """
+    Return the cost of a recorded call in USD, at the prices of its model or of
+    the given one.
+    """
+    prompt, cached, completion = PRICES.get(model or record["model"], (0, 0, 0))
+    uncached_tokens = record["prompt_tokens"] - record["cached_tokens"]
+    return (
+        uncached_tokens * prompt
+        + record["cached_tokens"] * cached
+        + record["completion_tokens"] * completion
+    ) / 1_000_000
+
+
+def load(run: Optional[str] = None) -> List[dict]:
+    """
+    Load the records of a run from the metrics file (by default the latest run).
+    """
+    if not config.LLM_METRICS_JSONL.exists():
+        return []
+    with open(config.LLM_METRICS_JSONL, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    run = run or (records[-1]["run"] if records else None)
+    return [r for r in records if r["run"] == run]
+
+
+def summarize(records: List[dict]) -> Dict[str, dict]:
+    """
+    Aggregate records by stage and model.
+    """
+    groups = defaultdict(list)
+    for r in records:
+        groups[f"{r.get('stage', '-')} / {r['model']}"].append(r)
+
+    summary = {}
+    for name, group in sorted(groups.items()):
+        calls = [r for r in group if not r["cache_hit"]]
+        totals = {
+            field: sum(r[field] for r in calls)
+            for field in (
+                "prompt_tokens",
+                "completion_tokens",
+                "cached_tokens",
+                "accepted_prediction_tokens",
+                "rejected_prediction_tokens",
+                "retries",
+            )
+        }
+        predicted = (
+            totals["accepted_prediction_tokens"] + totals["rejected_prediction_tokens"]
+        )
+        latencies = sorted(r["wall_time"] for r in calls)
+        summary[name] = {
+            "lookups": lookups(group),
+            "cache_hit_ratio": 1 - len(calls) / lookups(group),
+            "api_calls": len(calls),
+            **totals,
+            "prompt_cache_ratio": (
+                totals["cached_tokens"] / totals["prompt_tokens"]
+                if totals["prompt_tokens"]
+                else None
+            ),
+            "cost_usd": sum(map(cost, calls)),
+            "prediction_acceptance": (
+                totals["accepted_prediction_tokens"] / predicted if predicted else None
+            ),
+            "latency_p50": statistics.median(latencies) if latencies else None,
+            "latency_p95": (
+                latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else None
+            ),
+        }
+    return summary
+
+
+def report(records: Optional[List[dict]] = None):
+    """
+    Print the summary of the given records (by default those of the current run,
+    see ``run``).
+    """
+    if records is None:
+        current = _run.get() or _process_run
+        current.flush()
+        records = current.records
+    if not records:
+        print("No LLM calls recorded.")
+        return
+    for name, summary in summarize(records).items():
+        print(name)
+        for field, value in summary.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            print(f"  {field:<28} {value if value is not None else '-'}")
+
+
+@cache
+def _writer() -> IO[str]:
+    config.LLM_METRICS_JSONL.parent.mkdir(parents=True, exist_ok=True)
+    return open(config.LLM_METRICS_JSONL, "a", encoding="utf-8", buffering=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--run", help="Run id (default: the latest run).")
+    args = parser.parse_args()
+    report(load(args.run))
@@ -0,0 +1,279 @@
+"""
+This module provides the request and token budgets for the OpenAI API calls.
+
+The API limits every model by requests per minute (RPM) and tokens per minute
+(TPM). A ``TokenBudget`` per model keeps two token buckets that refill at these
+rates. Before a request is sent, its prompt and completion tokens are estimated
+from the text lengths and reserved; once the response arrives, the estimate is
+settled against the actual usage.
+
+The budgets adapt to the rate-limit headers of every response: the limits are
+taken from ``x-ratelimit-limit-*``, the buckets never hold more than
+``x-ratelimit-remaining-*`` and, when a bucket is empty or a request is
+throttled, all requests to the model pause until ``x-ratelimit-reset-*`` or
+``Retry-After`` (as in ``src.common.transport`` for the scraping stages).
+
+``utilization`` reports the current limits and usage per model, to size runs.
+"""
+
+import asyncio
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Mapping, Optional, Tuple
+
+from src.common.transport import parse_retry_after
+
+# Limits assumed until the first response reports the actual ones
+DEFAULT_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gpt-4.1-2025-04-14": (500, 30_000),
+    "gpt-4.1-mini-2025-04-14": (500, 200_000),
+}
+FALLBACK_LIMITS = (500, 30_000)
+
+# German legal text has about 3.5 characters per token with the GPT-4.1 tokenizer
+CHARS_PER_TOKEN = 3.5
+TOKENS_PER_MESSAGE = 4
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+_budgets: Dict[str, "TokenBudget"] = {}
+_budgets_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class TokenBudget:
+    """
+    RPM and TPM budget of a single model.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttled = 0
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._usage: Deque[Tuple[float, int]] = deque()
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, tokens: int) -> int:
+        """
+        Wait until a request with the estimated number of tokens may be sent.
+        Returns the number of tokens reserved.
+        """
+        # A request larger than the whole budget still has to go through eventually
+        tokens = min(tokens, self.tpm)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self._blocked_until:
+                        await self._wait(self._blocked_until - now)
+                    elif self._requests < 1 or self._tokens < tokens:
+                        await self._wait(self._time_to_refill(tokens))
+                    else:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        self.in_flight += 1
+                        return tokens
+            finally:
+                self.waiting -= 1
+
+    async def release(
+        self,
+        reserved: int,
+        used: Optional[int] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        throttled: bool = False,
+    ):
+        """
+        Settle the reservation of a finished request against its actual usage and
+        adapt the budget to the rate-limit headers of its response.
+        """
+        async with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if used is not None:
+                self._tokens = min(self.tpm, self._tokens + reserved - used)
+                self._usage.append((now, used))
+            if headers:
+                self._observe(headers, now)
+            if throttled:
+                self.throttled += 1
+                retry_after = _retry_after(headers or {})
+                # Without a hint, pause briefly rather than retrying right away
+                self._blocked_until = max(
+                    self._blocked_until, now + (retry_after or 1.0)
+                )
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, tokens: int) -> AsyncIterator["_Reservation"]:
+        """
+        Hold a reservation for a request; its outcome is reported through the
+        yielded object. A throttled request (HTTP 429) is detected from the error.
+        """
+        reservation = _Reservation(await self.acquire(tokens))
+        try:
+            yield reservation
+        except Exception as e:
+            if (response := getattr(e, "response", None)) is not None:
+                reservation.headers = response.headers
+                reservation.throttled = response.status_code == 429
+            raise
+        finally:
+            await self.release(
+                reservation.reserved,
+                used=reservation.used,
+                headers=reservation.headers,
+                throttled=reservation.throttled,
+            )
+
+    def utilization(self) -> Dict[str, float]:
+        """
+        Return the limits and the usage over the last minute.
+        """
+        now = time.monotonic()
+        while self._usage and self._usage[0][0] < now - 60:
+            self._usage.popleft()
+        requests = len(self._usage)
+        tokens = sum(used for _, used in self._usage)
+        return {
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "requests_last_minute": requests,
+            "tokens_last_minute": tokens,
+            "request_utilization": requests / self.rpm,
+            "token_utilization": tokens / self.tpm,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "throttled": self.throttled,
+            "paused_for": max(self._blocked_until - now, 0.0),
+        }
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+        self._last_refill = now
+
+    def _time_to_refill(self, tokens: int) -> float:
+        missing_requests = max(1 - self._requests, 0) * 60 / self.rpm
+        missing_tokens = max(tokens - self._tokens, 0) * 60 / self.tpm
+        return max(missing_requests, missing_tokens, 0.01)
+
+    def _observe(self, headers: Mapping[str, str], now: float):
+        """
+        Adapt the limits and buckets to the rate-limit headers of a response.
+        """
+        if limit := _int_header(headers, "x-ratelimit-limit-requests"):
+            self.rpm = limit
+        if limit := _int_header(headers, "x-ratelimit-limit-tokens"):
+            self.tpm = limit
+        for kind in ("requests", "tokens"):
+            remaining = _int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            if kind == "requests":
+                self._requests = min(self._requests, remaining)
+            else:
+                self._tokens = min(self._tokens, remaining)
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining == 0 and reset:
+                self._blocked_until = max(self._blocked_until, now + reset)
+
+    async def _wait(self, delay: float):
+        """
+        Wait for a notification or the given delay, whichever comes first.
+        """
+        try:
+            await asyncio.wait_for(self._condition.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _Reservation:
+    def __init__(self, reserved: int):
+        self.reserved = reserved
+        self.used: Optional[int] = None
+        self.headers: Optional[Mapping[str, str]] = None
+        self.throttled = False
+
+    def observe(self, headers: Mapping[str, str], used: Optional[int]):
+        """
+        Record the rate-limit headers and the token usage of the response.
+        """
+        self.headers = headers
+        self.used = used
+
+
+def budget_for(model: str) -> TokenBudget:
+    """
+    Return the budget of the model, creating it on first use in the running event
+    loop. The budgets of an earlier loop can't be awaited in this one; their
+    limits, as reported by the API, are carried over.
+    """
+    global _budgets_loop
+    loop = asyncio.get_running_loop()
+    if _budgets_loop is not loop:
+        for name, previous in _budgets.items():
+            _budgets[name] = TokenBudget(previous.rpm, previous.tpm)
+        _budgets_loop = loop
+    if (budget := _budgets.get(model)) is None:
+        budget = TokenBudget(*DEFAULT_LIMITS.get(model, FALLBACK_LIMITS))
+        _budgets[model] = budget
+    return budget
+
+
+def utilization() -> Dict[str, Dict[str, float]]:
+    """
+    Return the current limits and usage of all models used so far.
+    """
+    return {model: budget.utilization() for model, budget in _budgets.items()}
+
+
+def estimate_tokens(messages: list, completion_chars: int = 0) -> int:
+    """
+    Estimate the prompt and completion tokens of a request from the text lengths.
+    """
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    return int(
+        (prompt_chars + completion_chars) / CHARS_PER_TOKEN
+        + TOKENS_PER_MESSAGE * len(messages)
+    )
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate-limit reset duration such as "1s", "6m0s" or "120ms" into seconds.
+    """
+    if not value:
+        return None
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    if retry_after_ms := headers.get("retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    return parse_retry_after(headers.get("retry-after"))
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,278 @@
+"""
+This module provides the shared HTTP transport used by the scraping stages.
+
+It consists of three parts:
+
+- A long-lived, pooled ``httpx.AsyncClient`` (optionally speaking HTTP/2) that is
+  shared by all stages instead of creating a new client per stage. It is closed
+  when its event loop shuts down.
+- A ``HostRateController`` per host, which limits the number of concurrent
+  requests with an AIMD scheme: the limit grows additively while responses are
+  fast and successful, and is halved on 429 and 5xx responses and timeouts. An
+  optional token bucket caps the request rate on top of that.
+- Support for ``Retry-After``: a throttled response pauses all requests to the
+  host for the requested time, instead of putting every task to sleep for minutes.
+"""
+
+import asyncio
+import email.utils
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from httpx import URL, AsyncClient, Limits, Response, TimeoutException
+
+from src.common import config
+
+# Retry-After is honoured on these; 5xx responses also count as congestion
+THROTTLE_STATUS_CODES = (429, 503)
+
+_client: Optional[AsyncClient] = None
+_closer: Optional[asyncio.Task] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_controllers: Dict[str, "HostRateController"] = {}
+_controllers_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class HostRateController:
+    """
+    Adaptive concurrency (AIMD) and rate (token bucket) limit for a single host.
+    """
+
+    def __init__(
+        self,
+        initial_concurrency: float = 4,
+        min_concurrency: float = 1,
+        max_concurrency: float = 32,
+        latency_target: float = 5.0,
+        rate: Optional[float] = None,
+        burst: int = 1,
+    ):
+        self.limit = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.rate = rate
+        self.burst = burst
+
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """
+        Wait until a request to the host may be sent.
+        """
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await self._wait(self._blocked_until - now)
+                elif self.in_flight >= max(int(self.limit), 1):
+                    await self._condition.wait()
+                elif (delay := self._take_token(now)) > 0:
+                    await self._wait(delay)
+                else:
+                    self.in_flight += 1
+                    return
+
+    async def release(
+        self,
+        latency: Optional[float] = None,
+        throttled: bool = False,
+        retry_after: Optional[float] = None,
+    ):
+        """
+        Give back the slot of a finished request and adapt the limit to its outcome.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                # Multiplicative decrease
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if retry_after:
+                    self._blocked_until = max(
+                        self._blocked_until, time.monotonic() + retry_after
+                    )
+            elif latency is not None and latency <= self.latency_target:
+                # Additive increase, by roughly one slot per round trip of the window
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator["_Slot"]:
+        """
+        Hold a request slot; the outcome is reported through the yielded object.
+        """
+        await self.acquire()
+        outcome = _Slot()
+        try:
+            yield outcome
+        except TimeoutException:
+            outcome.throttled = True
+            raise
+        finally:
+            await self.release(
+                latency=outcome.latency or time.monotonic() - outcome.started,
+                throttled=outcome.throttled,
+                retry_after=outcome.retry_after,
+            )
+
+    def _take_token(self, now: float) -> float:
+        """
+        Take a token from the bucket. Returns the time to wait if none is available.
+        """
+        if self.rate is None:
+            return 0.0
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def _wait(self, delay: float):
+        """
+        Wait for a notification or the given delay, whichever comes first.
+        """
+        try:
+            await asyncio.wait_for(self._condition.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _Slot:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+        self.throttled = False
+        self.retry_after: Optional[float] = None
+
+    def observe(self, response: Response):
+        """
+        Record the outcome of the request sent in this slot.
+        """
+        # Time to the response headers, so large bodies don't count as slow responses
+        self.latency = time.monotonic() - self.started
+        if response.status_code in THROTTLE_STATUS_CODES:
+            self.throttled = True
+            self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        elif response.is_server_error:
+            # An overloaded server or proxy, so back off like on a 429
+            self.throttled = True
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delay in seconds or HTTP date) into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def get_client() -> AsyncClient:
+    """
+    Return the shared client, creating it on first use in the running event loop.
+    The client is closed when the loop shuts down.
+    """
+    global _client, _client_loop, _closer
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        if _closer is not None and _client_loop is loop:
+            _closer.cancel()
+        _client = AsyncClient(
+            timeout=config.SCRAPING_TIMEOUT,
+            http2=_http2_available() and config.SCRAPING_HTTP2,
+            limits=Limits(
+                max_connections=config.SCRAPING_MAX_CONCURRENCY,
+                max_keepalive_connections=config.SCRAPING_MAX_CONCURRENCY,
+                keepalive_expiry=config.SCRAPING_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client_loop = loop
+        _closer = loop.create_task(_close_with_loop(_client))
+    return _client
+
+
+def controller_for(url: URL) -> HostRateController:
+    """
+    Return the rate controller of the host the URL points to. The controllers
+    are created anew in each event loop, as their conditions are bound to it.
+    """
+    global _controllers_loop
+    loop = asyncio.get_running_loop()
+    if _controllers_loop is not loop:
+        _controllers.clear()
+        _controllers_loop = loop
+    host = URL(url).host
+    if (controller := _controllers.get(host)) is None:
+        controller = HostRateController(
+            initial_concurrency=config.SCRAPING_INITIAL_CONCURRENCY,
+            max_concurrency=config.SCRAPING_MAX_CONCURRENCY,
+            rate=config.SCRAPING_MAX_RATE,
+        )
+        _controllers[host] = controller
+    return controller
+
+
+async def request(
+    method: str, url: URL, client: Optional[AsyncClient] = None, **kwargs
+) -> Response:
+    """
+    Send a request through the rate controller of its host.
+    """
+    client = client or get_client()
+    async with controller_for(url).slot() as slot:
+        response = await client.request(method, url, **kwargs)
+        slot.observe(response)
+    return response
+
+
+@asynccontextmanager
+async def stream(
+    method: str, url: URL, client: Optional[AsyncClient] = None, **kwargs
+) -> AsyncIterator[Response]:
+    """
+    Stream a response through the rate controller of its host. The slot is held
+    until the body has been consumed.
+    """
+    client = client or get_client()
+    async with controller_for(url).slot() as slot:
+        async with client.stream(method, url, **kwargs) as response:
+            slot.observe(response)
+            yield response
+
+
+async def _close_with_loop(client: AsyncClient):
+    """
+    Close the client once this task is cancelled: ``asyncio.run`` cancels the
+    remaining tasks before closing the loop, and the connections of the client
+    can't be closed from another loop.
+    """
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await client.aclose()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
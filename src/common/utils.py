@@ -4,17 +4,21 @@ Utility functions for the law-ai project.
 
 import json
 from pathlib import Path
-from typing import Generator, List
+from typing import Generator, Iterator, List
 from uuid import UUID
 
 from httpx import URL
 
-from src.common import config
+from src.common import artifacts, config
 from src.common.types import (
+    Appellant,
+    Decision,
     DocumentAugmented,
     DocumentLabeled,
     DocumentParsed,
     DocumentText,
+    GrammaticalGender,
+    LegalPartyType,
     ScrapingID,
 )
 
@@ -26,6 +30,19 @@ def flatten_text(text: str) -> str:
     return " ".join(text.split())
 
 
+def is_augmentable(doc: DocumentLabeled) -> bool:
+    """
+    Whether the appellant of a labeled document is a single individual whose
+    grammatical gender can be swapped, and the decision is clear.
+    """
+    return (
+        doc["appellant"] in (Appellant.PLAINTIFF, Appellant.DEFENDANT)
+        and doc["decision"] != Decision.OTHER
+        and doc["appellant_type"] == LegalPartyType.INDIVIDUAL
+        and doc["appellant_gender"] != GrammaticalGender.NEUTER
+    )
+
+
 def get_document_path(document_id: UUID) -> Path:
     """
     Get the path to the document PDF file based on its ID.
@@ -48,6 +65,16 @@ def _read_jsonl(fp: Path) -> Generator[dict, None, None]:
             yield entry
 
 
+def _read_documents(stage: str, fp: Path) -> Iterator[dict]:
+    """
+    Read the documents of a stage from its JSONL file, or from the columnar store
+    with ``ARTIFACT_FORMAT=arrow``.
+    """
+    if config.ARTIFACT_FORMAT == "arrow":
+        return artifacts.read(stage)
+    return _read_jsonl(fp)
+
+
 def load_scraping_ids() -> List[ScrapingID]:
     """
     Load the scraping IDs.
@@ -62,7 +89,8 @@ def load_documents_text() -> List[DocumentText]:
     Load the documents text.
     """
     return [
-        DocumentText(**doc_text) for doc_text in _read_jsonl(config.DOCS_TEXT_JSONL)
+        DocumentText(**doc_text)
+        for doc_text in _read_documents("text", config.DOCS_TEXT_JSONL)
     ]
 
 
@@ -72,7 +100,7 @@ def load_documents_parsed() -> List[DocumentParsed]:
     """
     return [
         DocumentParsed(**doc_parsed)
-        for doc_parsed in _read_jsonl(config.DOCS_PARSED_JSONL)
+        for doc_parsed in _read_documents("parsed", config.DOCS_PARSED_JSONL)
     ]
 
 
@@ -82,7 +110,7 @@ def load_documents_labeled() -> List[DocumentLabeled]:
     """
     return [
         DocumentLabeled(**doc_labeled)
-        for doc_labeled in _read_jsonl(config.DOCS_LABELED_JSONL)
+        for doc_labeled in _read_documents("labeled", config.DOCS_LABELED_JSONL)
     ]
 
 
@@ -92,5 +120,5 @@ def load_documents_augmented() -> List[DocumentAugmented]:
     """
     return [
         DocumentAugmented(**doc_augmented)
-        for doc_augmented in _read_jsonl(config.DOCS_AUGMENTED_JSONL)
+        for doc_augmented in _read_documents("augmented", config.DOCS_AUGMENTED_JSONL)
     ]
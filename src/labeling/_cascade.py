@@ -0,0 +1,194 @@
+"""
+This module labels documents with a cascade of models: every document is labeled
+by GPT-4.1 mini first, and only escalated to GPT-4.1 if the small model is
+uncertain about one of the fields.
+
+The confidence of a field is the probability of the enum value the small model
+chose, from the logprobs of its tokens (see
+``cached_generation.field_confidences``). A document is escalated as a whole if
+any field is below ``LABEL_CASCADE_THRESHOLD``, and then takes all labels from
+GPT-4.1, since the large model reads the same prompt either way.
+
+The threshold is calibrated against the existing GPT-4.1 labels: the small model
+labels the labeled documents, and for each candidate threshold the escalation
+rate, the agreement of the cascade with GPT-4.1 and its relative cost are
+reported, along with the lowest threshold that reaches the target agreement::
+
+    python -m src.labeling._cascade --target 0.99
+"""
+
+import argparse
+import asyncio
+import statistics
+from typing import Dict, List, Optional
+
+from tqdm.auto import tqdm
+
+from src.common import cached_generation, config, executor, telemetry
+from src.common.cached_generation import Model
+from src.common.types import DocumentLabeled, Message
+from src.common.utils import load_documents_labeled
+from src.labeling._model import CaseInfo
+
+# Paths of the fields in the response, and the labels they are stored as
+FIELDS = {
+    "plaintiff.type": "plaintiff_type",
+    "plaintiff.grammatical_gender": "plaintiff_gender",
+    "defendant.type": "defendant_type",
+    "defendant.grammatical_gender": "defendant_gender",
+    "appellant": "appellant",
+    "decision": "decision",
+}
+THRESHOLDS = (0.5, 0.8, 0.9, 0.95, 0.98, 0.99, 0.995, 0.999)
+
+
+async def parse_cascade(
+    messages: List[Message], threshold: Optional[float] = None
+) -> CaseInfo:
+    """
+    Label a document with the small model, escalating it to the large model if
+    any field is less certain than the threshold.
+    """
+    threshold = config.LABEL_CASCADE_THRESHOLD if threshold is None else threshold
+    r, confidences = await cached_generation.parse_with_confidence(
+        model=Model.GPT_41_MINI, messages=messages, response_format=CaseInfo
+    )
+    if confidence(confidences) >= threshold:
+        return r
+    return await cached_generation.parse(
+        model=Model.GPT_41, messages=messages, response_format=CaseInfo
+    )
+
+
+def confidence(confidences: Dict[str, float]) -> float:
+    """
+    The confidence of a labeling: that of its least certain field. Completions
+    without logprobs have no confidence.
+    """
+    return min(confidences.get(path, 0.0) for path in FIELDS)
+
+
+def report(records: List[dict]):
+    """
+    Print the escalation rate of a cascade run and its cost and latency compared
+    to labeling every document with the large model.
+    """
+    small = [r for r in records if r["model"] == Model.GPT_41_MINI.value]
+    large = [r for r in records if r["model"] == Model.GPT_41.value]
+    n_small, n_large = telemetry.lookups(small), telemetry.lookups(large)
+    if not n_small:
+        return
+
+    # Cache hits are priced as well, so that reruns report the same savings
+    cascade_cost = sum(map(telemetry.cost, small + large))
+    # The models share the tokenizer, so the small model's usage prices the large one
+    baseline_cost = sum(telemetry.cost(r, Model.GPT_41.value) for r in small)
+    print(
+        f"Cascade: escalated {n_large} of {n_small} documents "
+        f"({n_large / n_small:.1%})"
+    )
+    print(
+        f"  cost ${cascade_cost:.2f} vs. ${baseline_cost:.2f} with {Model.GPT_41.value} "
+        f"only ({1 - cascade_cost / baseline_cost:.1%} saved)"
+        if baseline_cost
+        else f"  cost ${cascade_cost:.2f}"
+    )
+
+    small_latency = [r["wall_time"] for r in small if not r["cache_hit"]]
+    large_latency = [r["wall_time"] for r in large if not r["cache_hit"]]
+    if small_latency and large_latency:
+        escalation_rate = n_large / n_small
+        cascade_latency = statistics.mean(
+            small_latency
+        ) + escalation_rate * statistics.mean(large_latency)
+        print(
+            f"  mean latency per document {cascade_latency:.2f} s vs. "
+            f"{statistics.mean(large_latency):.2f} s with {Model.GPT_41.value} only"
+        )
+
+
+async def calibrate(
+    target: float = 0.99, concurrency: int = 10, thresholds=THRESHOLDS
+) -> Optional[float]:
+    """
+    Label the labeled documents with the small model and compare the cascade
+    with the existing labels for each threshold. Returns the lowest threshold
+    whose agreement reaches the target.
+    """
+    from src.labeling._label_docs import _messages
+
+    documents = load_documents_labeled()
+    if not documents:
+        print("No labeled documents to calibrate with.")
+        return None
+
+    async def label(doc: DocumentLabeled):
+        with telemetry.scope(document_id=str(doc["id"])):
+            r, confidences = await cached_generation.parse_with_confidence(
+                model=Model.GPT_41_MINI,
+                messages=_messages(doc),
+                response_format=CaseInfo,
+            )
+        values = {
+            "plaintiff_type": r.plaintiff.type,
+            "plaintiff_gender": r.plaintiff.grammatical_gender,
+            "defendant_type": r.defendant.type,
+            "defendant_gender": r.defendant.grammatical_gender,
+            "appellant": r.appellant,
+            "decision": r.decision,
+        }
+        agrees = all(values[field] == doc[field] for field in FIELDS.values())
+        return confidence(confidences), agrees
+
+    results = []
+    with telemetry.run() as records, telemetry.scope(
+        stage="label_cascade_calibration"
+    ), tqdm(total=len(documents)) as pbar:
+        async for r in executor.run_bounded(documents, label, concurrency=concurrency):
+            pbar.update(1)
+            if r.error is not None:
+                print(f"Error labeling {r.item['id']}: {r.error!r}")
+            else:
+                results.append(r.value)
+
+    small_cost = sum(map(telemetry.cost, records))
+    large_cost = sum(telemetry.cost(r, Model.GPT_41.value) for r in records)
+
+    print(
+        f"Small model agrees with {sum(a for _, a in results) / len(results):.1%} "
+        f"of {len(results)} documents"
+    )
+    print(f"{'threshold':>10} {'escalated':>10} {'agreement':>10} {'cost':>8}")
+    recommended = None
+    for threshold in thresholds:
+        escalated = sum(c < threshold for c, _ in results) / len(results)
+        # Escalated documents get the large model's labels, which agree by definition
+        agreement = sum(c < threshold or a for c, a in results) / len(results)
+        relative_cost = (
+            (small_cost + escalated * large_cost) / large_cost if large_cost else 0.0
+        )
+        print(
+            f"{threshold:>10} {escalated:>10.1%} {agreement:>10.1%} "
+            f"{relative_cost:>8.1%}"
+        )
+        if recommended is None and agreement >= target:
+            recommended = threshold
+
+    if recommended is None:
+        print(f"No threshold reaches {target:.1%} agreement.")
+    else:
+        print(f"Set LABEL_CASCADE_THRESHOLD={recommended} for {target:.1%} agreement.")
+    return recommended
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=0.99,
+        help="Agreement with the existing labels to reach (default 0.99).",
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(calibrate(args.target, args.concurrency))
@@ -2,46 +2,93 @@
 Label documents with case information using the GPT-4o model.
 """
 
-import asyncio
-import json
-from itertools import batched
+from collections import Counter
+from functools import partial
+from typing import List
 
 from tqdm.auto import tqdm
 
-from src.common import cached_generation, config, prompts
+from src.common import (
+    artifacts,
+    cached_generation,
+    executor,
+    generation_batch,
+    prompts,
+    telemetry,
+)
 from src.common.types import Appellant, DocumentLabeled, DocumentParsed, Message
 from src.common.utils import load_documents_parsed
 from src.labeling._model import CaseInfo
 
 
-async def label_docs():
+async def label_docs(
+    concurrency: int = 10,
+    batch: bool = False,
+    skip_ineligible: bool = False,
+    cascade: bool = False,
+):
     """
-    Main function to label documents with case information.
+    Main function to label documents with case information. With ``batch``, the
+    uncached requests are first run as OpenAI batch jobs. With ``skip_ineligible``,
+    documents that the pre-classifier finds ineligible for the augmentation are
+    not labeled (and left out of the labeled documents). With ``cascade``, the
+    documents are labeled by the small model first and only escalated to the
+    large one if a field is uncertain (see ``src.labeling._cascade``).
     """
-    sem = asyncio.Semaphore(10)
     docs_parsed = load_documents_parsed()
+    if skip_ineligible:
+        docs_parsed = _skip_ineligible(docs_parsed)
+    process = partial(_process, cascade=cascade)
+    if batch:
+        await generation_batch.prefill(docs_parsed, process, "label_docs")
 
     # noinspection DuplicatedCode
     async def generate():
+        # Longest documents first, as they take longest to label
         with tqdm(total=len(docs_parsed)) as pbar:
-            for batch in batched(docs_parsed, 25):
-                tasks = (_process(doc, sem) for doc in batch)
-                for r in await asyncio.gather(*tasks):
-                    pbar.update(1)
-                    yield r
+            async for r in executor.run_bounded(
+                docs_parsed,
+                process,
+                concurrency=concurrency,
+                size=lambda doc: len(doc["facts"]) + len(doc["operative"]),
+            ):
+                pbar.update(1)
+                if r.error is not None:
+                    print(f"Error labeling {r.item['id']}: {r.error!r}")
+                yield r
 
-    results = [r async for r in generate()]
-    content = "\n".join(json.dumps(r, default=lambda x: str(x)) for r in results)
-    config.DOCS_LABELED_JSONL.write_text(content, encoding="utf-8")
+    with telemetry.run() as records, telemetry.scope(stage="label_docs"):
+        results = [
+            r.value for r in executor.in_order([r async for r in generate()]) if r.value
+        ]
+    telemetry.report(records)
+    if cascade:
+        from src.labeling._cascade import report
+
+        report(records)
+    artifacts.write("labeled", results)
 
     return results
 
 
-async def _process(doc: DocumentParsed, sem: asyncio.Semaphore):
-    """
-    Process a single document to extract case information.
-    """
-    messages = [
+def _skip_ineligible(docs: List[DocumentParsed]) -> List[DocumentParsed]:
+    from src.labeling._preclassify import preclassify
+
+    reasons = Counter()
+    remaining = []
+    for doc in docs:
+        if reason := preclassify(doc).ineligible:
+            reasons[reason] += 1
+        else:
+            remaining.append(doc)
+    print(f"Skipped {len(docs) - len(remaining)} of {len(docs)} documents:")
+    for reason, n in reasons.most_common():
+        print(f"  {reason}: {n}")
+    return remaining
+
+
+def _messages(doc: DocumentParsed) -> list[Message]:
+    return [
         Message(
             role="system",
             content=prompts.CREATE_CASE_INFO_SYSTEM,
@@ -54,12 +101,24 @@ async def _process(doc: DocumentParsed, sem: asyncio.Semaphore):
             ),
         ),
     ]
-    r = await cached_generation.parse(
-        model=cached_generation.Model.GPT_41,
-        messages=messages,
-        response_format=CaseInfo,
-        sem=sem,
-    )
+
+
+async def _process(doc: DocumentParsed, cascade: bool = False):
+    """
+    Process a single document to extract case information.
+    """
+    messages = _messages(doc)
+    with telemetry.scope(document_id=str(doc["id"])):
+        if cascade:
+            from src.labeling._cascade import parse_cascade
+
+            r = await parse_cascade(messages)
+        else:
+            r = await cached_generation.parse(
+                model=cached_generation.Model.GPT_41,
+                messages=messages,
+                response_format=CaseInfo,
+            )
     if r.appellant == Appellant.PLAINTIFF:
         appellant_type = r.plaintiff.type
         appellant_gender = r.plaintiff.grammatical_gender
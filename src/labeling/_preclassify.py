@@ -0,0 +1,276 @@
+"""
+This module pre-classifies parsed documents with regular expressions, so that
+documents the augmentation would discard are not sent to the labeling model.
+
+The appellant and the decision are read from the operative part ("Auf die
+Revision der Beklagten wird das Urteil ... aufgehoben", "Die Revision des
+Klägers ... wird zurückgewiesen"), the type and grammatical gender of the parties
+from the way the facts refer to them ("Die Klägerin, eine GmbH, ...", "Das
+beklagte Land", "Die Kläger zu 1 und 2"). A field is only predicted if its cues
+are unambiguous.
+
+A document is skipped only if the predicted fields alone make it ineligible for
+the augmentation (see ``is_augmentable``): both parties appealed, the decision
+is mixed, or the appellant is a company, a public body or several persons.
+The calls saved and the disagreement with the existing labels are reported with::
+
+    python -m src.labeling._preclassify
+"""
+
+import argparse
+import re
+from collections import Counter
+from typing import NamedTuple, Optional, Tuple
+
+from src.common.types import (
+    Appellant,
+    Decision,
+    DocumentParsed,
+    GrammaticalGender,
+    LegalPartyType,
+)
+from src.common.utils import (
+    is_augmentable,
+    load_documents_labeled,
+    load_documents_parsed,
+)
+
+REMEDY = r"(?:Revision|Nichtzulassungsbeschwerde|Rechtsbeschwerde)"
+APPELLANT_PATTERN = re.compile(
+    rf"\b{REMEDY}\s+(des|der)\s+(Klägers|Klägerin|Kläger|Beklagten)\b(\s+zu\s+\d)?"
+)
+# "Auf die Revision des beklagten Landes"
+ENTITY_APPELLANT_PATTERN = re.compile(
+    rf"\b{REMEDY}\s+(?:des|der)\s+(klagenden|beklagten)\s+(\w+)"
+)
+BOTH_PATTERN = re.compile(
+    r"\b(?:Revisionen|Nichtzulassungsbeschwerden|Rechtsbeschwerden|Anschlussrevision)\b"
+    rf"|\b{REMEDY}\s+der\s+Parteien\b"
+)
+REVERSED_PATTERN = re.compile(r"\b(?:aufgehoben|abgeändert)\b")
+# Only the appellant's remedy counts, not e.g. "Die Berufung ... wird zurückgewiesen"
+UPHELD_PATTERN = re.compile(rf"\b{REMEDY}\b[^.]*?\b(?:zurückgewiesen|verworfen)\b")
+PARTIAL_PATTERN = re.compile(r"\bteilweise\b")
+
+MENTIONS = {
+    Appellant.PLAINTIFF: r"\b(?:[Dd]er|[Dd]ie)\s+Kläger(?:in)?\b",
+    Appellant.DEFENDANT: r"\b(?:[Dd]er|[Dd]ie)\s+Beklagte\b",
+}
+GENDERS = {
+    Appellant.PLAINTIFF: {
+        GrammaticalGender.MASCULINE: re.compile(
+            r"\b(?:[Dd]er|[Dd]es|[Dd]em|[Dd]en)\s+Klägers?\b"
+        ),
+        GrammaticalGender.FEMININE: re.compile(r"\bKlägerin\b"),
+    },
+    Appellant.DEFENDANT: {
+        GrammaticalGender.MASCULINE: re.compile(
+            r"\b(?:[Dd]er\s+Beklagte|[Dd]es\s+Beklagten|[Dd]em\s+Beklagten)\b"
+        ),
+        GrammaticalGender.FEMININE: re.compile(r"\b[Dd]ie\s+Beklagte\b"),
+    },
+}
+PLURAL_VERBS = r"(?:sind|waren|haben|hatten|verlangen|begehren|nehmen|machen)"
+MULTIPLE = {
+    Appellant.PLAINTIFF: re.compile(
+        rf"\bKläger(?:in|n)?\s+zu\s+\d|\bDie\s+Kläger\s+{PLURAL_VERBS}\b"
+    ),
+    Appellant.DEFENDANT: re.compile(
+        rf"\bBeklagten?\s+zu\s+\d|\bDie\s+Beklagten\s+{PLURAL_VERBS}\b"
+    ),
+}
+ADJECTIVES = {Appellant.PLAINTIFF: "klagende", Appellant.DEFENDANT: "beklagte"}
+ENTITIES = (
+    r"GmbH|AG|KG|OHG|GbR|SE|mbH|e\.\s?V\.|\w*(?:[Gg]esellschaft|[Gg]enossenschaft|"
+    r"[Vv]erein|[Bb]ank|[Ss]parkasse|[Vv]ersicherung|[Vv]ersicherer|[Ss]tiftung|"
+    r"[Uu]nternehmen|[Ii]nstitut|[Kk]onzern|[Ff]irma|[Vv]erband|[Kk]asse)"
+)
+PUBLIC_ENTITIES = (
+    r"\w*(?:[Ll]and|[Ss]tadt|[Gg]emeinde|[Kk]reis|[Kk]ommune|[Kk]örperschaft|"
+    r"[Aa]nstalt|[Bb]ehörde)|Bundesrepublik|Freistaat"
+)
+# An apposition or predicate of a mention ("Die Klägerin, eine in Köln ansässige
+# GmbH," or "Der Beklagte ist ein eingetragener Verein"), whose head noun follows
+# the article after at most a few adjectives or names
+APPOSITION = (
+    r"(?:,|\s+(?:ist|war|sind|waren))\s+(?:ein|eine|die|der|das)\s+"
+    r"(?:(?!(?:der|des|dem|den|vom|beim|zum|zur|und|oder)\b)[\w.&-]+\s+){0,4}?"
+)
+
+
+class Preclassification(NamedTuple):
+    appellant: Optional[Appellant]
+    decision: Optional[Decision]
+    appellant_type: Optional[LegalPartyType]
+    appellant_gender: Optional[GrammaticalGender]
+    # Why the document is ineligible for the augmentation, if it certainly is
+    ineligible: Optional[str]
+
+
+def preclassify(doc: DocumentParsed) -> Preclassification:
+    """
+    Predict the appellant, the decision and the type and gender of the appellant,
+    where the cues are unambiguous.
+    """
+    appellant, appellant_type, gender = _appellant(doc["operative"])
+    decision = _decision(doc["operative"])
+
+    if appellant in (Appellant.PLAINTIFF, Appellant.DEFENDANT):
+        facts_type, facts_gender = _party(doc["facts"], appellant)
+        appellant_type = appellant_type or facts_type
+        gender = gender or facts_gender
+
+    if appellant == Appellant.BOTH:
+        ineligible = "both parties appealed"
+    elif decision == Decision.OTHER:
+        ineligible = "mixed decision"
+    elif appellant_type not in (None, LegalPartyType.INDIVIDUAL):
+        ineligible = f"appellant is {appellant_type.value}"
+    elif gender == GrammaticalGender.NEUTER:
+        ineligible = "appellant is neuter"
+    else:
+        ineligible = None
+    return Preclassification(appellant, decision, appellant_type, gender, ineligible)
+
+
+def _appellant(
+    operative: str,
+) -> Tuple[Optional[Appellant], Optional[LegalPartyType], Optional[GrammaticalGender]]:
+    """
+    Return the appellant named in the operative part, and its type and gender
+    where the wording shows them.
+    """
+    if BOTH_PATTERN.search(operative):
+        return Appellant.BOTH, None, None
+    parties = set()
+    types = set()
+    genders = set()
+    for article, noun, number in APPELLANT_PATTERN.findall(operative):
+        parties.add(
+            Appellant.PLAINTIFF if noun.startswith("Kläger") else Appellant.DEFENDANT
+        )
+        if number or noun == "Kläger":
+            # "der Kläger" (plural genitive) or "der Beklagten zu 1"
+            types.add(LegalPartyType.MULTIPLE_INDIVIDUALS)
+        elif article == "des":
+            genders.add(GrammaticalGender.MASCULINE)
+        elif noun == "Klägerin":
+            genders.add(GrammaticalGender.FEMININE)
+    for adjective, noun in ENTITY_APPELLANT_PATTERN.findall(operative):
+        parties.add(
+            Appellant.PLAINTIFF if adjective == "klagenden" else Appellant.DEFENDANT
+        )
+        if re.fullmatch(rf"(?:{PUBLIC_ENTITIES})(?:e?s)?", noun):
+            types.add(LegalPartyType.PUBLIC_ENTITY)
+        elif re.fullmatch(rf"(?:{ENTITIES})", noun):
+            types.add(LegalPartyType.LEGAL_ENTITY)
+    if len(parties) != 1:
+        return (Appellant.BOTH if len(parties) > 1 else None), None, None
+
+    appellant_type = types.pop() if len(types) == 1 else None
+    gender = genders.pop() if len(genders) == 1 else None
+    return parties.pop(), appellant_type, gender
+
+
+def _decision(operative: str) -> Optional[Decision]:
+    reversed_ = bool(REVERSED_PATTERN.search(operative))
+    upheld = bool(UPHELD_PATTERN.search(operative))
+    if reversed_ and (upheld or PARTIAL_PATTERN.search(operative)):
+        # "... aufgehoben. Im Übrigen wird die Revision zurückgewiesen."
+        return Decision.OTHER
+    if reversed_:
+        return Decision.REVERSED
+    if upheld:
+        return Decision.UPHELD
+    return None
+
+
+def _party(
+    facts: str, party: Appellant
+) -> Tuple[Optional[LegalPartyType], Optional[GrammaticalGender]]:
+    """
+    Return the type and grammatical gender of a party from the facts.
+    """
+    # "Das beklagte Land", "die klagende Gemeinde", "vom beklagten Land"
+    if m := re.search(
+        rf"\b([Dd]as|[Dd]er|[Dd]ie|[Dd]e[msn]|vom)\s+{ADJECTIVES[party]}[nrsm]?\s+"
+        rf"(?:({ENTITIES})|{PUBLIC_ENTITIES})\b",
+        facts,
+    ):
+        gender = {
+            "das": GrammaticalGender.NEUTER,
+            "der": GrammaticalGender.MASCULINE,
+            "die": GrammaticalGender.FEMININE,
+        }.get(m.group(1).lower())
+        if m.group(2):
+            return LegalPartyType.LEGAL_ENTITY, gender
+        return LegalPartyType.PUBLIC_ENTITY, gender
+
+    if MULTIPLE[party].search(facts):
+        return LegalPartyType.MULTIPLE_INDIVIDUALS, None
+
+    # The gender is only predicted if the facts use one gender for the party
+    counts = {
+        gender: len(pattern.findall(facts))
+        for gender, pattern in GENDERS[party].items()
+    }
+    gender = None
+    if any(counts.values()) and min(counts.values()) == 0:
+        gender = max(counts, key=counts.get)
+
+    mention = MENTIONS[party]
+    if re.search(rf"{mention}{APPOSITION}(?:{PUBLIC_ENTITIES})\b", facts):
+        return LegalPartyType.PUBLIC_ENTITY, gender
+    if re.search(rf"{mention}{APPOSITION}(?:{ENTITIES})\b", facts):
+        return LegalPartyType.LEGAL_ENTITY, gender
+    return None, gender
+
+
+def report():
+    """
+    Report the calls saved on the parsed corpus, and how often the skipped
+    documents disagree with the existing labels.
+    """
+    parsed = load_documents_parsed()
+    skipped = [doc for doc in parsed if preclassify(doc).ineligible]
+    print(
+        f"Skipped {len(skipped)} of {len(parsed)} parsed documents "
+        f"({len(skipped) / max(len(parsed), 1):.1%} of the labeling calls)"
+    )
+
+    labeled = load_documents_labeled()
+    if not labeled:
+        print("No labeled documents to compare with.")
+        return
+    reasons = Counter()
+    disagreements = Counter()
+    fields = Counter()
+    agreements = Counter()
+    for doc in labeled:
+        prediction = preclassify(doc)
+        if prediction.ineligible:
+            reasons[prediction.ineligible] += 1
+            # Skipping a document the augmentation would have used loses it
+            disagreements[prediction.ineligible] += is_augmentable(doc)
+        for field in ("appellant", "decision", "appellant_type", "appellant_gender"):
+            if (value := getattr(prediction, field)) is not None:
+                fields[field] += 1
+                agreements[field] += value == doc[field]
+
+    total = sum(reasons.values())
+    lost = sum(disagreements.values())
+    print(f"Skipped {total} of {len(labeled)} labeled documents:")
+    for reason, n in reasons.most_common():
+        print(f"  {reason:<40} {n:>6} ({disagreements[reason]} augmentable)")
+    print(f"Disagreement rate of the skipped documents: {lost / max(total, 1):.1%}")
+    for field, n in fields.items():
+        print(
+            f"  {field:<20} predicted for {n / len(labeled):>6.1%}, "
+            f"agreement {agreements[field] / n:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.parse_args()
+    report()
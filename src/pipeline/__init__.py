@@ -0,0 +1 @@
+from src.pipeline._streaming import run_pipeline
@@ -0,0 +1,556 @@
+"""
+This module updates the artifacts of the stages incrementally: only the documents
+whose fingerprint changed are recomputed, and the results are merged into the
+existing JSONL files or, with ``ARTIFACT_FORMAT=arrow``, the tables of the store.
+
+The fingerprint of a document in a stage covers the input of the stage (the
+bytes of the PDF, or the line of the document in the artifact of the previous
+stage) and the version of the stage: the source of its modules, its prompts,
+models and options. The fingerprints are kept in ``FINGERPRINTS_DB`` along with
+a digest of each output line, which is the input of the next stage. Documents a
+stage drops (e.g. PDFs that are no Urteil) are recorded too, so they aren't
+retried until their input or the stage changes; documents that fail are not.
+
+A daily run after new judgments have been published::
+
+    python -m src.pipeline._incremental --scrape --since 2025-01-31 --jobs 4
+
+``--ids`` restricts the run to some documents, ``--force`` recomputes them
+regardless of their fingerprints and ``--adopt`` records the fingerprints of
+artifacts written by the stage functions, without recomputing anything.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from functools import partial
+from importlib import metadata
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from httpx import URL
+from tqdm import tqdm
+
+from src.common import artifacts, config, executor, telemetry, transport
+from src.common.types import DocumentText, ScrapingID
+from src.common.utils import get_document_path, is_augmentable, load_scraping_ids
+from src.pipeline._streaming import ID_PATTERN
+
+STAGES = ("extract", "parse", "label", "augment")
+
+
+class Fingerprints:
+    """
+    SQLite-backed record of the fingerprints and output digests per stage and
+    document, and of the digests of the PDFs.
+    """
+
+    def __init__(self, path: Path):
+        self._db = _open_db(path)
+
+    def get(self, stage: str) -> Dict[UUID, Tuple[str, Optional[str]]]:
+        """
+        The fingerprint and output digest of every document of a stage.
+        """
+        rows = self._db.execute(
+            "SELECT id, input, output FROM fingerprints WHERE stage = ?", (stage,)
+        )
+        return {UUID(id_): (input_, output) for id_, input_, output in rows}
+
+    def set(self, stage: str, rows: List[Tuple[UUID, str, Optional[str]]]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                [(stage, str(id_), input_, output) for id_, input_, output in rows],
+            )
+
+    def pdf_digest(self, document_id: UUID) -> Optional[str]:
+        """
+        The SHA-256 of a PDF, only read again if its size or mtime changed.
+        """
+        path = get_document_path(document_id)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        row = self._db.execute(
+            "SELECT size, mtime_ns, digest FROM pdfs WHERE id = ?", (str(document_id),)
+        ).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?)",
+                (str(document_id), stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+
+async def run_incremental(
+    ids: Optional[List[UUID]] = None,
+    since: Optional[datetime] = None,
+    jobs: int = 1,
+    concurrency: int = 10,
+    scrape: bool = False,
+    force: bool = False,
+    adopt: bool = False,
+    skip_ineligible: bool = False,
+    cascade: bool = False,
+    chunk_chars: Optional[int] = None,
+    rule_threshold: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Bring the artifacts of all stages up to date for the selected documents and
+    return the number of documents recomputed per stage.
+
+    The documents are those of ``ids`` (all by default) whose PDF was written
+    at or after ``since``; missing PDFs are downloaded first. ``jobs`` is the
+    number of processes of the extraction and the parsing, ``concurrency`` that
+    of the LLM stages. With ``scrape``, new case IDs are scraped first. The
+    other options are those of ``label_docs`` and ``create_augmentations``.
+    """
+    if scrape:
+        from src.scraping import scrape_ids
+
+        await scrape_ids(incremental=True)
+    scraping_ids = load_scraping_ids()
+    order = {scraping_id["id"]: i for i, scraping_id in enumerate(scraping_ids)}
+    if ids is not None:
+        selected_ids = set(ids)
+        scraping_ids = [s for s in scraping_ids if s["id"] in selected_ids]
+    await _download_missing(scraping_ids)
+    if since is not None:
+        scraping_ids = [s for s in scraping_ids if _written_since(s["id"], since)]
+
+    fingerprints = Fingerprints(config.FINGERPRINTS_DB)
+    versions = _versions(skip_ineligible, cascade, chunk_chars, rule_threshold)
+    computations = {
+        "extract": partial(_extract, workers=jobs),
+        "parse": partial(_parse, workers=jobs),
+        "label": partial(
+            _label,
+            concurrency=concurrency,
+            skip_ineligible=skip_ineligible,
+            cascade=cascade,
+        ),
+        "augment": partial(
+            _augment,
+            concurrency=concurrency,
+            chunk_chars=chunk_chars,
+            rule_threshold=rule_threshold,
+        ),
+    }
+
+    # The input of each document to the next stage: its digest, and the document
+    # itself if it was (re)computed in this run
+    upstream = {s["id"]: fingerprints.pdf_digest(s["id"]) for s in scraping_ids}
+    documents: Dict[UUID, dict] = {s["id"]: s for s in scraping_ids}
+    upstream_stage: Optional[str] = None
+    counts = Counter()
+
+    with telemetry.run() as records:
+        for stage, artifact_stage in zip(STAGES, artifacts.STAGES_WRITTEN):
+            stored = fingerprints.get(stage)
+            inputs = {
+                id_: _digest(versions[stage], digest)
+                for id_, digest in upstream.items()
+            }
+            if adopt:
+                outputs = {
+                    id_: _digest(line)
+                    for id_, line in _scan(artifact_stage, set(inputs))
+                }
+                fingerprints.set(
+                    stage,
+                    [(id_, inputs[id_], output) for id_, output in outputs.items()],
+                )
+                print(f"{stage}: adopted {len(outputs)} of {len(inputs)} documents")
+                upstream, documents = outputs, {}
+                upstream_stage = artifact_stage
+                continue
+
+            changed = [
+                id_
+                for id_ in inputs
+                if force or id_ not in stored or stored[id_][0] != inputs[id_]
+            ]
+            # Documents dropped by an earlier stage are dropped here too
+            todo = [id_ for id_ in changed if upstream[id_] is not None]
+            missing = {id_ for id_ in todo if id_ not in documents}
+            documents.update(
+                (id_, _load(line)) for id_, line in _scan(upstream_stage, missing)
+            )
+            # Documents missing from the upstream artifact are left out like failures
+            todo = [id_ for id_ in todo if id_ in documents]
+            results = await computations[stage]([documents[id_] for id_ in todo])
+
+            lines: Dict[UUID, Optional[bytes]] = {
+                id_: None for id_ in changed if upstream[id_] is None
+            }
+            for id_, r in results.items():
+                lines[id_] = (
+                    None
+                    if r is None
+                    else json.dumps(r, default=lambda x: str(x)).encode("utf-8")
+                )
+            if lines:
+                _merge(artifact_stage, lines, order)
+            outputs = {
+                id_: None if line is None else _digest(line)
+                for id_, line in lines.items()
+            }
+            fingerprints.set(
+                stage, [(id_, inputs[id_], output) for id_, output in outputs.items()]
+            )
+            counts[stage] = len(results)
+            print(f"{stage}: recomputed {len(results)} of {len(inputs)} documents")
+
+            # Failed documents are left out, keeping their earlier artifact line if any
+            unchanged = set(inputs) - set(changed)
+            upstream = {id_: stored[id_][1] for id_ in unchanged} | outputs
+            documents = {id_: r for id_, r in results.items() if r is not None}
+            upstream_stage = artifact_stage
+
+    if counts["label"] or counts["augment"]:
+        telemetry.report(records)
+    return dict(counts)
+
+
+def _versions(
+    skip_ineligible: bool,
+    cascade: bool,
+    chunk_chars: Optional[int],
+    rule_threshold: Optional[float],
+) -> Dict[str, str]:
+    """
+    The version of each stage: a digest of its source, prompts, models and
+    options.
+    """
+    from src.common import prompts
+    from src.common.cached_generation import Model
+
+    label = [
+        _source("src.labeling._label_docs"),
+        _source("src.labeling._model"),
+        prompts.CREATE_CASE_INFO_SYSTEM,
+        prompts.CREATE_CASE_INFO_USER,
+        Model.GPT_41.value,
+    ]
+    if skip_ineligible:
+        label += [_source("src.labeling._preclassify")]
+    if cascade:
+        label += [
+            _source("src.labeling._cascade"),
+            Model.GPT_41_MINI.value,
+            config.LABEL_CASCADE_THRESHOLD,
+        ]
+
+    augment = [
+        _source("src.augmentation._create_augmentations"),
+        _source("src.augmentation._prompt"),
+        prompts.CREATE_AUGMENTATION_SYSTEM,
+        Model.GPT_41_MINI.value,
+    ]
+    if chunk_chars:
+        augment += [_source("src.augmentation._chunking"), chunk_chars]
+    if rule_threshold is not None:
+        augment += [_source("src.augmentation._rule_based"), rule_threshold]
+
+    return {
+        "extract": _digest(
+            _source("src.scraping._extract_text"), metadata.version("pymupdf")
+        ),
+        "parse": _digest(
+            _source("src.scraping._parse_docs"),
+            _source("src.scraping._dehyphenation"),
+            config.SPACY_MODEL,
+            config.SPACY_EXCLUDE,
+        ),
+        "label": _digest(*label),
+        "augment": _digest(*augment),
+    }
+
+
+def _source(module: str) -> bytes:
+    return Path(importlib.util.find_spec(module).origin).read_bytes()
+
+
+def _digest(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+async def _download_missing(scraping_ids: List[ScrapingID]):
+    from src.scraping._download_docs import _process
+
+    missing = [s for s in scraping_ids if not get_document_path(s["id"]).exists()]
+    if not missing:
+        return
+    client = transport.get_client()
+    with tqdm(total=len(missing), desc="Downloading") as pbar:
+        async for r in executor.run_bounded(
+            missing,
+            lambda scraping_id: _process(scraping_id, client),
+            concurrency=config.SCRAPING_MAX_CONCURRENCY,
+        ):
+            pbar.update(1)
+            if r.error is not None:
+                print(f"Error downloading {r.item['url']}: {r.error!r}")
+
+
+def _written_since(document_id: UUID, since: datetime) -> bool:
+    path = get_document_path(document_id)
+    return path.exists() and path.stat().st_mtime >= since.timestamp()
+
+
+def _scan(stage: Optional[str], ids: set) -> Iterator[Tuple[UUID, bytes]]:
+    """
+    Yield the id and line of the documents of a stage that are in ids, from its
+    JSONL artifact or from the store.
+    """
+    if stage is None or not ids:
+        return
+    if config.ARTIFACT_FORMAT == "arrow":
+        for doc in artifacts.select(stage, ids):
+            line = json.dumps(doc, default=lambda x: str(x)).encode("utf-8")
+            yield UUID(doc["id"]), line
+        return
+    path = artifacts.jsonl_path(stage)
+    if not path.exists():
+        return
+    with path.open("rb") as f:
+        for line in f:
+            document_id = UUID(ID_PATTERN.search(line).group(1).decode())
+            if document_id in ids:
+                yield document_id, line.rstrip(b"\n")
+
+
+def _load(line: bytes) -> dict:
+    doc = json.loads(line)
+    doc["id"] = UUID(doc["id"])
+    doc["url"] = URL(doc["url"])
+    return doc
+
+
+def _merge(stage: str, lines: Dict[UUID, Optional[bytes]], order: Dict[UUID, int]):
+    """
+    Replace the documents of a stage with the given lines, in its JSONL artifact
+    or in the store.
+    """
+    if config.ARTIFACT_FORMAT == "arrow":
+        documents = {
+            id_: None if line is None else json.loads(line)
+            for id_, line in lines.items()
+        }
+        artifacts.merge(stage, documents, order)
+    else:
+        _merge_artifact(artifacts.jsonl_path(stage), lines, order)
+
+
+def _merge_artifact(
+    path: Path, lines: Dict[UUID, Optional[bytes]], order: Dict[UUID, int]
+):
+    """
+    Replace the lines of the given documents in a JSONL artifact (removing those
+    that are None) and keep it in the order of the scraping IDs. The lines that
+    are kept are copied by offset, without loading the file.
+    """
+    # rank, offset and length of a kept line, or the new line
+    entries: List[Tuple[int, int, int, Optional[bytes]]] = []
+    if path.exists():
+        offset = 0
+        with path.open("rb") as f:
+            for line in f:
+                document_id = UUID(ID_PATTERN.search(line).group(1).decode())
+                if document_id not in lines:
+                    rank = order.get(document_id, len(order))
+                    entries.append((rank, offset, len(line), None))
+                offset += len(line)
+    for document_id, line in lines.items():
+        if line is not None:
+            entries.append((order.get(document_id, len(order)), 0, 0, line))
+    entries.sort(key=lambda entry: entry[0])
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".partial")
+    with temporary.open("wb") as dst, open(
+        path if path.exists() else os.devnull, "rb"
+    ) as src:
+        for i, (_, offset, length, line) in enumerate(entries):
+            if line is None:
+                src.seek(offset)
+                line = src.read(length).rstrip(b"\n")
+            if i:
+                dst.write(b"\n")
+            dst.write(line)
+    os.replace(temporary, path)
+
+
+async def _extract(docs: List[ScrapingID], workers: int) -> Dict[UUID, Optional[dict]]:
+    from src.scraping._extract_text import _pymupdf, _read
+
+    paths = [get_document_path(doc["id"]) for doc in docs]
+    texts = executor.map_processes(_read, paths, workers=workers, initializer=_pymupdf)
+    return {
+        doc["id"]: DocumentText(**doc, text=text) if text else None
+        for doc, text in zip(docs, texts)
+    }
+
+
+async def _parse(docs: List[DocumentText], workers: int) -> Dict[UUID, Optional[dict]]:
+    from src.scraping._parse_docs import (
+        ParseFailure,
+        _get_dehyphenator,
+        _parse_sections,
+        _to_document,
+    )
+
+    sections = executor.map_processes(
+        _parse_sections,
+        [doc["text"] for doc in docs],
+        workers=workers,
+        initializer=_get_dehyphenator,
+    )
+    return {
+        doc["id"]: None if isinstance(s, ParseFailure) else _to_document(doc, s)
+        for doc, s in zip(docs, sections)
+    }
+
+
+async def _label(
+    docs: List[dict], concurrency: int, skip_ineligible: bool, cascade: bool
+) -> Dict[UUID, Optional[dict]]:
+    from src.labeling._label_docs import _process
+
+    results = {}
+    if skip_ineligible:
+        from src.labeling._preclassify import preclassify
+
+        results = {doc["id"]: None for doc in docs if preclassify(doc).ineligible}
+    remaining = [doc for doc in docs if doc["id"] not in results]
+    with telemetry.scope(stage="label_docs"):
+        results.update(
+            await _run_llm_stage(
+                remaining, partial(_process, cascade=cascade), concurrency, "labeling"
+            )
+        )
+    return results
+
+
+async def _augment(
+    docs: List[dict],
+    concurrency: int,
+    chunk_chars: Optional[int],
+    rule_threshold: Optional[float],
+) -> Dict[UUID, Optional[dict]]:
+    from src.augmentation._create_augmentations import _process, _swap_one
+
+    results = {}
+    if rule_threshold is not None:
+        for doc in docs:
+            if is_augmentable(doc) and (r := _swap_one(doc, rule_threshold)):
+                results[doc["id"]] = r
+    remaining = [doc for doc in docs if doc["id"] not in results]
+    with telemetry.scope(stage="create_augmentations"):
+        results.update(
+            await _run_llm_stage(
+                remaining,
+                partial(_process, chunk_chars=chunk_chars),
+                concurrency,
+                "augmenting",
+            )
+        )
+    return results
+
+
+async def _run_llm_stage(
+    docs: List[dict], process: Callable, concurrency: int, verb: str
+) -> Dict[UUID, Optional[dict]]:
+    """
+    Run an LLM stage on the documents, leaving out those that fail.
+    """
+    results = {}
+    if not docs:
+        return results
+    with tqdm(total=len(docs)) as pbar:
+        async for r in executor.run_bounded(docs, process, concurrency=concurrency):
+            pbar.update(1)
+            if r.error is not None:
+                print(f"Error {verb} {r.item['id']}: {r.error!r}")
+            else:
+                results[r.item["id"]] = r.value
+    return results
+
+
+def _open_db(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS fingerprints ("
+        "stage TEXT, id TEXT, input TEXT, output TEXT, PRIMARY KEY (stage, id))"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS pdfs "
+        "(id TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+    )
+    return connection
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--ids", type=UUID, nargs="+", help="Only update these documents."
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="Only update documents whose PDF was written since this date.",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Processes of extraction and parsing."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="Concurrency of the LLM stages."
+    )
+    parser.add_argument("--scrape", action="store_true", help="Scrape new IDs first.")
+    parser.add_argument(
+        "--force", action="store_true", help="Ignore the stored fingerprints."
+    )
+    parser.add_argument(
+        "--adopt",
+        action="store_true",
+        help="Record the fingerprints of the existing artifacts without recomputing.",
+    )
+    parser.add_argument("--skip-ineligible", action="store_true")
+    parser.add_argument("--cascade", action="store_true")
+    parser.add_argument("--chunk-chars", type=int, default=None)
+    parser.add_argument("--rule-threshold", type=float, default=None)
+    args = parser.parse_args()
+    asyncio.run(
+        run_incremental(
+            ids=args.ids,
+            since=args.since,
+            jobs=args.jobs,
+            concurrency=args.concurrency,
+            scrape=args.scrape,
+            force=args.force,
+            adopt=args.adopt,
+            skip_ineligible=args.skip_ineligible,
+            cascade=args.cascade,
+            chunk_chars=args.chunk_chars,
+            rule_threshold=args.rule_threshold,
+        )
+    )
@@ -0,0 +1,255 @@
+"""
+This module runs the stages from the download of the PDFs to the augmentation as
+one streaming pipeline, so that a document moves on to the next stage as soon as
+it has passed the previous one instead of waiting for the whole corpus.
+
+The stages are connected by bounded queues. The PDFs are downloaded and the LLM
+stages run as async workers, like ``executor.run_bounded``; the text extraction
+and the parsing run on process pools, with at most one document per process in
+flight. A stage blocks when the queue to the next one is full, so a slow stage
+holds back the ones before it and the number of documents in memory stays
+bounded by the queue sizes and the concurrency of the stages.
+
+Each stage appends its documents to a ``.partial`` copy of its JSONL artifact as
+they pass it. At the end, the artifacts are sorted into the order of the
+scraping IDs and moved into place, so they are the same as those of the stages
+run one by one.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, TextIO
+from uuid import UUID
+
+from tqdm import tqdm
+
+from src.common import artifacts, config, telemetry, transport
+from src.common.types import DocumentText
+from src.common.utils import get_document_path, is_augmentable, load_scraping_ids
+
+ID_PATTERN = re.compile(rb'"id": "([0-9a-f-]{36})"')
+
+# Marks the end of the documents in a queue
+_DONE = object()
+
+
+async def run_pipeline(
+    workers: int = 4,
+    concurrency: int = 10,
+    queue_size: int = 32,
+    scrape: bool = False,
+    skip_ineligible: bool = False,
+    cascade: bool = False,
+    chunk_chars: Optional[int] = None,
+    rule_threshold: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Run ``download_docs``, ``extract_text``, ``parse_docs``, ``label_docs`` and
+    ``create_augmentations`` as a streaming pipeline and return the number of
+    documents that passed each stage. With ``scrape``, the case IDs are scraped
+    first; they are needed in full to order the artifacts.
+
+    ``workers`` is the number of processes of the extraction and the parsing,
+    ``concurrency`` that of the LLM stages and ``queue_size`` the number of
+    documents waiting between two stages. The other options are those of
+    ``label_docs`` and ``create_augmentations``.
+    """
+    from src.augmentation._create_augmentations import _process as augment
+    from src.augmentation._create_augmentations import _swap_one
+    from src.labeling._label_docs import _process as label
+    from src.scraping._download_docs import _process as download
+    from src.scraping._extract_text import _pymupdf, _read
+    from src.scraping._parse_docs import (
+        ParseFailure,
+        _get_dehyphenator,
+        _parse_sections,
+        _to_document,
+    )
+
+    if scrape:
+        from src.scraping import scrape_ids
+
+        await scrape_ids()
+    scraping_ids = load_scraping_ids()
+    order = {scraping_id["id"]: i for i, scraping_id in enumerate(scraping_ids)}
+
+    loop = asyncio.get_running_loop()
+    client = transport.get_client()
+    failures = Counter()
+    started = time.perf_counter()
+    first_augmented: Optional[float] = None
+
+    async def extract(scraping_id):
+        path = get_document_path(scraping_id["id"])
+        if text := await loop.run_in_executor(extract_pool, _read, path):
+            return DocumentText(**scraping_id, text=text)
+        return None
+
+    async def parse(doc_text):
+        # Only the text is sent to the workers, the metadata stays here
+        sections = await loop.run_in_executor(
+            parse_pool, _parse_sections, doc_text["text"]
+        )
+        if isinstance(sections, ParseFailure):
+            failures[sections] += 1
+            return None
+        return _to_document(doc_text, sections)
+
+    async def label_or_skip(doc):
+        if skip_ineligible:
+            from src.labeling._preclassify import preclassify
+
+            if reason := preclassify(doc).ineligible:
+                failures[reason] += 1
+                return None
+        with telemetry.scope(stage="label_docs"):
+            return await label(doc, cascade=cascade)
+
+    async def augment_or_swap(doc):
+        nonlocal first_augmented
+        r = None
+        if rule_threshold is not None and is_augmentable(doc):
+            r = _swap_one(doc, rule_threshold)
+        if r is None:
+            with telemetry.scope(stage="create_augmentations"):
+                r = await augment(doc, chunk_chars=chunk_chars)
+        if r is not None and first_augmented is None:
+            first_augmented = time.perf_counter() - started
+        return r
+
+    async def fetch(scraping_id):
+        await download(scraping_id, client)
+        return scraping_id
+
+    # name, function, concurrency, artifact (None for the PDFs)
+    stages = [
+        ("download", fetch, config.SCRAPING_MAX_CONCURRENCY, None),
+        ("extract", extract, workers, config.DOCS_TEXT_JSONL),
+        ("parse", parse, workers, config.DOCS_PARSED_JSONL),
+        ("label", label_or_skip, concurrency, config.DOCS_LABELED_JSONL),
+        ("augment", augment_or_swap, concurrency, config.DOCS_AUGMENTED_JSONL),
+    ]
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    counts = Counter()
+
+    async def feed():
+        for scraping_id in scraping_ids:
+            await queues[0].put(scraping_id)
+        await queues[0].put(_DONE)
+
+    with ExitStack() as stack:
+        records = stack.enter_context(telemetry.run())
+        extract_pool = stack.enter_context(
+            ProcessPoolExecutor(workers, initializer=_pymupdf)
+        )
+        parse_pool = stack.enter_context(
+            ProcessPoolExecutor(workers, initializer=_get_dehyphenator)
+        )
+        runs = []
+        for i, (name, fn, n, artifact) in enumerate(stages):
+            sink = None
+            if artifact is not None:
+                sink = stack.enter_context(
+                    _partial(artifact).open("w", encoding="utf-8")
+                )
+            pbar = stack.enter_context(
+                tqdm(desc=name, position=i, total=len(scraping_ids) if i == 0 else None)
+            )
+            outbox = queues[i + 1] if i + 1 < len(stages) else None
+            runs.append(_stage(name, fn, n, queues[i], outbox, sink, pbar, counts))
+        await asyncio.gather(feed(), *runs)
+
+    for (_, _, _, artifact), stage in zip(stages[1:], artifacts.STAGES_WRITTEN):
+        _sort_artifact(_partial(artifact), artifact, order)
+        # The JSONL files are the working copy; the store is written from them
+        if config.ARTIFACT_FORMAT == "arrow":
+            artifacts.import_jsonl(stage)
+
+    for reason, n in failures.most_common():
+        print(f"Skipped {n} documents: {getattr(reason, 'value', reason)}")
+    telemetry.report(records)
+    if cascade:
+        from src.labeling._cascade import report
+
+        report([r for r in records if r.get("stage") == "label_docs"])
+    if first_augmented is not None:
+        print(f"First augmented document after {first_augmented:.1f} s")
+    print(
+        f"Pipeline finished in {time.perf_counter() - started:.1f} s: "
+        + ", ".join(f"{name} {counts[name]}" for name, *_ in stages)
+    )
+    return dict(counts)
+
+
+async def _stage(
+    name: str,
+    fn: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+    inbox: asyncio.Queue,
+    outbox: Optional[asyncio.Queue],
+    sink: Optional[TextIO],
+    pbar: tqdm,
+    counts: Counter,
+):
+    """
+    Run ``fn`` on the documents of the inbox with ``concurrency`` workers, write
+    the results to the sink and pass them on to the outbox. Documents for which
+    ``fn`` returns None or fails are dropped.
+    """
+
+    async def worker():
+        while (item := await inbox.get()) is not _DONE:
+            try:
+                result = await fn(item)
+            except Exception as e:
+                print(f"Error in stage {name} for {item['id']}: {e!r}")
+                result = None
+            pbar.update(1)
+            if result is None:
+                continue
+            counts[name] += 1
+            if sink is not None:
+                sink.write(json.dumps(result, default=lambda x: str(x)) + "\n")
+                sink.flush()
+            if outbox is not None:
+                await outbox.put(result)
+        # Pass the marker on to the other workers of this stage
+        await inbox.put(_DONE)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if outbox is not None:
+        await outbox.put(_DONE)
+
+
+def _partial(path: Path) -> Path:
+    return path.with_name(path.name + ".partial")
+
+
+def _sort_artifact(source: Path, target: Path, order: Dict[UUID, int]):
+    """
+    Write the lines of a JSONL file in the order of the scraping IDs to the target
+    and remove the source. Only the offsets of the lines are kept in memory.
+    """
+    lines = []
+    offset = 0
+    with source.open("rb") as f:
+        for line in f:
+            document_id = UUID(ID_PATTERN.search(line).group(1).decode())
+            lines.append((order[document_id], offset, len(line)))
+            offset += len(line)
+    lines.sort()
+
+    with source.open("rb") as src, target.open("wb") as dst:
+        for i, (_, offset, length) in enumerate(lines):
+            src.seek(offset)
+            if i:
+                dst.write(b"\n")
+            dst.write(src.read(length).rstrip(b"\n"))
+    os.remove(source)
@@ -0,0 +1,182 @@
+"""
+Batched and memoized removal of line-break hyphens for the parsed BGH documents.
+
+The text extracted from the PDFs contains words split across lines, such as
+"Haft- pflicht". Whether such a candidate is joined ("Haftpflicht"), keeps its
+hyphen ("Haft-pflicht") or is left alone ("Kauf- oder") depends on the token
+shapes and the part of speech spaCy assigns to the two-token text. As that
+decision only depends on the (left, right) pair, the candidates of a document
+are deduplicated, decided in one ``nlp.pipe`` call with only the components
+needed for ``pos_`` and ``shape_``, and the decisions are memoized in an
+in-memory LRU backed by a persistent SQLite lexicon that later runs reuse. The
+lexicon is keyed by the model, its version and the excluded components, as
+each of them can change the decisions.
+"""
+
+import re
+import sqlite3
+from collections import OrderedDict
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+
+LINE_BREAK_PATTERN = re.compile(r"(\w+)-\s+(\w+)")
+
+# Components needed for the part of speech; shape_ is set by the tokenizer
+PIPE_COMPONENTS = ("tok2vec", "tagger", "morphologizer", "attribute_ruler")
+
+
+class Decision(str, Enum):
+    KEEP = "keep"
+    JOIN = "join"
+    HYPHENATE = "hyphenate"
+
+
+class Dehyphenator:
+    def __init__(
+        self,
+        nlp: "Language",
+        model_name: str,
+        lexicon_path: Optional[Path] = None,
+        cache_size: int = 100_000,
+        exclude: Iterable[str] = (),
+    ):
+        self.nlp = nlp
+        self.model_name = model_name
+        self.model_key = _model_key(nlp, model_name, exclude)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[Tuple[str, str], Decision] = OrderedDict()
+        self._lexicon = _open_lexicon(lexicon_path) if lexicon_path else None
+
+    def fix(self, text: str) -> str:
+        """
+        Remove the line-break hyphens from the text.
+        """
+        decisions = self.decide(
+            match.groups() for match in LINE_BREAK_PATTERN.finditer(text)
+        )
+        return LINE_BREAK_PATTERN.sub(
+            lambda match: _apply(match, decisions[match.groups()]), text
+        )
+
+    def prime(self, texts: Iterable[str]):
+        """
+        Decide all candidates of the given texts (e.g. all sections of a document)
+        in one batch, so that ``fix`` only needs lookups.
+        """
+        self.decide(
+            match.groups()
+            for text in texts
+            for match in LINE_BREAK_PATTERN.finditer(text)
+        )
+
+    def decide(
+        self, pairs: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Decision]:
+        """
+        Return the decisions for the given (left, right) pairs.
+        """
+        decisions = {}
+        missing = []
+        for pair in pairs:
+            if pair in decisions:
+                continue
+            if (decision := self._lookup(pair)) is not None:
+                decisions[pair] = decision
+            else:
+                decisions[pair] = None
+                missing.append(pair)
+
+        if missing:
+            disable = [n for n in self.nlp.pipe_names if n not in PIPE_COMPONENTS]
+            docs = self.nlp.pipe(
+                (f"{left}- {right}" for left, right in missing), disable=disable
+            )
+            for pair, doc in zip(missing, docs):
+                decisions[pair] = _decide(doc)
+                self._remember(pair, decisions[pair])
+            self._persist({pair: decisions[pair] for pair in missing})
+
+        return decisions
+
+    def _lookup(self, pair: Tuple[str, str]) -> Optional[Decision]:
+        if (decision := self._cache.get(pair)) is not None:
+            self._cache.move_to_end(pair)
+            return decision
+        if self._lexicon is None:
+            return None
+
+        row = self._lexicon.execute(
+            "SELECT decision FROM lexicon WHERE model = ? AND left = ? AND right = ?",
+            (self.model_key, *pair),
+        ).fetchone()
+        if row is None:
+            return None
+        decision = Decision(row[0])
+        self._remember(pair, decision)
+        return decision
+
+    def _remember(self, pair: Tuple[str, str], decision: Decision):
+        self._cache[pair] = decision
+        self._cache.move_to_end(pair)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _persist(self, decisions: Dict[Tuple[str, str], Decision]):
+        if self._lexicon is None:
+            return
+        with self._lexicon:
+            self._lexicon.executemany(
+                "INSERT OR REPLACE INTO lexicon VALUES (?, ?, ?, ?)",
+                (
+                    (self.model_key, left, right, decision.value)
+                    for (left, right), decision in decisions.items()
+                ),
+            )
+
+
+def _model_key(nlp: "Language", model_name: str, exclude: Iterable[str]) -> str:
+    """
+    The key of the lexicon entries decided with this model, e.g.
+    "de_core_news_lg==3.8.0 exclude=lemmatizer,ner,parser".
+    """
+    version = nlp.meta.get("version", "")
+    return f"{model_name}=={version} exclude={','.join(sorted(filter(None, exclude)))}"
+
+
+def _decide(doc) -> Decision:
+    """
+    Decide a candidate by checking the token shapes and conjunctions.
+    """
+    assert len(doc) == 2, "Expected two tokens in the doc."
+    if doc[1].pos_ == "CCONJ" or doc[1].text == "bzw":
+        return Decision.KEEP
+    elif doc[0].shape_.endswith("x-") and doc[1].shape_.startswith("x"):
+        return Decision.JOIN
+    return Decision.HYPHENATE
+
+
+def _apply(match: re.Match, decision: Decision) -> str:
+    match decision:
+        case Decision.KEEP:
+            return match.group(0)
+        case Decision.JOIN:
+            return match.group(1) + match.group(2)
+        case Decision.HYPHENATE:
+            return match.group(0).replace(" ", "")
+
+
+def _open_lexicon(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    # WAL lets the worker processes of parse_docs share the lexicon
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS lexicon ("
+        "model TEXT, left TEXT, right TEXT, decision TEXT, "
+        "PRIMARY KEY (model, left, right))"
+    )
+    return connection
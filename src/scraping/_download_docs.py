@@ -2,13 +2,10 @@
 This script downloads documents from scraping IDs using asynchronous HTTP requests.
 """
 
-import asyncio
-from itertools import batched
-
 from httpx import AsyncClient
 from tqdm import tqdm
 
-from src.common import cached_request
+from src.common import cached_request, config, executor, transport
 from src.common.types import ScrapingID
 from src.common.utils import get_document_path, load_scraping_ids
 
@@ -17,32 +14,36 @@ async def download_docs():
     """
     Main function to download documents from scraping IDs.
     """
-    sem = asyncio.Semaphore(10)
     scraping_ids = load_scraping_ids()
-    async with AsyncClient(timeout=60) as client:
-        with tqdm(total=len(scraping_ids)) as pbar:
-            # Process the scraping IDs in batches of 100
-            for batch in batched(scraping_ids, 100):
-                tasks = (
-                    _process(scraping_id, client, sem, pbar) for scraping_id in batch
-                )
-                # Gather will run these tasks concurrently, but each task
-                # will respect the semaphore limit
-                await asyncio.gather(*tasks)
-
-
-async def _process(
-    scraping_id: ScrapingID, client: AsyncClient, sem: asyncio.Semaphore, pbar: tqdm
-):
+    client = transport.get_client()
+    errors = []
+    with tqdm(total=len(scraping_ids)) as pbar:
+        # The executor keeps up to the host's maximum concurrency in progress; each
+        # request additionally respects the host's adaptive concurrency limit
+        async for r in executor.run_bounded(
+            scraping_ids,
+            lambda scraping_id: _process(scraping_id, client),
+            concurrency=config.SCRAPING_MAX_CONCURRENCY,
+        ):
+            if r.error is not None:
+                errors.append(r.error)
+                print(f"Error downloading {r.item['url']}: {r.error!r}")
+            # Update the progress bar after each completed (or skipped) item
+            pbar.update(1)
+
+    if errors:
+        # The later stages need every PDF, so the stage fails like a single download
+        raise RuntimeError(
+            f"{len(errors)} of {len(scraping_ids)} documents failed to download."
+        ) from errors[0]
+
+
+async def _process(scraping_id: ScrapingID, client: AsyncClient):
     """
     Process a single scraping ID. This function is called concurrently for each
     scraping ID.
     """
     output_path = get_document_path(scraping_id["id"])
-    output_path.parent.mkdir(parents=True, exist_ok=True)
     if not output_path.exists():
-        content = await cached_request.get(scraping_id["url"], client, sem=sem)
-        output_path.write_bytes(content)
-
-    # Update the progress bar after each completed (or skipped) item
-    pbar.update(1)
+        # Streamed to disk; the cache only keeps a reference to the file
+        await cached_request.download(scraping_id["url"], output_path, client)
@@ -2,42 +2,45 @@
 Extracts text from PDF documents using PyMuPDF and saves the results in a JSONL file.
 """
 
-import json
 import re
+from functools import cache
 from pathlib import Path
 from typing import Generator, Optional
 
-import pymupdf
 from tqdm import tqdm
 
-from src.common import config
+from src.common import artifacts, executor
 from src.common.types import DocumentText
 from src.common.utils import flatten_text, get_document_path, load_scraping_ids
 
-pymupdf.TOOLS.mupdf_display_errors(False)
-
 PAGE_NUMBER_PATTERN = re.compile(r"^-\s*\d+\s*-$", re.MULTILINE)
 PARAGRAPH_NUMBER_PATTERN = re.compile(r"^\d+$", re.MULTILINE)
 TOO_MANY_NEWLINES_PATTERN = re.compile(r"\n{3,}", re.MULTILINE)
 
 
-def extract_text():
+def extract_text(workers: int = 1):
     """
-    Main function to extract text from PDF documents.
+    Main function to extract text from PDF documents. With ``workers > 1`` the
+    PDFs are read on a pool of processes; the output order is unchanged.
     """
+    scraping_ids = load_scraping_ids()
+    paths = [get_document_path(scraping_id["id"]) for scraping_id in scraping_ids]
 
     def generate() -> Generator[DocumentText, None, None]:
-        for scraping_id in tqdm(load_scraping_ids(), desc="Extracting text"):
-            fp = get_document_path(scraping_id["id"])
-            if text := _read(fp):
+        texts = executor.map_processes(
+            _read, paths, workers=workers, initializer=_pymupdf
+        )
+        for scraping_id, text in tqdm(
+            zip(scraping_ids, texts), total=len(paths), desc="Extracting text"
+        ):
+            if text:
                 yield DocumentText(
                     **scraping_id,
                     text=text,
                 )
 
     results = list(generate())
-    content = "\n".join(json.dumps(r, default=lambda x: str(x)) for r in results)
-    config.DOCS_TEXT_JSONL.write_text(content, encoding="utf-8")
+    artifacts.write("text", results)
 
     return results
 
@@ -46,6 +49,10 @@ def _read(document_path: Path) -> Optional[str]:
     """
     Reads and cleans up the text from the PDF using PyMuPDF.
     """
+    if not document_path.exists():
+        print(f"Error reading {document_path}: the PDF was not downloaded")
+        return None
+    pymupdf = _pymupdf()
     try:
         pages = pymupdf.get_text(path=document_path)
     except pymupdf.FileDataError as e:
@@ -64,3 +71,14 @@ def _read(document_path: Path) -> Optional[str]:
     text = TOO_MANY_NEWLINES_PATTERN.sub("\n\n", text)
 
     return text.strip()
+
+
+@cache
+def _pymupdf():
+    """
+    Import PyMuPDF on first use, once per worker process.
+    """
+    import pymupdf
+
+    pymupdf.TOOLS.mupdf_display_errors(False)
+    return pymupdf
@@ -1,53 +1,91 @@
 """
 Parse BGH Urteil documents from the BGH website.
 This script extracts the tenor and tatbestand from the documents and saves them in a JSONL file.
-It uses regex patterns to identify the relevant sections of the text.
+It locates the relevant sections of the text with a single pass over its section headings.
 The script is designed to work with documents that follow a specific format, and it will return None for documents that do not match this format.
 """
 
-import json
+import os
 import re
-from typing import Generator, Optional
+from collections import Counter
+from enum import Enum
+from typing import Generator, NamedTuple, Optional, Union
 
-import spacy
 from tqdm import tqdm
 
-from src.common import config
+from src.common import artifacts, config, executor, nlp
 from src.common.types import DocumentParsed, DocumentText
 from src.common.utils import flatten_text, load_documents_text
-
-NLP = spacy.load("de_core_news_lg")
+from src.scraping._dehyphenation import Dehyphenator
 
 URTEIL_PATTERN = re.compile(
     r"\s*(?:\S+\s+)?BUNDESGERICHTSHOF\s+IM\s+NAMEN\s+DES\s+VOLKES\s+URTEIL\s+",
     re.IGNORECASE,
 )
-TENOR_TATBESTAND_PATTERN = re.compile(
-    r"für\s+recht\s+erkannt\s*:?"
-    r"\s*\n(.+?)\n\s*"
-    r"(?:von\s+rechts\s+wegen\s+.*)?"
-    r"tatbestand\s*:?"
-    r"\s*\n(.+?)\n\s*"
-    r"entscheidungsgründe\s*:?"
-    r"\s*\n.*",
-    re.DOTALL | re.IGNORECASE,
+# All headings that delimit the tenor and tatbestand, found in one pass over the text
+SECTION_HEADING_PATTERN = re.compile(
+    r"(?P<tenor>für\s+recht\s+erkannt)[^\S\n]*:?[^\S\n]*\n"
+    r"|^[^\S\n]*(?P<von_rechts_wegen>von\s+rechts\s+wegen)\b"
+    r"|^[^\S\n]*(?P<tatbestand>tatbestand)[^\S\n]*:?[^\S\n]*\n"
+    r"|^[^\S\n]*(?P<gruende>entscheidungsgründe)[^\S\n]*:?[^\S\n]*\n",
+    re.IGNORECASE | re.MULTILINE,
+)
+# The cleanup substitutions for tenor/tatbestand, fused into a single pass
+CLEANUP_PATTERN = re.compile(
+    r"(?P<ellipsis>\b\.{3,}\b)"
+    r"|(?P<ellipses>…[…\s]*…)"
+    r"|(?P<dots>\.[.\s]*\.)"
+    r"|(?P<space_before>\s+)(?=[.,;:!?)\]}/])"
+    r"|(?P<opening>[(\[{/])\s+"
 )
-LINE_BREAK_PATTERN = re.compile(r"(\w+)-\s+(\w+)")
 
 
-def parse_docs():
+class ParseFailure(str, Enum):
+    NOT_URTEIL = "not_urteil"
+    MISSING_TENOR = "missing_tenor"
+    MISSING_TATBESTAND = "missing_tatbestand"
+    MISSING_ENTSCHEIDUNGSGRUENDE = "missing_entscheidungsgruende"
+
+
+class Sections(NamedTuple):
+    operative: str
+    facts: str
+
+
+_dehyphenator: Optional[Dehyphenator] = None
+_dehyphenator_pid: Optional[int] = None
+
+
+def parse_docs(workers: int = 1):
     """
-    Main function to parse BGH Urteil documents.
+    Main function to parse BGH Urteil documents. With ``workers > 1`` the
+    documents are parsed on a pool of processes; the output order is unchanged.
     """
+    documents_text = load_documents_text()
+    failures = Counter()
 
     def generate() -> Generator[DocumentParsed, None, None]:
-        for document_text in tqdm(load_documents_text(), desc="Parsing documents"):
-            if document_parsed := _parse(document_text):
+        # Only the text is sent to the workers, the metadata stays here
+        sections = executor.map_processes(
+            _parse_sections,
+            [doc["text"] for doc in documents_text],
+            workers=workers,
+            initializer=_get_dehyphenator,
+        )
+        for document_text, parsed in tqdm(
+            zip(documents_text, sections),
+            total=len(documents_text),
+            desc="Parsing documents",
+        ):
+            if isinstance(parsed, ParseFailure):
+                failures[parsed] += 1
+            elif document_parsed := _to_document(document_text, parsed):
                 yield document_parsed
 
     results = list(generate())
-    content = "\n".join(json.dumps(r, default=lambda x: str(x)) for r in results)
-    config.DOCS_PARSED_JSONL.write_text(content, encoding="utf-8")
+    for reason, n in failures.most_common():
+        print(f"Skipped {n} documents: {reason.value}")
+    artifacts.write("parsed", results)
 
     return results
 
@@ -57,18 +95,70 @@ def _parse(doc_text: DocumentText) -> Optional[DocumentParsed]:
     Attempts to parse the PDF document for a valid BGH Urteil. Returns an Urteil object
     or None if parsing fails or the document doesn't match the known pattern.
     """
-    # Quick check if it's a BGH Urteil
-    if not URTEIL_PATTERN.match(doc_text["text"]):
+    sections = _parse_sections(doc_text["text"])
+    if isinstance(sections, ParseFailure):
         return None
+    return _to_document(doc_text, sections)
 
-    match = TENOR_TATBESTAND_PATTERN.search(doc_text["text"])
-    if not match:
-        return None
 
-    operative, facts = match.groups()
-    operative = _process(operative)
-    facts = _process(facts)
+def _parse_sections(text: str) -> Union[Sections, ParseFailure]:
+    """
+    Extracts the cleaned-up tenor and tatbestand from the text of a BGH Urteil, or
+    the reason why the text doesn't match the known pattern.
+    """
+    # Quick check if it's a BGH Urteil
+    if not URTEIL_PATTERN.match(text):
+        return ParseFailure.NOT_URTEIL
+
+    sections = _locate_sections(text)
+    if isinstance(sections, ParseFailure):
+        return sections
+
+    operative, facts = (_clean(section) for section in sections)
+
+    # Decide the hyphenation candidates of both sections in one batch
+    dehyphenator = _get_dehyphenator()
+    dehyphenator.prime([operative, facts])
+    return Sections(
+        operative=dehyphenator.fix(operative).strip(),
+        facts=dehyphenator.fix(facts).strip(),
+    )
+
 
+def _locate_sections(text: str) -> Union[Sections, ParseFailure]:
+    """
+    Slices the raw tenor and tatbestand from the text using the positions of the
+    section headings: the tenor follows "für Recht erkannt" and ends at "Von Rechts
+    wegen" or the "Tatbestand" heading, the tatbestand ends at the
+    "Entscheidungsgründe" heading.
+    """
+    tenor_start = tenor_end = facts_start = None
+    for match in SECTION_HEADING_PATTERN.finditer(text):
+        heading = match.lastgroup
+        if tenor_start is None:
+            if heading == "tenor":
+                tenor_start = match.end()
+        elif facts_start is None:
+            if heading == "von_rechts_wegen" and tenor_end is None:
+                tenor_end = match.start()
+            elif heading == "tatbestand":
+                tenor_end = match.start() if tenor_end is None else tenor_end
+                facts_start = match.end()
+        elif heading == "gruende":
+            return Sections(
+                operative=text[tenor_start:tenor_end],
+                facts=text[facts_start : match.start()],
+            )
+
+    if tenor_start is None:
+        return ParseFailure.MISSING_TENOR
+    if facts_start is None:
+        return ParseFailure.MISSING_TATBESTAND
+    return ParseFailure.MISSING_ENTSCHEIDUNGSGRUENDE
+
+
+def _to_document(doc_text: DocumentText, sections: Sections) -> DocumentParsed:
+    operative, facts = sections
     if not operative or not facts:
         raise ValueError(f"Empty tenor/tatbestand for {doc_text['id']}")
 
@@ -79,30 +169,45 @@ def _parse(doc_text: DocumentText) -> Optional[DocumentParsed]:
     )
 
 
-def _process(text: str) -> str:
+def _clean(text: str) -> str:
     """
-    Final cleanup for tenor/tatbestand: remove extraneous hyphens, strip whitespace, etc.
+    Cleanup for tenor/tatbestand before the hyphens are removed: normalize ellipses,
+    punctuation spacing and whitespace.
     """
-    text = re.sub(r"(\b)\.{3,}(\b)", "\1…\2", text)
-    text = re.sub(r"…[…\s]*…", r"…", text)
-    text = re.sub(r"\.[.\s]*\.", r".", text)
-    text = re.sub(r"\s+([.,;:!?)\]}/])", r"\1", text)
-    text = re.sub(r"([(\[{/])\s+", r"\1", text)
-
-    text = flatten_text(text)
-    text = LINE_BREAK_PATTERN.sub(_fix_linebreaks, text)
-
-    return text.strip()
-
-
-def _fix_linebreaks(match):
+    return flatten_text(CLEANUP_PATTERN.sub(_cleanup_replacement, text))
+
+
+def _cleanup_replacement(match: re.Match) -> str:
+    match match.lastgroup:
+        case "ellipsis":
+            # The former separate pass replaced with the non-raw string "\1…\2",
+            # i.e. the control characters \x01/\x02 instead of group references.
+            # Kept as is, so the parsed texts (and the generation cache keys
+            # derived from them) don't change.
+            return "\x01…\x02"
+        case "ellipses":
+            return "…"
+        case "dots":
+            return "."
+        case "space_before":
+            return ""
+        case "opening":
+            return match.group("opening")
+
+
+def _get_dehyphenator() -> Dehyphenator:
     """
-    Fixes line breaks in the text by checking the token shapes and conjunctions.
+    Return the dehyphenator of this process, loading the spaCy model on first use.
+    Worker processes get their own instance, as the lexicon connection can't be
+    shared across a fork.
     """
-    doc = NLP(match.group(0))
-    assert len(doc) == 2, "Expected two tokens in the doc."
-    if doc[1].pos_ == "CCONJ" or doc[1].text == "bzw":
-        return match.group(0)
-    elif doc[0].shape_.endswith("x-") and doc[1].shape_.startswith("x"):
-        return match.group(1) + match.group(2)
-    return match.group(0).replace(" ", "")
+    global _dehyphenator, _dehyphenator_pid
+    if _dehyphenator is None or _dehyphenator_pid != os.getpid():
+        _dehyphenator = Dehyphenator(
+            nlp.load(),
+            config.SPACY_MODEL,
+            lexicon_path=config.DEHYPHENATION_LEXICON,
+            exclude=config.SPACY_EXCLUDE,
+        )
+        _dehyphenator_pid = os.getpid()
+    return _dehyphenator
@@ -6,43 +6,78 @@ import asyncio
 import json
 import re
 import uuid
+from collections import defaultdict
 from itertools import count
-from typing import List
+from typing import Dict, Iterable, List, Optional
 
 from httpx import URL, AsyncClient
-from lxml import html
 from tqdm import tqdm
 
-from src.common import cached_request, config
+from src.common import cached_request, config, transport
 from src.common.types import ScrapingID
-from src.common.utils import flatten_text
+from src.common.utils import flatten_text, load_scraping_ids
 
 BASE_URL = URL("https://juris.bundesgerichtshof.de/cgi-bin/rechtsprechung/")
 BASE_PARAMS = "list.py?Gericht=bgh&Art=en&Datum={year}&Seite={page}"
 AKTENZEICHEN_PATTERN = re.compile(r"\w+\sZR\s\d+/\d+")
+NUMBER_PATTERN = re.compile(r"[?&]nr=(\d+)")
+# Listing pages per year requested ahead of the parser
+PREFETCH = 8
 
 
-async def scrape_ids() -> List[ScrapingID]:
+async def scrape_ids(
+    prefetch: int = PREFETCH, incremental: bool = False
+) -> List[ScrapingID]:
     """
     Main entry point to scrape multiple years (2005 through 2024) from BGH
     and save ScrapingID metadata into a JSONL file.
+
+    ``prefetch`` is the number of listing pages per year that are requested
+    ahead of the parser (see ``scrape_ids_for_year``).
+
+    With ``incremental=True`` the existing ``CASE_IDS_JSONL`` is used as a
+    high-water mark: listing pages are revalidated against the server and each
+    year stops paging at the first page that contains an already known document.
+    Documents are matched by their number (the ``nr`` parameter), since the
+    other parameters of their URLs shift as new decisions are listed. The
+    rescanned entries replace the known ones, keeping their IDs.
     """
-    # Adjust the timeout if you expect big delays or slow connections
-    sem = asyncio.Semaphore(10)
-    async with AsyncClient(timeout=60) as client:
-        with tqdm() as pbar:
-            # Create a list (generator would also work) of coroutines to scrape each year
-            tasks = [
-                scrape_ids_for_year(year, client, sem, pbar)
-                for year in range(2005, 2025)
-            ]
-            # Run scraping coroutines in parallel
-            results_per_year = await asyncio.gather(*tasks)
-
-    # Flatten the list of lists
-    all_results = [
-        scraping_id for sublist in results_per_year for scraping_id in sublist
-    ]
+    existing = (
+        load_scraping_ids() if incremental and config.CASE_IDS_JSONL.exists() else []
+    )
+    known = defaultdict(dict)
+    for scraping_id in existing:
+        known[scraping_id["year"]][document_number(scraping_id["url"])] = scraping_id
+    if incremental:
+        # Only the first page(s) of each year are expected to change, so
+        # speculative fetching would mostly produce wasted requests
+        prefetch = 1
+
+    # The shared client and its per-host rate controller limit the concurrency
+    client = transport.get_client()
+    with tqdm() as pbar:
+        # Create a list (generator would also work) of coroutines to scrape each year
+        tasks = [
+            scrape_ids_for_year(
+                year,
+                client,
+                None,
+                pbar,
+                prefetch=prefetch,
+                known=known[year] if incremental else None,
+            )
+            for year in range(2005, 2025)
+        ]
+        # Run scraping coroutines in parallel
+        results_per_year = await asyncio.gather(*tasks)
+
+    # Flatten the list of lists, keeping the known documents of each year that
+    # weren't rescanned after the scraped ones
+    all_results = []
+    for year, sublist in zip(range(2005, 2025), results_per_year):
+        if incremental:
+            sublist = _unique(sublist + list(known[year].values()))
+        all_results.extend(sublist)
 
     # Write out to a JSONL file
     content = "\n".join(json.dumps(r, default=lambda x: str(x)) for r in all_results)
@@ -53,11 +88,30 @@ async def scrape_ids() -> List[ScrapingID]:
 
 
 async def scrape_ids_for_year(
-    year: int, client: AsyncClient, sem: asyncio.Semaphore, pbar: tqdm
+    year: int,
+    client: AsyncClient,
+    sem: Optional[asyncio.Semaphore],
+    pbar: tqdm,
+    prefetch: int = PREFETCH,
+    known: Optional[Dict[str, ScrapingID]] = None,
 ) -> List[ScrapingID]:
     """
     Scrapes a single year's worth of case metadata from BGH website.
+
+    Listing pages are fetched speculatively: up to ``prefetch`` pages are kept in
+    flight ahead of the page currently being parsed. Once the last page is
+    detected from the ``pagelink`` hrefs, the outstanding requests past it are
+    cancelled, or discarded without caching them if they already completed.
+
+    If ``known`` (the known documents by number) is given, listing pages are
+    revalidated with the server and paging stops after the first page containing
+    a known document. The listings are ordered newest first, so everything after
+    that page has been scraped before. Known documents found on the scanned pages
+    keep their ID, with the URL of the current listing. As the listings may shift
+    while they are paged, a document listed twice is then only returned once.
     """
+    from lxml import html
+
     # This pattern checks for link URLs that match the exact format for the document pages.
     # Example: "document.py?Gericht=bgh&Art=en&Datum=2020&Seite=0&nr=1234&anz=12&pos=3"
     link_pattern = re.compile(
@@ -65,39 +119,95 @@ async def scrape_ids_for_year(
     )
 
     results = []
-
-    # We iterate over pages, starting from 0 until we no longer find the "next page" link.
-    for page in count(0):
-        # Construct the URL for this year/page.
-        url = BASE_URL.join(BASE_PARAMS.format(year=year, page=page))
-        content = await cached_request.get(url, client, sem=sem)
-        tree = html.fromstring(content)
-
-        # Extract all <a class="doklink"> elements and check if they match our link pattern
-        for a in tree.xpath("//a[@class='doklink']"):
-            href = a.get("href", "")
-            if href and link_pattern.match(href):
-                # Flatten the text (removes weird whitespace, newlines, etc.)
-                aktenzeichen = flatten_text(a.text)
-                if AKTENZEICHEN_PATTERN.fullmatch(aktenzeichen):
-                    # Add the parameter "Blank=1.pdf" to get direct PDF access
-                    doc_url = BASE_URL.join(href).copy_add_param("Blank", "1.pdf")
-                    results.append(
-                        ScrapingID(
-                            id=uuid.uuid5(uuid.NAMESPACE_URL, str(doc_url)),
-                            year=year,
-                            case_number=aktenzeichen,
-                            url=doc_url,
-                        )
+    seen = set()
+    pending: dict[int, asyncio.Task] = {}
+
+    def schedule(first_page: int):
+        # Keep the window [first_page, first_page + prefetch) in flight
+        for p in range(first_page, first_page + max(prefetch, 1)):
+            if p not in pending:
+                url = BASE_URL.join(BASE_PARAMS.format(year=year, page=p))
+                pending[p] = asyncio.create_task(
+                    cached_request.fetch(
+                        url, client, sem=sem, revalidate=known is not None
                     )
-                    pbar.update(1)
-            elif not href.endswith(".pdf"):
-                print(f"Unexpected link: {href}")
-
-        # Check if the next page link exists
-        page_links = tree.xpath("//a[@class='pagelink']/@href")
-        next_page_param = BASE_PARAMS.format(year=year, page=page + 1)
-        if next_page_param not in page_links:
-            break
+                )
+
+    try:
+        # We iterate over pages, starting from 0 until we no longer find the "next page" link.
+        for page in count(0):
+            schedule(page)
+            # Only pages that exist are cached, not the speculative ones past the end
+            fetched = await pending.pop(page)
+            fetched.commit()
+            content = fetched.content
+            tree = html.fromstring(content)
+            reached_known = False
+
+            # Extract all <a class="doklink"> elements and check if they match our link pattern
+            for a in tree.xpath("//a[@class='doklink']"):
+                href = a.get("href", "")
+                if href and link_pattern.match(href):
+                    # Flatten the text (removes weird whitespace, newlines, etc.)
+                    aktenzeichen = flatten_text(a.text)
+                    if AKTENZEICHEN_PATTERN.fullmatch(aktenzeichen):
+                        # Add the parameter "Blank=1.pdf" to get direct PDF access
+                        doc_url = BASE_URL.join(href).copy_add_param("Blank", "1.pdf")
+                        number = document_number(doc_url)
+                        if known is not None:
+                            if number in seen:
+                                continue
+                            seen.add(number)
+                        if known is not None and number in known:
+                            reached_known = True
+                            doc_id = known[number]["id"]
+                        else:
+                            doc_id = uuid.uuid5(uuid.NAMESPACE_URL, str(doc_url))
+                            pbar.update(1)
+                        results.append(
+                            ScrapingID(
+                                id=doc_id,
+                                year=year,
+                                case_number=aktenzeichen,
+                                url=doc_url,
+                            )
+                        )
+                elif not href.endswith(".pdf"):
+                    print(f"Unexpected link: {href}")
+
+            # In incremental mode, everything from here on has been scraped before
+            if reached_known:
+                break
+
+            # Check if the next page link exists
+            page_links = tree.xpath("//a[@class='pagelink']/@href")
+            next_page_param = BASE_PARAMS.format(year=year, page=page + 1)
+            if next_page_param not in page_links:
+                break
+    finally:
+        # Drop the speculative requests for pages past the last real page
+        for task in pending.values():
+            task.cancel()
+        await asyncio.gather(*pending.values(), return_exceptions=True)
 
     return results
+
+
+def document_number(url: URL) -> str:
+    """
+    The number of a document (the ``nr`` parameter of its URL), which, unlike the
+    page and position in the listing, doesn't change as new decisions are listed.
+    """
+    return NUMBER_PATTERN.search(str(url)).group(1)
+
+
+def _unique(scraping_ids: Iterable[ScrapingID]) -> List[ScrapingID]:
+    # Keep the first entry per document number
+    numbers = set()
+    unique = []
+    for scraping_id in scraping_ids:
+        number = document_number(scraping_id["url"])
+        if number not in numbers:
+            numbers.add(number)
+            unique.append(scraping_id)
+    return unique